@@ -6,15 +6,44 @@ import json
 import time
 import datetime
 import calendar
+import copy
 import hashlib
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from typing import Optional, Iterator
 
+import numpy as np
 import pandas as pd
 from ortools.sat.python import cp_model
 import locale
 
+from shift_model import (
+    CONSTRAINT_FAMILIES,
+    CONSTRAINT_MODE_LABELS,
+    DEFAULT_CONSTRAINT_MODES,
+    DEFAULT_SOLVER_SETTINGS,
+    OBJECTIVE_MODES,
+    SEQUENCE_ENGINES,
+    SOLVER_PRESETS,
+    VACANCY_POLICY_MAP,
+    VACANT_SHIFT,
+    WEEKDAYS_JP,
+    CalendarIndex,
+    RuleMasks,
+    ScheduleProblem,
+    StaffSettings,
+    build_staff_settings,
+    calendar_index,
+    compile_rules,
+    day_label,
+    parse_iso_date,
+    safe_int,
+    values_to_table,
+)
+from result_cache import ResultCache
+from solve_job import SolveJob
+from solve_pool import SolvePool
+
 
 
 try:
@@ -25,12 +54,6 @@ except locale.Error:
     except:
         pass
 
-try:
-    import jpholiday
-except Exception:
-    jpholiday = None
-
-
 # ----------------------------
 # Page Config & Google-like (Material-ish) CSS
 # ----------------------------
@@ -574,14 +597,6 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 USER_DATA_DIR = os.path.join(BASE_DIR, "user_data")
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 
-SOLVER_TIMEOUT = 300
-WEEKDAYS_JP = ["月", "火", "水", "木", "金", "土", "日"]
-VACANT_SHIFT = "空き"
-
-VACANCY_POLICY_MAP = {
-    "keep_blank": "空きがあったら、空きを表示する",
-    "assign_specific": "特定の担務や休日を付与する",
-}
 VACANCY_POLICY_CODES = list(VACANCY_POLICY_MAP.keys())
 VACANCY_POLICY_LABELS = list(VACANCY_POLICY_MAP.values())
 VACANCY_POLICY_REV = {v: k for k, v in VACANCY_POLICY_MAP.items()}
@@ -621,13 +636,28 @@ def df_to_json_dict(df: pd.DataFrame) -> dict:
     return json.loads(df.to_json(orient="split", force_ascii=False))
 
 
-def safe_int(v, default=0):
-    if pd.isna(v):
-        return default
-    try:
-        return int(v)
-    except Exception:
-        return default
+def result_column_dates(result_df: pd.DataFrame) -> list:
+    """結果表の日付列ごとの ISO 日付（スタッフ名の列は除く）。今の期間に無い列は None"""
+    cal = current_calendar()
+    cols = [c for c in result_df.columns if c != "スタッフ名"]
+    ids = [cal.day_index(c) if cal is not None else None for c in cols]
+    return [None if i is None else cal.iso[i] for i in ids]
+
+
+def saved_result_dates(data: dict, date_cols: list) -> list:
+    """保存データの結果列ごとの日付
+
+    「確定シフト日付」があればそれを使う。無い古いデータは保存時の期間（開始日〜終了日）のラベルから引く。
+    """
+    isos = data.get("確定シフト日付")
+    if isinstance(isos, list) and len(isos) == len(date_cols):
+        return [parse_iso_date(v) if v else None for v in isos]
+    start, end = parse_iso_date(data.get("開始日")), parse_iso_date(data.get("終了日"))
+    if start is None or end is None or end < start:
+        return [None] * len(date_cols)
+    cal = calendar_index(start, end)
+    ids = [cal.day_index(c) for c in date_cols]
+    return [None if i is None else cal.dates[i] for i in ids]
 
 
 def serialize_time(v):
@@ -638,18 +668,17 @@ def serialize_time(v):
 
 def compute_days(start: datetime.date, end: datetime.date):
     """days(list[str]), day_map(dict[str, date])"""
-    date_range = []
-    cur = start
-    while cur <= end:
-        date_range.append(cur)
-        cur += datetime.timedelta(days=1)
+    cal = calendar_index(start, end)
+    return list(cal.labels), dict(cal.day_map)
+
 
-    days = []
-    for d in date_range:
-        w = WEEKDAYS_JP[d.weekday()]
-        days.append(f"{d.month}/{d.day}({w})")
-    day_map = {d_str: d_obj for d_str, d_obj in zip(days, date_range)}
-    return days, day_map
+def current_calendar() -> CalendarIndex | None:
+    """設定中の計画期間の CalendarIndex（期間が未設定なら None）"""
+    start = st.session_state.get("start_date")
+    end = st.session_state.get("end_date")
+    if isinstance(start, datetime.date) and isinstance(end, datetime.date) and end >= start:
+        return calendar_index(start, end)
+    return None
 
 
 def badge_class_for_weekday(wd: str) -> str:
@@ -661,13 +690,9 @@ def badge_class_for_weekday(wd: str) -> str:
 
 
 def badge_class_for_daylabel(day_label: str) -> str:
-    if jpholiday and "day_map" in st.session_state:
-        d = st.session_state["day_map"].get(day_label)
-        try:
-            if d and jpholiday.is_holiday(d):
-                return "orange"
-        except:
-            pass
+    cal = current_calendar()
+    if cal is not None and cal.is_holiday(day_label):
+        return "orange"
     if "(土)" in day_label:
         return "blue"
     if "(日)" in day_label:
@@ -677,19 +702,13 @@ def badge_class_for_daylabel(day_label: str) -> str:
 
 def render_shift_table_html(df: pd.DataFrame, for_export: bool = False, highlight_vacant: bool = False) -> str:
     hol_types = st.session_state.get("holiday_types_list", [])
-    day_map = st.session_state.get("day_map", {})
+    cal = current_calendar()
 
     # HTMLテーブル構築（ヘッダーの色付けを確実にするため）
     th_list = []
     for col in df.columns:
         c_style = ""
-        is_holiday_flag = False
-        if jpholiday and col in day_map:
-            try:
-                if jpholiday.is_holiday(day_map[col]):
-                    is_holiday_flag = True
-            except:
-                pass
+        is_holiday_flag = cal is not None and cal.is_holiday(col)
 
         if "(土)" in str(col):
             c_style = "color: #1A73E8;"
@@ -802,42 +821,12 @@ def format_schedule_for_line(df: pd.DataFrame) -> str:
     return "\n".join(lines)
 
 
-def build_provisional_table(
-    days: list[str],
-    day_map: dict[str, datetime.date],
-    staff_df: pd.DataFrame,
-    hope_df: pd.DataFrame,
-    rules_df: pd.DataFrame,
-) -> pd.DataFrame:
-    staff_names = [
-        str(x).strip()
-        for x in staff_df.get("スタッフ名", pd.Series(dtype=str)).fillna("").tolist()
-        if str(x).strip()
-    ]
-    if rules_df is None or rules_df.empty:
-        rules_df = pd.DataFrame(columns=["スタッフ名", "曜日", "希望内容", "ルールタイプ"])
-
-    rows = []
-    for s in staff_names:
-        row = {"スタッフ名": s}
-        rules = rules_df[(rules_df["スタッフ名"] == s) & (rules_df["ルールタイプ"] == "固定")]
-        for d in days:
-            val = ""
-            if s in hope_df.index and d in hope_df.columns:
-                v = str(hope_df.at[s, d]).strip()
-                if v:
-                    val = v
-            if not val and not rules.empty and d in day_map:
-                wd = WEEKDAYS_JP[day_map[d].weekday()]
-                rule_row = rules[rules["曜日"] == wd]
-                if rule_row.empty:
-                    rule_row = rules[rules["曜日"] == "全日"]
-                if not rule_row.empty:
-                    val = str(rule_row.iloc[0]["希望内容"]).strip()
-            row[d] = val
-        rows.append(row)
-
-    return pd.DataFrame(rows, columns=["スタッフ名"] + days)
+def build_provisional_table(problem: ScheduleProblem) -> pd.DataFrame:
+    """希望シフト・固定ルールを反映した暫定表（希望 > 曜日指定の固定ルール > 全日の固定ルール）"""
+    labels = problem.rule_masks().fixed_labels
+    table = pd.DataFrame(labels, index=problem.staffs, columns=problem.days)
+    table.index.name = "スタッフ名"
+    return table.reset_index()
 
 
 def counter_input(
@@ -904,6 +893,9 @@ def create_save_json() -> str:
         "確定シフト結果": df_to_json_dict(st.session_state["last_result"])
         if st.session_state.get("last_result") is not None
         else {},
+        "確定シフト日付": st.session_state.get("last_result_dates") or result_column_dates(st.session_state["last_result"])
+        if st.session_state.get("last_result") is not None
+        else [],
         "開始日": st.session_state.get("start_date", datetime.date.today()).isoformat(),
         "終了日": st.session_state.get("end_date", datetime.date.today()).isoformat(),
         "充填用シフト": st.session_state.get("filler_shift_type", None),
@@ -917,6 +909,8 @@ def create_save_json() -> str:
         "共通ルール": st.session_state.get("global_rules", []),
         "休日順序ルール": st.session_state.get("holiday_order_rules", []),
         "祝日代休ルール": st.session_state.get("public_holiday_rules", {}),
+        "制約モード": st.session_state.get("constraint_modes", dict(DEFAULT_CONSTRAINT_MODES)),
+        "ソルバー設定": st.session_state.get("solver_settings", dict(DEFAULT_SOLVER_SETTINGS)),
     }
     return json.dumps(save_data, ensure_ascii=False, indent=2)
 
@@ -943,6 +937,8 @@ def load_state_from_dict(loaded: dict):
             ("共通ルール", "global_rules"),
             ("休日順序ルール", "holiday_order_rules"),
             ("祝日代休ルール", "public_holiday_rules"),
+            ("制約モード", "constraint_modes"),
+            ("ソルバー設定", "solver_settings"),
         ]:
             if key in loaded:
                 st.session_state[state_key] = loaded[key]
@@ -1014,13 +1010,19 @@ def load_state_from_dict(loaded: dict):
                 st.session_state["end_date"] = datetime.date.fromisoformat(loaded["終了日"])
             except Exception:
                 pass
+        # 読み込む表のラベルは保存時の期間のもの。年なしのラベルで保存された古いデータも
+        # set_period_days で今の形式に付け替えられるよう、年なしのラベル → 日付を控えておく
+        start, end = st.session_state.get("start_date"), st.session_state.get("end_date")
+        if isinstance(start, datetime.date) and isinstance(end, datetime.date) and end >= start:
+            dates = calendar_index(start, end).dates
+            st.session_state["day_map"] = {day_label(d): d for d in dates}
 
         if "スタッフ情報" in loaded:
             df = read_df_from_json(loaded["スタッフ情報"])
             if "スタッフ名" not in df.columns and "name" in df.columns:
                 df.rename(columns={"name": "スタッフ名"}, inplace=True)
             if "スタッフ名" in df.columns:
-                st.session_state["staff_df"] = df.reset_index(drop=True)
+                set_input_table("staff_df", df.reset_index(drop=True))
 
         for key, state_key in [
             ("日別必要人数", "req_df"),
@@ -1029,7 +1031,7 @@ def load_state_from_dict(loaded: dict):
             ("個別ルール", "individual_rules_df"),
         ]:
             if key in loaded:
-                st.session_state[state_key] = read_df_from_json(loaded[key])
+                set_input_table(state_key, read_df_from_json(loaded[key]))
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {e}")
 
@@ -1131,37 +1133,48 @@ def ensure_core_defaults():
             "comp_holiday_type": ""
         }
 
+    if "constraint_modes" not in st.session_state:
+        st.session_state["constraint_modes"] = dict(DEFAULT_CONSTRAINT_MODES)
+
+    if "solver_settings" not in st.session_state:
+        st.session_state["solver_settings"] = dict(DEFAULT_SOLVER_SETTINGS)
+
     if "prohibited_transitions" not in st.session_state:
         st.session_state["prohibited_transitions"] = []
 
     if "ng_pairs" not in st.session_state:
         st.session_state["ng_pairs"] = []
     if "individual_rules_df" not in st.session_state:
-        st.session_state["individual_rules_df"] = pd.DataFrame(columns=["スタッフ名", "曜日", "希望内容", "ルールタイプ"])
+        set_input_table("individual_rules_df", pd.DataFrame(columns=["スタッフ名", "曜日", "希望内容", "ルールタイプ"]))
     else:
-        df = st.session_state["individual_rules_df"].copy()
-        for c in ["スタッフ名", "曜日", "希望内容", "ルールタイプ"]:
-            if c not in df.columns:
+        df = st.session_state["individual_rules_df"]
+        missing = [c for c in ["スタッフ名", "曜日", "希望内容", "ルールタイプ"] if c not in df.columns]
+        # 空でない表で種別が全部未入力なら「固定」に（空の表は毎回ここに来るので除く）
+        untyped = "ルールタイプ" in df.columns and not df.empty and df["ルールタイプ"].isna().all()
+        if missing or untyped:
+            df = df.copy()
+            for c in missing:
                 df[c] = ""
-        if "ルールタイプ" in df.columns and df["ルールタイプ"].isna().all():
-            df["ルールタイプ"] = "固定"
-        st.session_state["individual_rules_df"] = df
+            if untyped:
+                df["ルールタイプ"] = "固定"
+            set_input_table("individual_rules_df", df)
 
     if "staff_df" not in st.session_state:
-        st.session_state["staff_df"] = pd.DataFrame(columns=["スタッフ名", "最大連勤数", "シフト開始前の連勤数", "シフト開始前の担務/休日"])
+        set_input_table("staff_df", pd.DataFrame(columns=["スタッフ名", "最大連勤数", "シフト開始前の連勤数", "シフト開始前の担務/休日"]))
 
     if "req_df" not in st.session_state:
-        st.session_state["req_df"] = pd.DataFrame()
+        set_input_table("req_df", pd.DataFrame())
 
     if "hope_df" not in st.session_state:
-        st.session_state["hope_df"] = pd.DataFrame()
+        set_input_table("hope_df", pd.DataFrame())
     if "req_by_weekday" not in st.session_state:
-        st.session_state["req_by_weekday"] = pd.DataFrame()
+        set_input_table("req_by_weekday", pd.DataFrame())
 
 
 def sync_staff_df_schema():
     """列が足りない分だけ追加。既存入力は維持。"""
-    df = st.session_state["staff_df"].copy()
+    current = st.session_state["staff_df"]
+    df = current.copy()
     if "スタッフ名" not in df.columns:
         df["スタッフ名"] = ""
     if "最大連勤数" not in df.columns:
@@ -1196,14 +1209,59 @@ def sync_staff_df_schema():
         if col_period not in df.columns:
             df[col_period] = "週"
 
-    st.session_state["staff_df"] = df.reset_index(drop=True)
+    df = df.reset_index(drop=True)
+    # 毎回差し替えると入力シグネチャの計算し直しになるので、列・行が変わったときだけ入れ替える
+    if list(df.columns) == list(current.columns) and df.index.equals(current.index):
+        return
+    set_input_table("staff_df", df)
+
+
+def set_period_days(days: list[str], day_map: dict):
+    """計画期間の日付ラベルを session に入れる
+
+    表（必要人数・希望・結果）は日付ラベルで持っているので、同じ日付のラベルが変わったとき
+    （期間が1年以上になって年付きのラベルになったときなど）は、sync_* で寄せる前に行・列名を付け替える。
+    """
+    old_map = st.session_state.get("day_map") or {}
+    new_labels = {d: label for label, d in day_map.items()}
+    renames = {
+        old: new_labels[d]
+        for old, d in old_map.items()
+        if d in new_labels and new_labels[d] != old
+    }
+    if renames:
+        migrate_day_labels(renames)
+    st.session_state["days_list"] = days
+    st.session_state["day_map"] = day_map
+
+
+def migrate_day_labels(renames: dict[str, str]):
+    """日付ラベルの付け替え（旧ラベル → 新ラベル）を、日付をキーに持つ入力・結果に反映する"""
+    req_df = st.session_state.get("req_df")
+    if isinstance(req_df, pd.DataFrame) and set(renames) & set(req_df.index):
+        set_input_table("req_df", req_df.rename(index=renames))
+    hope_df = st.session_state.get("hope_df")
+    if isinstance(hope_df, pd.DataFrame) and set(renames) & set(hope_df.columns):
+        set_input_table("hope_df", hope_df.rename(columns=renames))
+    result = st.session_state.get("last_result")
+    if isinstance(result, pd.DataFrame) and set(renames) & set(result.columns):
+        st.session_state["last_result"] = result.rename(columns=renames)
+    # 以前のデータの日付指定ルールはラベルで持っている
+    rules = st.session_state.get("global_rules", [])
+    if any(r.get("type") == "date" and r.get("value") in renames for r in rules):
+        st.session_state["global_rules"] = [
+            dict(r, value=renames[r["value"]]) if r.get("type") == "date" and r.get("value") in renames else r
+            for r in rules
+        ]
 
 
 def sync_req_df(days: list[str]):
     work_shifts = st.session_state.get("work_shifts_list", [])
-    req_df = st.session_state["req_df"].copy()
-    req_df = req_df.reindex(index=days, columns=work_shifts, fill_value=0)
-    st.session_state["req_df"] = req_df
+    current = st.session_state["req_df"]
+    if list(current.index) == list(days) and list(current.columns) == list(work_shifts):
+        return
+    req_df = current.reindex(index=days, columns=work_shifts, fill_value=0)
+    set_input_table("req_df", req_df)
 
 
 def sync_hope_df(days: list[str]):
@@ -1215,804 +1273,176 @@ def sync_hope_df(days: list[str]):
         if str(x).strip()
     ]
 
-    hope_df = st.session_state["hope_df"].copy()
-
-    for d in days:
-        if d not in hope_df.columns:
-            hope_df[d] = ""
-
-    for s in staff_names:
-        if s not in hope_df.index:
-            hope_df.loc[s] = ""
+    current = st.session_state["hope_df"]
+    if set(days) <= set(current.columns) and set(staff_names) <= set(current.index):
+        return
+    # 足りない日・スタッフは1回でまとめて足す（1列ずつ足すと表が断片化する）
+    missing_days = [d for d in dict.fromkeys(days) if d not in current.columns]
+    missing_staffs = [s for s in dict.fromkeys(staff_names) if s not in current.index]
+    hope_df = pd.concat([current, pd.DataFrame("", index=current.index, columns=missing_days)], axis=1)
+    hope_df = pd.concat([hope_df, pd.DataFrame("", index=missing_staffs, columns=hope_df.columns)])
 
-    st.session_state["hope_df"] = hope_df
+    set_input_table("hope_df", hope_df)
 
 
 # ----------------------------
 # Logic / Solver
 # ----------------------------
-def diagnose_infeasibility(days, day_map, work_shifts, holiday_types, shift_types):
-    """
-    解が見つからない場合に、制約を緩和して原因を特定する診断関数
+def build_schedule_problem(days, day_map, work_shifts, holiday_types, shift_types) -> ScheduleProblem:
+    """session_state から ScheduleProblem を組み立てる（Streamlit 側のアダプタ）"""
+    problem = ScheduleProblem(
+        days=days,
+        day_map=day_map,
+        work_shifts=work_shifts,
+        holiday_types=holiday_types,
+        shift_types=shift_types,
+        staff_df=st.session_state["staff_df"],
+        req_df=st.session_state["req_df"],
+        hope_df=st.session_state["hope_df"],
+        individual_rules_df=st.session_state.get("individual_rules_df", pd.DataFrame()),
+        work_shift_properties=st.session_state.get("work_shift_properties", []),
+        holiday_properties=st.session_state.get("holiday_properties", []),
+        global_rules=st.session_state.get("global_rules", []),
+        ng_pairs=st.session_state.get("ng_pairs", []),
+        prohibited_transitions=st.session_state.get("prohibited_transitions", []),
+        period_counts=st.session_state.get("period_counts", {}),
+        holiday_order_rules=st.session_state.get("holiday_order_rules", []),
+        public_holiday_rules=st.session_state.get("public_holiday_rules", {}),
+        max_consecutive_work=int(st.session_state.get("max_consecutive_work", 5)),
+        vacancy_policy=get_vacancy_policy(),
+        vacancy_fill_candidates=st.session_state.get("vacancy_fill_candidates", []),
+        vacancy_target_mode=st.session_state.get("vacancy_target_mode", "全員"),
+        vacancy_target_value=st.session_state.get("vacancy_target_value", ""),
+        constraint_modes=st.session_state.get("constraint_modes", dict(DEFAULT_CONSTRAINT_MODES)),
+    )
+    # スタッフ設定と希望・ルールの解釈は入力が変わったときだけやり直し、求解プロセスにもそのまま渡す
+    problem.compiled_staff = get_staff_settings(problem)
+    problem.compiled_rules = get_rule_masks(problem)
+    return problem
+
+
+def get_staff_settings(problem: ScheduleProblem) -> dict[str, StaffSettings]:
+    """build_staff_settings の結果を、staff_df の版（ハッシュ）と担務・休日の並びが同じあいだ使い回す"""
+    key = (table_signature("staff_df"), tuple(problem.work_shifts), tuple(problem.weekly_holiday_targets))
+    cached = st.session_state.get("staff_settings_cache")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    settings = build_staff_settings(problem)
+    st.session_state["staff_settings_cache"] = (key, settings)
+    return settings
+
+
+def get_rule_masks(problem: ScheduleProblem) -> RuleMasks:
+    """compile_rules の結果を、関係する入力の部品ハッシュが同じあいだ使い回す"""
+    parts = compute_input_components()
+    key = tuple(parts.get(k) for k in RULE_INPUT_COMPONENTS) + (tuple(problem.days),)
+    cached = st.session_state.get("rule_masks_cache")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    masks = compile_rules(problem)
+    st.session_state["rule_masks_cache"] = (key, masks)
+    return masks
+
+
+def start_solve_job(
+    problem: ScheduleProblem,
+    trigger: str,
+    reason: str = "",
+    cache_key: Optional[str] = None,
+    action: str = "full",
+    scope: Optional[dict] = None,
+) -> SolveJob:
+    """求解ジョブを裏で開始する。実行中のジョブがあれば中止して新しいジョブに置き換える
+
+    action / scope は classify_input_change / input_change_scope の結果（前回の結果をどこまで活かすか）。
     """
-    staff_df = st.session_state["staff_df"]
-    hope_df = st.session_state["hope_df"]
-    req_df = st.session_state["req_df"]
-    
-    ws_props = {p["名称"]: p for p in st.session_state.get("work_shift_properties", [])}
-    target_work_shifts = [ws for ws in work_shifts if ws_props.get(ws, {}).get("必要人数対象", True)]
-    
-    staffs_local = [n.strip() for n in staff_df["スタッフ名"].fillna("").astype(str).tolist() if str(n).strip()]
-    
-    staff_settings = {}
-    for _, row in staff_df.iterrows():
-        name = str(row.get("スタッフ名", "")).strip()
-        if not name: continue
-        able = [ws for ws in work_shifts if bool(row.get(ws, False))]
-        staff_settings[name] = {
-            "able_shifts": able,
-            "prev_consecutive_work": safe_int(row.get("シフト開始前の連勤数"), 0),
-            "max_consecutive_work": safe_int(row.get("最大連勤数"), 0),
-            "prev_shift_type": str(row.get("シフト開始前の担務/休日", "")).strip(),
-            "employment_type": str(row.get("雇用形態", "")).strip(),
-        }
-
-    model = cp_model.CpModel()
-    shift = {}
-    
-    # 変数定義
-    for s in staffs_local:
-        for d in days:
-            for t in shift_types:
-                shift[(s, d, t)] = model.NewBoolVar(f"shift_{s}_{d}_{t}")
-            model.Add(sum(shift[(s, d, t)] for t in shift_types) == 1)
-
-    # 可能なシフト（これは物理的な制約としてHardのままにする）
-    for d in days:
-        for s in staffs_local:
-            able = set(staff_settings.get(s, {}).get("able_shifts", []))
-            for ws in target_work_shifts:
-                if ws not in able:
-                    model.Add(shift[(s, d, ws)] == 0)
-
-    violation_vars = []
-    violation_msgs = []
-
-    # 1. 希望シフト（緩和可能にする）
-    for s in staffs_local:
-        if s in hope_df.index:
-            for d in days:
-                if d in hope_df.columns:
-                    val = str(hope_df.at[s, d]).strip()
-                    if not val: continue
-                    
-                    v_var = model.NewBoolVar(f"vio_hope_{s}_{d}")
-                    if val == "休み(全般)":
-                        model.Add(sum(shift[(s, d, t)] for t in holiday_types) == 1).OnlyEnforceIf(v_var.Not())
-                    elif val == "出勤(全般)":
-                        model.Add(sum(shift[(s, d, t)] for t in work_shifts) == 1).OnlyEnforceIf(v_var.Not())
-                    elif val in shift_types:
-                        model.Add(shift[(s, d, val)] == 1).OnlyEnforceIf(v_var.Not())
-                    
-                    violation_vars.append(v_var)
-                    violation_msgs.append(f"希望シフト: {s}さんの {d} ({val})")
-
-    # 2. 個別ルール（緩和可能にする）
-    rules_df = st.session_state.get("individual_rules_df", pd.DataFrame())
-    if not rules_df.empty:
-        for i, row in rules_df.iterrows():
-            s = str(row.get("スタッフ名", "")).strip()
-            dow = str(row.get("曜日", "")).strip()
-            target = str(row.get("希望内容", "")).strip()
-            rule_type = str(row.get("ルールタイプ", "固定")).strip()
-            if s not in staffs_local: continue
-            
-            if dow == "全日": target_days = list(days)
-            elif dow in WEEKDAYS_JP:
-                idx = WEEKDAYS_JP.index(dow)
-                target_days = [dd for dd in days if day_map[dd].weekday() == idx]
-            else: target_days = []
-
-            for dd in target_days:
-                v_var = model.NewBoolVar(f"vio_rule_{s}_{dd}_{i}")
-                if rule_type == "固定":
-                    if target == "休み(全般)":
-                        model.Add(sum(shift[(s, dd, t)] for t in holiday_types) == 1).OnlyEnforceIf(v_var.Not())
-                    elif target == "出勤(全般)": model.Add(sum(shift[(s, dd, t)] for t in work_shifts) == 1).OnlyEnforceIf(v_var.Not())
-                    elif target in shift_types: model.Add(shift[(s, dd, target)] == 1).OnlyEnforceIf(v_var.Not())
-                elif rule_type == "不可":
-                    if target == "休み(全般)": model.Add(sum(shift[(s, dd, t)] for t in holiday_types) == 0).OnlyEnforceIf(v_var.Not())
-                    elif target == "出勤(全般)": model.Add(sum(shift[(s, dd, t)] for t in work_shifts) == 0).OnlyEnforceIf(v_var.Not())
-                    elif target in shift_types: model.Add(shift[(s, dd, target)] == 0).OnlyEnforceIf(v_var.Not())
-                
-                violation_vars.append(v_var)
-                violation_msgs.append(f"ルール: {s}さんの {dow}曜 {target} ({dd})")
-
-    # 3. NGペア（緩和可能にする）
-    for pair in st.session_state.get("ng_pairs", []):
-        s1, s2 = pair.get("スタッフA"), pair.get("スタッフB")
-        if s1 in staffs_local and s2 in staffs_local and s1 != s2:
-            for d in days:
-                v_var = model.NewBoolVar(f"vio_ng_{s1}_{s2}_{d}")
-                model.Add(
-                    sum(shift[(s1, d, ws)] for ws in work_shifts)
-                    + sum(shift[(s2, d, ws)] for ws in work_shifts)
-                    <= 1
-                ).OnlyEnforceIf(v_var.Not())
-                violation_vars.append(v_var)
-                violation_msgs.append(f"NGペア: {s1}さんと{s2}さん ({d})")
-
-    # 4. 連勤制限（緩和可能にする）
-    global_max = int(st.session_state.get("max_consecutive_work", 5))
-    for s in staffs_local:
-        s_max = int(staff_settings[s].get("max_consecutive_work", 0))
-        max_cons = s_max if s_max > 0 else global_max
-        window_len = max_cons + 1
-        
-        # 開始前の連勤考慮
-        prev_work = int(staff_settings[s].get("prev_consecutive_work", 0))
-        if prev_work > 0:
-            limit = window_len - prev_work
-            if 0 < limit <= len(days):
-                slack = model.NewIntVar(0, limit, f"slack_prev_{s}")
-                model.Add(sum(shift[(s, d, t)] for d in days[:limit] for t in work_shifts) <= limit - 1 + slack)
-                violation_vars.append(slack)
-                violation_msgs.append(f"連勤制限: {s}さんの月初の連勤")
-
-        # 期間中の連勤
-        for i in range(len(days) - max_cons):
-            slack = model.NewIntVar(0, window_len, f"slack_cons_{s}_{i}")
-            model.Add(sum(shift[(s, d, t)] for d in days[i : i + window_len] for t in work_shifts) <= max_cons + slack)
-            violation_vars.append(slack)
-            violation_msgs.append(f"連勤制限: {s}さんの {days[i]} からの連勤")
-
-    # 5. 募集なしシフト（req=0）への割り当て（緩和可能にする）
-    # run_optimizationでは req=0 はHard制約のため、これが原因で解なしになる可能性がある
-    for d in days:
-        for ws in target_work_shifts:
-            req = int(req_df.at[d, ws]) if (d in req_df.index and ws in req_df.columns) else 0
-            if req == 0:
-                # 募集0なのに誰かが割り当てられているかチェック
-                count_var = model.NewIntVar(0, len(staffs_local), f"diag_req0_{d}_{ws}")
-                model.Add(sum(shift[(s, d, ws)] for s in staffs_local) == count_var)
-                v_var = model.NewBoolVar(f"vio_req0_{d}_{ws}")
-                model.Add(count_var == 0).OnlyEnforceIf(v_var.Not())
-                violation_vars.append(v_var)
-                violation_msgs.append(f"募集なしシフト: {d} の {ws} (目標配置数0)")
-
-    # 6. 禁止シフト遷移（緩和可能にする）
-    prohibited_transitions = st.session_state.get("prohibited_transitions", [])
-    for s in staffs_local:
-        # 月初の「前日→初日」も禁止遷移に含める
-        prev_shift_type = staff_settings.get(s, {}).get("prev_shift_type", "")
-        if prev_shift_type:
-            for p in prohibited_transitions:
-                prev_s = p["prev"]
-                next_s = p["next"]
-                if prev_s == prev_shift_type and next_s in shift_types and days:
-                    v_var = model.NewBoolVar(f"vio_trans_prev_{s}_{next_s}")
-                    model.Add(shift[(s, days[0], next_s)] == 0).OnlyEnforceIf(v_var.Not())
-                    violation_vars.append(v_var)
-                    violation_msgs.append(f"禁止遷移: {s}さんの 前日({prev_s})→{days[0]}({next_s})")
-        for i in range(len(days) - 1):
-            d_curr = days[i]
-            d_next = days[i+1]
-            for p in prohibited_transitions:
-                prev_s = p["prev"]
-                next_s = p["next"]
-                if prev_s in shift_types and next_s in shift_types:
-                    v_var = model.NewBoolVar(f"vio_trans_{s}_{d_curr}_{prev_s}_{next_s}")
-                    model.Add(shift[(s, d_curr, prev_s)] + shift[(s, d_next, next_s)] <= 1).OnlyEnforceIf(v_var.Not())
-                    violation_vars.append(v_var)
-                    violation_msgs.append(f"禁止遷移: {s}さんの {d_curr}({prev_s})→{d_next}({next_s})")
-
-    # 違反の総数を最小化
-    model.Minimize(sum(violation_vars))
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = 300.0
-    status = solver.Solve(model)
-
-    results = []
-    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
-        for var, msg in zip(violation_vars, violation_msgs):
-            if solver.Value(var) > 0:
-                results.append(f"・{msg} が原因で作成できません（他のルールと矛盾）。")
-    return results
-
-def run_optimization(days, day_map, work_shifts, holiday_types, shift_types):
-    staff_df = st.session_state["staff_df"]
-    req_df = st.session_state["req_df"]
-    hope_df = st.session_state["hope_df"]
-
-    ws_props = {p["名称"]: p for p in st.session_state.get("work_shift_properties", [])}
-    target_work_shifts = [ws for ws in work_shifts if ws_props.get(ws, {}).get("必要人数対象", True)]
-
-    staffs_local = [n.strip() for n in staff_df["スタッフ名"].fillna("").astype(str).tolist() if str(n).strip()]
-    if not staffs_local:
-        st.error("スタッフが登録されていません。")
-        return None, []
-
-    weekly_holiday_targets = [x["名称"] for x in st.session_state.get("holiday_properties", []) if x.get("週回数固定設定") and x.get("名称") in holiday_types]
-    free_holiday_targets = [x["名称"] for x in st.session_state.get("holiday_properties", []) if not x.get("週回数固定設定") and x.get("名称") in holiday_types]
-
-    staff_settings = {}
-    for _, row in staff_df.iterrows():
-        name = str(row.get("スタッフ名", "")).strip()
-        if not name:
-            continue
-        able = [ws for ws in work_shifts if bool(row.get(ws, False))]
-        holiday_counts_week = {h: safe_int(row.get(f"週の{h}日数"), 1) for h in weekly_holiday_targets}
-        holiday_counts_month = {h: safe_int(row.get(f"月の{h}日数"), 4) for h in weekly_holiday_targets}
-        holiday_periods = {
-            h: (str(row.get(f"{h}日数対象", "週")).strip() or "週")
-            for h in weekly_holiday_targets
-        }
-        shift_preferences = {
-            ws: (str(row.get(f"{ws}希望度", "中")).strip() or "中")
-            for ws in work_shifts
-        }
-        staff_settings[name] = {
-            "able_shifts": able,
-            "holiday_counts_week": holiday_counts_week,
-            "holiday_counts_month": holiday_counts_month,
-            "holiday_periods": holiday_periods,
-            "shift_preferences": shift_preferences,
-            "prev_consecutive_work": safe_int(row.get("シフト開始前の連勤数"), 0),
-            "max_consecutive_work": safe_int(row.get("最大連勤数"), 0),
-            "prev_shift_type": str(row.get("シフト開始前の担務/休日", "")).strip(),
-        }
-
-    debug_messages = []
-    # 事前チェック: 必要人数 vs 可能なスタッフ数
-    for d in days:
-        for ws in target_work_shifts:
-            req = int(req_df.at[d, ws]) if (d in req_df.index and ws in req_df.columns) else 0
-            if req > 0:
-                capable = 0
-                for s in staffs_local:
-                    # 1. 可能なシフトに含まれているか
-                    if ws not in staff_settings[s]["able_shifts"]:
-                        continue
-                    # 2. 希望シフトで休みや別の勤務になっていないか
-                    if s in hope_df.index and d in hope_df.columns:
-                        val = str(hope_df.at[s, d]).strip()
-                        if val == "休み(全般)" or val in holiday_types:
-                            continue
-                        if val in work_shifts and val != ws:
-                            continue
-                    capable += 1
-                if req > capable:
-                    debug_messages.append(f"・{d} の「{ws}」: 目標 {req}名 に対し、勤務可能なスタッフが {capable}名 しかいません。")
+    cancel_solve_job()
+    solver_settings = {**DEFAULT_SOLVER_SETTINGS, **st.session_state.get("solver_settings", {})}
+    solver_settings["resolve_action"] = action
+    solver_settings["repair_scope"] = scope
+    # 前回の結果の点数。「確認だけ」で済ませてよいか（点数が下がっていないか）の判定に使う
+    solver_settings["previous_score"] = (st.session_state.get("last_solve_stats") or {}).get("score")
+    job = SolveJob(
+        problem,
+        solver_settings,
+        previous_result=st.session_state.get("last_result"),
+        trigger=trigger,
+        reason=reason,
+        cache_key=cache_key,
+        pool=get_solve_pool(),
+    )
+    st.session_state["solve_job"] = job
+    job.start()
+    return job
 
-    model = cp_model.CpModel()
-    shift = {}
-    obj_terms = []
 
-    for s in staffs_local:
-        for d in days:
-            for t in shift_types:
-                shift[(s, d, t)] = model.NewBoolVar(f"shift_{s}_{d}_{t}")
-            model.Add(sum(shift[(s, d, t)] for t in shift_types) == 1)
+def cancel_solve_job():
+    """実行中のジョブを中止して手放す（結果は使わない）"""
+    job = st.session_state.pop("solve_job", None)
+    if job is not None and not job.done:
+        job.cancel()
 
-    for d in days:
-        for ws in target_work_shifts:
-            req = int(req_df.at[d, ws]) if (d in req_df.index and ws in req_df.columns) else 0
-            model.Add(sum(shift[(s, d, ws)] for s in staffs_local) == req)
-            
-            # 必要人数をソフト制約に変更（解なし回避のため）
-            actual_var = model.NewIntVar(0, len(staffs_local), f"count_{d}_{ws}")
-            model.Add(sum(shift[(s, d, ws)] for s in staffs_local) == actual_var)
-
-            if req > 0:
-                diff = model.NewIntVar(-len(staffs_local), len(staffs_local), f"diff_{d}_{ws}")
-                model.Add(diff == actual_var - req)
-                abs_diff = model.NewIntVar(0, len(staffs_local), f"abs_diff_{d}_{ws}")
-                model.AddAbsEquality(abs_diff, diff)
-                # 人数不足・過剰は大きなペナルティ
-                obj_terms.append(abs_diff * -10000)
-            else:
-                # 必要人数0なら0人で固定（ここは厳守）
-                model.Add(actual_var == 0)
 
-    for d in days:
-        for s in staffs_local:
-            able = set(staff_settings.get(s, {}).get("able_shifts", []))
-            for ws in target_work_shifts:
-                if ws not in able:
-                    model.Add(shift[(s, d, ws)] == 0)
-
-            hope_val = ""
-            if s in hope_df.index and d in hope_df.columns:
-                hope_val = str(hope_df.at[s, d])
-
-            if hope_val == "休み(全般)":
-                model.Add(sum(shift[(s, d, t)] for t in holiday_types) == 1)
-            elif hope_val == "出勤(全般)":
-                model.Add(sum(shift[(s, d, t)] for t in work_shifts) == 1)
-            elif hope_val in shift_types:
-                model.Add(shift[(s, d, hope_val)] == 1)
-
-    rules_df = st.session_state.get("individual_rules_df", pd.DataFrame())
-    if not rules_df.empty:
-        for _, row in rules_df.iterrows():
-            s = str(row.get("スタッフ名", "")).strip()
-            dow = str(row.get("曜日", "")).strip()
-            target = str(row.get("希望内容", "")).strip()
-            rule_type = str(row.get("ルールタイプ", "固定")).strip()
-            if not s or s not in staffs_local or not dow or not target:
-                continue
-
-            if dow == "全日":
-                target_days = list(days)
-            elif dow in WEEKDAYS_JP:
-                idx = WEEKDAYS_JP.index(dow)
-                target_days = [dd for dd in days if day_map[dd].weekday() == idx]
-            else:
-                continue
+def df_to_signature(df: Optional[pd.DataFrame]) -> str:
+    if df is None:
+        return ""
+    try:
+        return df.fillna("").to_json(orient="split", date_format="iso")
+    except Exception:
+        return ""
 
-            for dd in target_days:
-                if rule_type == "固定":
-                    if target == "休み(全般)":
-                        model.Add(sum(shift[(s, dd, t)] for t in holiday_types) == 1)
-                    elif target == "出勤(全般)":
-                        model.Add(sum(shift[(s, dd, t)] for t in work_shifts) == 1)
-                    elif target in shift_types:
-                        model.Add(shift[(s, dd, target)] == 1)
-                elif rule_type == "不可":
-                    if target == "休み(全般)":
-                        model.Add(sum(shift[(s, dd, t)] for t in holiday_types) == 0)
-                    elif target == "出勤(全般)":
-                        model.Add(sum(shift[(s, dd, t)] for t in work_shifts) == 0)
-                    elif target in shift_types:
-                        model.Add(shift[(s, dd, target)] == 0)
-
-    # 共通ルール（Global Rules）
-    # スタッフごとの雇用形態を取得
-    staff_emp_map = {}
-    if "雇用形態" in staff_df.columns:
-        for _, row in staff_df.iterrows():
-            nm = str(row.get("スタッフ名", "")).strip()
-            em = str(row.get("雇用形態", "")).strip()
-            if nm:
-                staff_emp_map[nm] = em
-
-    global_rules = st.session_state.get("global_rules", [])
-    for rule in global_rules:
-        r_type = rule.get("type")
-        r_val = rule.get("value")
-        r_shift = rule.get("shift")
-        r_act = rule.get("action")
-        r_emp = rule.get("employment_type")
-
-        if not r_shift or r_shift not in shift_types:
-            continue
-
-        target_days = []
-        if r_type == "dow" and r_val in WEEKDAYS_JP:
-            idx = WEEKDAYS_JP.index(r_val)
-            target_days = [d for d in days if day_map[d].weekday() == idx]
-        elif r_type == "date" and r_val in days:
-            target_days = [r_val]
-
-        for d in target_days:
-            for s in staffs_local:
-                # 雇用形態によるフィルタリング
-                if r_emp and r_emp != "指定なし(全員)":
-                    s_emp = staff_emp_map.get(s, "")
-                    if s_emp != r_emp:
-                        continue
 
-                if r_act == "禁止":
-                    model.Add(shift[(s, d, r_shift)] == 0)
-                elif r_act == "固定":
-                    model.Add(shift[(s, d, r_shift)] == 1)
-                elif r_act == "休日ならこれのみ":
-                    # 指定されたシフト以外の全ての休日を禁止
-                    for h in holiday_types:
-                        if h != r_shift:
-                            model.Add(shift[(s, d, h)] == 0)
-                elif r_act.startswith("優先"):
-                    # 優先設定（ソフト制約）
-                    weight = 0
-                    if "高" in r_act:
-                        weight = 100
-                    elif "中" in r_act:
-                        weight = 50
-                    elif "低" in r_act:
-                        weight = 10
-                    
-                    if weight > 0:
-                        obj_terms.append(shift[(s, d, r_shift)] * weight)
+# 入力シグネチャのうち直列化が重い表。中身を書き換えたら set_input_table / bump_input_version で版を上げる
+INPUT_TABLE_KEYS = ("staff_df", "hope_df", "req_df", "individual_rules_df", "req_by_weekday")
+# compile_rules の結果が変わりうる部品（ほかの部品が変わっても作り直さない）
+RULE_INPUT_COMPONENTS = (
+    "staff_df",
+    "hope_df",
+    "individual_rules_df",
+    "global_rules",
+    "work_shifts_list",
+    "holiday_types_list",
+    "work_shift_properties",
+    "holiday_properties",
+)
 
-    for pair in st.session_state.get("ng_pairs", []):
-        s1, s2 = pair.get("スタッフA"), pair.get("スタッフB")
-        p_type = pair.get("type", "絶対NG")
-        
-        if s1 in staffs_local and s2 in staffs_local and s1 != s2:
-            for d in days:
-                term_a = sum(shift[(s1, d, ws)] for ws in work_shifts)
-                term_b = sum(shift[(s2, d, ws)] for ws in work_shifts)
-                
-                if p_type == "できるだけNG":
-                     # Penalty if both work: term_a + term_b <= 1 + both_flg
-                     both_flg = model.NewBoolVar(f"both_{s1}_{s2}_{d}")
-                     model.Add(term_a + term_b <= 1 + both_flg)
-                     obj_terms.append(both_flg * -100)
-                else:
-                    # Absolute NG (Hard Constraint)
-                    model.Add(term_a + term_b <= 1)
-
-    prohibited_transitions = st.session_state.get("prohibited_transitions", [])
-    for s in staffs_local:
-        # 月初の「前日→初日」も禁止遷移に含める
-        prev_shift_type = staff_settings.get(s, {}).get("prev_shift_type", "")
-        if prev_shift_type:
-            for p in prohibited_transitions:
-                prev_s = p["prev"]
-                next_s = p["next"]
-                if prev_s == prev_shift_type and next_s in shift_types and days:
-                    model.Add(shift[(s, days[0], next_s)] == 0)
-        for i in range(len(days) - 1):
-            d_curr = days[i]
-            d_next = days[i+1]
-            for p in prohibited_transitions:
-                prev_s = p["prev"]
-                next_s = p["next"]
-                if prev_s in shift_types and next_s in shift_types:
-                    model.Add(shift[(s, d_curr, prev_s)] + shift[(s, d_next, next_s)] <= 1)
-
-    # 期間内の回数指定（Hard制約）
-    # ただし、希望シフトで指定された回数が設定値を上回る場合は、希望シフトの回数を優先（適用）する
-    period_counts = st.session_state.get("period_counts", {})
-    for s in staffs_local:
-        if s in period_counts:
-            for t_type, count in period_counts[s].items():
-                if t_type in shift_types:
-                    # 希望シフトでの指定回数をカウント
-                    hope_count = 0
-                    if s in hope_df.index:
-                        for d in days:
-                            if d in hope_df.columns:
-                                val = str(hope_df.at[s, d]).strip()
-                                if val == t_type:
-                                    hope_count += 1
-                    
-                    # 設定値と希望数の大きい方を採用
-                    target_count = max(int(count), hope_count)
-                    model.Add(sum(shift[(s, d, t_type)] for d in days) == target_count)
-
-    global_max = int(st.session_state.get("max_consecutive_work", 5))
-    for s in staffs_local:
-        s_max = int(staff_settings[s].get("max_consecutive_work", 0))
-        max_cons = s_max if s_max > 0 else global_max
-        window_len = max_cons + 1
-
-        prev_work = int(staff_settings[s].get("prev_consecutive_work", 0))
-        if prev_work > 0:
-            limit = window_len - prev_work
-            if 0 < limit <= len(days):
-                model.Add(sum(shift[(s, d, t)] for d in days[:limit] for t in work_shifts) <= limit - 1)
-
-        for i in range(len(days) - max_cons):
-            model.Add(sum(shift[(s, d, t)] for d in days[i : i + window_len] for t in work_shifts) <= max_cons)
-
-    weeks = {}
-    for d_str in days:
-        d_obj = day_map[d_str]
-        sunday = d_obj - datetime.timedelta(days=(d_obj.weekday() + 1) % 7)
-        weeks.setdefault(sunday, []).append(d_str)
-
-    weekly_holiday_targets = [x["名称"] for x in st.session_state.get("holiday_properties", []) if x.get("週回数固定設定") and x.get("名称") in holiday_types]
-    for s in staffs_local:
-        for w_days in weeks.values():
-            for h in weekly_holiday_targets:
-                if staff_settings[s]["holiday_periods"].get(h, "週") != "週":
-                    continue
-                req_count = int(staff_settings[s]["holiday_counts_week"].get(h, 0))
-                actual_sum = sum(shift[(s, d, h)] for d in w_days)
-
-                if len(w_days) == 7:
-                    model.Add(sum(shift[(s, d, h)] for d in w_days) == req_count)
-                    # 週回数指定をソフト制約に変更（解なしエラーを防ぐため）
-                    # 違反した場合は大きなペナルティを与える
-                    actual_var = model.NewIntVar(0, 7, f"act_{s}_{h}_{w_days[0]}")
-                    model.Add(actual_var == actual_sum)
-                    diff_var = model.NewIntVar(-7, 7, f"diff_raw_{s}_{h}_{w_days[0]}")
-                    model.Add(diff_var == actual_var - req_count)
-                    abs_diff = model.NewIntVar(0, 7, f"abs_diff_{s}_{h}_{w_days[0]}")
-                    model.AddAbsEquality(abs_diff, diff_var)
-                    obj_terms.append(abs_diff * -1000)
-                else:
-                    model.Add(sum(shift[(s, d, h)] for d in w_days) <= req_count)
-                    # 半端な期間もソフト制約に変更
-                    # req_countを超えた分だけペナルティ
-                    actual_var = model.NewIntVar(0, 7, f"act_{s}_{h}_{w_days[0]}")
-                    model.Add(sum(shift[(s, d, h)] for d in w_days) == actual_var)
-                    
-                    excess = model.NewIntVar(0, 7, f"excess_{s}_{h}_{w_days[0]}")
-                    model.Add(excess >= actual_var - req_count)
-                    obj_terms.append(excess * -1000)
-
-    # Monthly holiday count constraints (soft)
-    months = {}
-    for d_str in days:
-        d_obj = day_map[d_str]
-        months.setdefault((d_obj.year, d_obj.month), []).append(d_str)
-
-    for s in staffs_local:
-        for (y, m), m_days in months.items():
-            days_in_month = calendar.monthrange(y, m)[1]
-            for h in weekly_holiday_targets:
-                if staff_settings[s]["holiday_periods"].get(h, "週") != "月":
-                    continue
-                req_count = int(staff_settings[s]["holiday_counts_month"].get(h, 0))
-                actual_sum = sum(shift[(s, d, h)] for d in m_days)
-
-                # Soft constraint only: allow any count, penalize deviation from target.
-                actual_var = model.NewIntVar(0, len(m_days), f"act_m_{s}_{h}_{y}_{m}")
-                model.Add(actual_var == actual_sum)
-                diff_var = model.NewIntVar(-len(m_days), len(m_days), f"diff_m_{s}_{h}_{y}_{m}")
-                model.Add(diff_var == actual_var - req_count)
-                abs_diff = model.NewIntVar(0, len(m_days), f"abs_m_{s}_{h}_{y}_{m}")
-                model.AddAbsEquality(abs_diff, diff_var)
-                obj_terms.append(abs_diff * -500)
-
-    # --- 休日順序ルール (Holiday Order Rules) ---
-    # 週単位で「Pre」が「Post」より先（または同時）でなければならない
-    # => 「Post」が「Pre」より先にあることを禁止
-    # つまり、同じ週内で 日付 d1 < d2 のとき、
-    # shift[s, d1, Post] == 1 かつ shift[s, d2, Pre] == 1 は禁止 (sum <= 1)
-    holiday_orders = st.session_state.get("holiday_order_rules", [])
-    if holiday_orders:
-        for s in staffs_local:
-            for w_days in weeks.values():
-                # w_days は文字列リストだが、順序は保証されている前提 (compute_daysでソート済)
-                #念のためインデックスでループ
-                n_days = len(w_days)
-                if n_days < 2:
-                    continue
-                
-                for rule in holiday_orders:
-                    pre = rule.get("pre")
-                    post = rule.get("post")
-                    
-                    if pre not in shift_types or post not in shift_types:
-                        continue
-                    
-                    # 全ての日付ペア (i, j) i < j についてチェック
-                    for i in range(n_days):
-                        for j in range(i + 1, n_days):
-                            d_early = w_days[i]
-                            d_late = w_days[j]
-                            
-                            # 「早い日(i)にPost」かつ「遅い日(j)にPre」を禁止
-                            model.Add(shift[(s, d_early, post)] + shift[(s, d_late, pre)] <= 1)
-
-    # --- 祝日・代休ルール ---
-    ph_rules = st.session_state.get("public_holiday_rules", {})
-    if ph_rules.get("enabled", False) and jpholiday:
-        target_emps = ph_rules.get("target_employments", [])
-        comp_type = ph_rules.get("comp_holiday_type", "")
-        
-        # 期間内の祝日を取得
-        public_holidays = [d for d in days if jpholiday.is_holiday(day_map[d])]
-        
-        if comp_type in shift_types and public_holidays:
-            # Pre-calculate work var for each day if it is a PH for easier access
-            # This is done per staff inside the loop
-            pass
-
-            for s in staffs_local:
-                # 雇用形態チェック
-                s_emp = staff_emp_map.get(s, "")
-                if target_emps and s_emp not in target_emps:
-                    continue
-                
-                # 累積変数
-                current_work_cum = 0
-                current_comp_cum = 0
-
-                for d in days:
-                    # 1. 祝日勤務の加算
-                    if d in public_holidays:
-                        # 全ての勤務シフトについて和をとる (Work Shiftであればカウント)
-                        current_work_cum += sum(shift[(s, d, w)] for w in work_shifts)
-                    
-                    # 2. 代休取得の加算
-                    current_comp_cum += shift[(s, d, comp_type)]
-                    
-                    # 3. 制約: 累積代休数 <= 累積祝日勤務数
-                    # これにより「先取り」を禁止し、「後から（または同時）」のみ許可
-                    # ※同時はシフト排他制御により不可なので、実質「後から」になる
-                    model.Add(current_comp_cum <= current_work_cum)
-                
-                # 4. 期間終了時に精算完了していること (Total Equality)
-                model.Add(current_comp_cum == current_work_cum)
-
-    filler_shift = st.session_state.get("filler_shift_type")
-    vacancy_policy = get_vacancy_policy()
-    vacancy_candidates = st.session_state.get("vacancy_fill_candidates", [])
-    pref_weights = {"低": -1.0, "中": 0.0, "高": 1.0}
-
-    def priority_weight(idx: int, base: float, step: float, min_w: float) -> float:
-        return max(min_w, base - (idx * step))
-
-    vacant_weight = 0.02
-    if vacancy_policy == VACANCY_POLICY_MAP["keep_blank"]:
-        vacant_weight = 0.2
-    elif vacancy_policy == VACANCY_POLICY_MAP["assign_specific"]:
-        # 空きは最終手段にしたいのでマイナス寄りにする
-        vacant_weight = -0.02
-    
-    for s in staffs_local:
-        for d in days:
-            # 0. シフト希望度（なるべく少なめ/多め）
-            for ws in work_shifts:
-                pref = staff_settings[s]["shift_preferences"].get(ws, "普通")
-                w = pref_weights.get(pref, 0.0)
-                if w != 0.0:
-                    obj_terms.append(shift[(s, d, ws)] * w)
-
-            # 1. 空き対応の方針に応じた補完
-            # スタッフごとの適用判断
-            apply_specific = False
-            current_vacant_weight = vacant_weight
-
-            if vacancy_policy == VACANCY_POLICY_MAP["assign_specific"]:
-                target_mode = st.session_state.get("vacancy_target_mode", "全員")
-                target_val = st.session_state.get("vacancy_target_value", "")
-                
-                if target_mode == "全員":
-                    apply_specific = True
-                elif target_mode == "雇用形態":
-                    s_emp = staff_settings[s].get("employment_type", "")
-                    if s_emp == target_val:
-                        apply_specific = True
-                elif target_mode == "スタッフ":
-                    if s == target_val:
-                        apply_specific = True
-                
-                # 対象外の場合はデフォルトの「空きにする(keep_blank)」挙動（vacant_weight=0.2）に戻す
-                if not apply_specific:
-                    current_vacant_weight = 0.2 # keep_blank default
 
-            if VACANT_SHIFT in shift_types and current_vacant_weight > 0:
-                obj_terms.append(shift[(s, d, VACANT_SHIFT)] * current_vacant_weight)
+def bump_input_version(*keys: str):
+    versions = st.session_state.setdefault("input_versions", {})
+    for key in keys:
+        versions[key] = versions.get(key, 0) + 1
 
-            if apply_specific:
-                for idx, cand in enumerate(vacancy_candidates):
-                    if isinstance(cand, dict):
-                        c_shift = str(cand.get("shift", "")).strip()
-                    else:
-                        c_shift = str(cand).strip()
-                    if c_shift in shift_types:
-                        w = priority_weight(idx, base=0.24, step=0.02, min_w=0.06)
-                        obj_terms.append(shift[(s, d, c_shift)] * w)
-
-            # 2. その他のシフト（不定を防ぐための微小な重み）
-            for t in shift_types:
-                if t != VACANT_SHIFT:
-                    obj_terms.append(shift[(s, d, t)] * 0.01)
-
-    model.Maximize(sum(obj_terms) if obj_terms else 0)
-
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = float(SOLVER_TIMEOUT)
-
-    status_text = st.empty()
-    progress_bar = st.progress(0)
-    start_time = time.time()
-
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(solver.Solve, model)
-        while not future.done():
-            elapsed = time.time() - start_time
-            progress = min(1.0, elapsed / float(SOLVER_TIMEOUT))
-            progress_bar.progress(progress)
-            status_text.caption(f"計算中... {elapsed:.0f}s")
-            time.sleep(0.1)
-        status = future.result()
-
-    status_text.empty()
-    progress_bar.empty()
-
-    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
-        data_rows = []
-        for s in staffs_local:
-            row = []
-            for d in days:
-                chosen = ""
-                for t in shift_types:
-                    if solver.Value(shift[(s, d, t)]) == 1:
-                        chosen = t
-                        break
-                row.append(chosen)
-            data_rows.append(row)
-
-        # ソフト制約（休日回数）の違反チェック
-        for s in staffs_local:
-            for w_days in weeks.values():
-                if len(w_days) == 7:
-                    for h in weekly_holiday_targets:
-                        if staff_settings[s]["holiday_periods"].get(h, "週") != "週":
-                            continue
-                        req = int(staff_settings[s]["holiday_counts_week"].get(h, 0))
-                        actual = 0
-                        for d in w_days:
-                            if solver.Value(shift[(s, d, h)]) == 1:
-                                actual += 1
-                        if actual != req:
-                            debug_messages.append(f"⚠️ {s}さんの {w_days[0]}週: {h}が {actual}日 (設定: {req}日)")
-
-            for (y, m), m_days in months.items():
-                days_in_month = calendar.monthrange(y, m)[1]
-                if len(m_days) == days_in_month:
-                    for h in weekly_holiday_targets:
-                        if staff_settings[s]["holiday_periods"].get(h, "週") != "月":
-                            continue
-                        req = int(staff_settings[s]["holiday_counts_month"].get(h, 0))
-                        actual = 0
-                        for d in m_days:
-                            if solver.Value(shift[(s, d, h)]) == 1:
-                                actual += 1
-                        if actual != req:
-                            debug_messages.append(f"⚠️ {s}さんの {y}年{m}月: {h}が {actual}日 (設定: {req}日)")
-
-        # 必要人数の不足・余剰チェック
-        for d in days:
-            for ws in target_work_shifts:
-                req = int(req_df.at[d, ws]) if (d in req_df.index and ws in req_df.columns) else 0
-                if req > 0:
-                    actual = 0
-                    for s in staffs_local:
-                        if solver.Value(shift[(s, d, ws)]) == 1:
-                            actual += 1
-                    if actual < req:
-                        debug_messages.append(f"⚠️ {d} の「{ws}」: {actual}名 (目標: {req}名) - 人手不足")
-                    elif actual > req:
-                        debug_messages.append(f"ℹ️ {d} の「{ws}」: {actual}名 (目標: {req}名) - 余剰あり")
-
-        out_df = pd.DataFrame(data_rows, index=staffs_local, columns=days)
-        out_df.index.name = "スタッフ名"
-        return out_df.reset_index(), debug_messages
-
-    if status == cp_model.INFEASIBLE:
-        debug_messages.append("・制約条件が厳しく、解が存在しません（NGペアや連勤制限などが原因の可能性があります）。")
-        debug_messages.append("🔍 詳細診断を実行中...")
-        diag_reasons = diagnose_infeasibility(days, day_map, work_shifts, holiday_types, shift_types)
-        if diag_reasons:
-            debug_messages.append("以下の条件を緩和（削除・変更）すると解決する可能性があります：")
-            debug_messages.extend(diag_reasons)
-        else:
-            debug_messages.append("・診断を行いましたが、特定の原因を特定できませんでした。")
-    elif status == cp_model.UNKNOWN:
-        debug_messages.append("・計算時間内に解が見つかりませんでした。")
 
-    return None, debug_messages
+def set_input_table(key: str, df: pd.DataFrame):
+    st.session_state[key] = df
+    bump_input_version(key)
 
 
-def df_to_signature(df: Optional[pd.DataFrame]) -> str:
-    if df is None:
-        return ""
-    try:
-        return df.fillna("").to_json(orient="split", date_format="iso")
-    except Exception:
-        return ""
+def table_signature(key: str) -> str:
+    """表の内容のハッシュ。前回と同じオブジェクトで版も同じなら計算し直さない"""
+    df = st.session_state.get(key)
+    version = st.session_state.get("input_versions", {}).get(key, 0)
+    hashes = st.session_state.setdefault("input_table_hashes", {})
+    cached = hashes.get(key)
+    # オブジェクトごと保持しておく（id の使い回しで別の表を同じとみなさないように）
+    if cached is not None and cached[0] is df and cached[1] == version:
+        return cached[2]
+    digest = hashlib.sha256(df_to_signature(df).encode("utf-8")).hexdigest()
+    hashes[key] = (df, version, digest)
+    return digest
 
 
-def compute_input_signature() -> str:
-    payload = {
-        "staff_df": df_to_signature(st.session_state.get("staff_df")),
-        "hope_df": df_to_signature(st.session_state.get("hope_df")),
-        "req_df": df_to_signature(st.session_state.get("req_df")),
-        "individual_rules_df": df_to_signature(st.session_state.get("individual_rules_df")),
+def compute_input_components() -> dict[str, str]:
+    """入力シグネチャの部品ごとのハッシュ。表は table_signature の結果を使うので、変わった表だけ直列化し直す"""
+    parts = {key: table_signature(key) for key in INPUT_TABLE_KEYS}
+    small = {
         "global_rules": st.session_state.get("global_rules", []),
         "ng_pairs": st.session_state.get("ng_pairs", []),
         "period_counts": st.session_state.get("period_counts", {}),
         "prohibited_transitions": st.session_state.get("prohibited_transitions", []),
         "holiday_order_rules": st.session_state.get("holiday_order_rules", []),
         "public_holiday_rules": st.session_state.get("public_holiday_rules", {}),
-        "req_by_weekday": df_to_signature(st.session_state.get("req_by_weekday")),
+        "constraint_modes": st.session_state.get("constraint_modes", {}),
         "work_shifts_list": st.session_state.get("work_shifts_list", []),
         "holiday_types_list": st.session_state.get("holiday_types_list", []),
         "work_shift_properties": st.session_state.get("work_shift_properties", []),
@@ -2023,12 +1453,71 @@ def compute_input_signature() -> str:
         "end_date": str(st.session_state.get("end_date", "")),
         "employment_types_list": st.session_state.get("employment_types_list", []),
     }
+    for key, value in small.items():
+        value_json = json.dumps(value, sort_keys=True, ensure_ascii=True, default=str)
+        parts[key] = hashlib.sha256(value_json.encode("utf-8")).hexdigest()
+    return parts
+
+
+def compute_input_signature(parts: Optional[dict] = None) -> str:
+    if parts is None:
+        parts = compute_input_components()
+    payload_json = json.dumps(parts, sort_keys=True, ensure_ascii=True)
+    return hashlib.sha256(payload_json.encode("utf-8")).hexdigest()
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    # プロセス内で共有する（メモリ上の LRU とディスクの両方を持つ）
+    return ResultCache(os.path.join(USER_DATA_DIR, "result_cache"))
+
+
+@st.cache_resource
+def get_solve_pool() -> SolvePool:
+    # 全セッションで共有する（同時に走る計算の数をサーバー全体で制限する）
+    return SolvePool()
+
+
+def compute_result_cache_key() -> str:
+    """入力シグネチャ + 結果に影響するその他の設定（空き対応・ソルバー設定）"""
+    payload = {
+        "input": compute_input_signature(),
+        "vacancy_policy": get_vacancy_policy(),
+        "vacancy_fill_candidates": st.session_state.get("vacancy_fill_candidates", []),
+        "vacancy_target_mode": st.session_state.get("vacancy_target_mode", "全員"),
+        "vacancy_target_value": st.session_state.get("vacancy_target_value", ""),
+        "solver_settings": {**DEFAULT_SOLVER_SETTINGS, **st.session_state.get("solver_settings", {})},
+    }
     payload_json = json.dumps(payload, sort_keys=True, ensure_ascii=True, default=str)
     return hashlib.sha256(payload_json.encode("utf-8")).hexdigest()
 
 
-def run_and_store_generation(days, day_map, work_shifts, holiday_types, shift_types, trigger, reason=""):
-    result_df, debug_msgs = run_optimization(days, day_map, work_shifts, holiday_types, shift_types)
+def start_generation(days, day_map, work_shifts, holiday_types, shift_types, trigger, reason="", action="full", scope=None):
+    """シフト作成を開始する。同じ条件で計算済みならその結果をすぐ反映し、なければ裏で求解ジョブを走らせる"""
+    if trigger == "manual":
+        # 今の入力で作り直すので、待っている自動生成は不要
+        clear_pending_auto_generation()
+    problem = build_schedule_problem(days, day_map, work_shifts, holiday_types, shift_types)
+    if not problem.staffs:
+        st.session_state["solve_notice"] = ("error", "スタッフが登録されていません。", [])
+        return
+
+    cache_key = compute_result_cache_key()
+    cached = get_result_cache().get(cache_key)
+    if cached is None:
+        start_solve_job(problem, trigger, reason, cache_key, action, scope)
+        return
+
+    # 同じ条件で計算済みなら保存してある結果をそのまま使う
+    cancel_solve_job()
+    result_df = None if cached.result_df is None else cached.result_df.copy()
+    debug_msgs = ["♻️ 同じ条件で計算済みの結果を再利用しました。"] + list(cached.messages)
+    st.session_state["last_solve_stats"] = dict(cached.stats, cached=True)
+    store_generation_result(result_df, debug_msgs, trigger, reason)
+    set_result_notice(result_df, debug_msgs)
+
+
+def store_generation_result(result_df, debug_msgs, trigger, reason=""):
     st.session_state["last_debug_msgs"] = debug_msgs
     st.session_state["last_run_trigger"] = trigger
     st.session_state["last_run_reason"] = reason
@@ -2037,38 +1526,232 @@ def run_and_store_generation(days, day_map, work_shifts, holiday_types, shift_ty
         st.session_state["auto_notice_dismissed"] = False
     if result_df is not None:
         st.session_state["last_result"] = result_df
+        # 後で期間を変えても列の日付が分かるよう、作った時点の日付を控えておく
+        st.session_state["last_result_dates"] = result_column_dates(result_df)
         st.session_state["last_status"] = "ok"
     else:
         st.session_state["last_result"] = None
         st.session_state["last_status"] = "infeasible"
-    return result_df, debug_msgs
+
+
+def set_result_notice(result_df, debug_msgs):
+    if result_df is not None:
+        st.session_state["solve_notice"] = ("success", "シフトを作成しました。", debug_msgs)
+    else:
+        st.session_state["solve_notice"] = ("error", "解が見つかりませんでした。条件を緩和してください。", debug_msgs)
+
+
+def deliver_finished_solve_job():
+    """終わったジョブの結果を画面の状態に反映する（1回だけ）"""
+    job = st.session_state.get("solve_job")
+    if job is None or not job.done:
+        return
+    st.session_state.pop("solve_job", None)
+
+    if job.state == "cancelled":
+        st.session_state["solve_notice"] = ("warning", "計算を中止しました。", [])
+        return
+    if job.state == "error":
+        st.session_state["solve_notice"] = ("error", f"計算中にエラーが発生しました: {job.error}", [])
+        return
+
+    st.session_state["last_solve_stats"] = job.stats
+    # 途中で確定した結果や、前回の結果を元に直しただけの結果は最後まで解いたものではないのでキャッシュしない
+    # （解なしは最後まで解いたときにしか返らない）
+    full_solve = job.stats.get("resolved_by") == "full" or job.stats.get("status") == "INFEASIBLE"
+    if job.cache_key and not job.accepted and full_solve and job.stats.get("status") in ("OPTIMAL", "FEASIBLE", "INFEASIBLE"):
+        get_result_cache().put(job.cache_key, job.result_df, job.messages, job.stats)
+    store_generation_result(job.result_df, job.messages, job.trigger, job.reason)
+    set_result_notice(job.result_df, job.messages)
+
+
+def render_solve_notice():
+    notice = st.session_state.pop("solve_notice", None)
+    if notice is None:
+        return
+    kind, text, msgs = notice
+    getattr(st, kind)(text)
+    if not msgs:
+        return
+    if kind == "error":
+        with st.expander("詳細な理由（可能性）", expanded=True):
+            for msg in msgs:
+                st.write(msg)
+    else:
+        with st.expander("⚠️ 結果に関するお知らせ（不足・余剰など）", expanded=False):
+            for msg in msgs:
+                st.write(msg)
+
+
+# 入力の変更の種類ごとに、自動生成でどこまで計算し直すか（RESOLVE_ACTIONS は軽い順）
+# skip: 何もしない / validate: 今の結果が満たすか確認し、だめなら全体を解く
+# repair: 確認し、だめなら変わった所の周りだけ解き直す / full: 最初から解く
+RESOLVE_ACTIONS = ("skip", "validate", "repair", "full")
+# 画面・テンプレート用の設定（計算には使わない）
+COSMETIC_INPUT_COMPONENTS = {"employment_types_list", "req_by_weekday", "filler_shift_type"}
+# スタッフ・日付単位の設定
+LOCAL_INPUT_COMPONENTS = {"staff_df", "hope_df", "req_df", "individual_rules_df", "ng_pairs", "period_counts"}
+# 期間・シフトの種類（今の結果がそのままでは使えない）
+STRUCTURAL_INPUT_COMPONENTS = {
+    "work_shifts_list",
+    "holiday_types_list",
+    "work_shift_properties",
+    "holiday_properties",
+    "start_date",
+    "end_date",
+}
+# 変わった所を調べるために、前回の中身を取っておく部品
+SCOPE_INPUT_KEYS = ("staff_df", "hope_df", "req_df", "individual_rules_df", "ng_pairs", "period_counts")
+# 最後の変更からこの秒数だけ入力が止まったら自動生成する（続けて入力している間はまとめて1回にする）
+DEFAULT_AUTO_GEN_QUIET_SECONDS = max(0, safe_int(os.environ.get("SHIFT_APP_AUTO_GEN_QUIET_SECONDS"), 3))
+
+
+def classify_input_change(changed: set, has_result: bool) -> str:
+    """変わった部品から一番軽く済む計算のしかたを選ぶ（それ以外の全体ルール等は validate）"""
+    changed = set(changed) - COSMETIC_INPUT_COMPONENTS
+    if not changed:
+        return "skip"
+    if not has_result or changed & STRUCTURAL_INPUT_COMPONENTS:
+        return "full"
+    if changed <= LOCAL_INPUT_COMPONENTS:
+        return "repair"
+    return "validate"
+
+
+def _changed_labels(before: Optional[pd.DataFrame], after: Optional[pd.DataFrame]) -> tuple[set, set]:
+    """2つの表で値の違うマスの (行ラベル, 列ラベル) の集合"""
+    before = pd.DataFrame() if before is None else before
+    after = pd.DataFrame() if after is None else after
+    index = before.index.union(after.index)
+    columns = before.columns.union(after.columns)
+    a = before.reindex(index=index, columns=columns).fillna("").astype(str).to_numpy()
+    b = after.reindex(index=index, columns=columns).fillna("").astype(str).to_numpy()
+    rows, cols = np.nonzero(a != b)
+    return {index[i] for i in rows}, {columns[j] for j in cols}
+
+
+def _rows_by_staff(df: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    if df is None or "スタッフ名" not in df.columns:
+        return None
+    df = df.assign(スタッフ名=df["スタッフ名"].fillna("").astype(str).str.strip())
+    return df[~df["スタッフ名"].duplicated()].set_index("スタッフ名")
+
+
+def _rule_rows(df: Optional[pd.DataFrame]) -> set:
+    if df is None or "スタッフ名" not in df.columns:
+        return set()
+    columns = ["スタッフ名", "曜日", "希望内容", "ルールタイプ"]
+    return set(df.reindex(columns=columns).fillna("").astype(str).itertuples(index=False, name=None))
+
+
+def input_change_scope(changed: set, before: dict) -> dict:
+    """解き直す範囲: 値の変わった日（その週を全員分）と、設定の変わったスタッフ（全日）"""
+    staffs, days = set(), set()
+    if "hope_df" in changed:
+        days |= _changed_labels(before.get("hope_df"), st.session_state.get("hope_df"))[1]
+    if "req_df" in changed:
+        days |= _changed_labels(before.get("req_df"), st.session_state.get("req_df"))[0]
+    if "staff_df" in changed:
+        staffs |= _changed_labels(_rows_by_staff(before.get("staff_df")), _rows_by_staff(st.session_state.get("staff_df")))[0]
+    if "individual_rules_df" in changed:
+        rows = _rule_rows(before.get("individual_rules_df")) ^ _rule_rows(st.session_state.get("individual_rules_df"))
+        staffs |= {row[0] for row in rows}
+    if "ng_pairs" in changed:
+        old = {json.dumps(p, sort_keys=True, ensure_ascii=True) for p in before.get("ng_pairs") or []}
+        new = {json.dumps(p, sort_keys=True, ensure_ascii=True) for p in st.session_state.get("ng_pairs", [])}
+        for p in old ^ new:
+            pair = json.loads(p)
+            staffs |= {pair.get("スタッフA"), pair.get("スタッフB")}
+    if "period_counts" in changed:
+        old = before.get("period_counts") or {}
+        new = st.session_state.get("period_counts", {})
+        staffs |= {s for s in set(old) | set(new) if old.get(s) != new.get(s)}
+    return {"staffs": sorted(str(s).strip() for s in staffs if s), "days": sorted(days)}
+
+
+def _snapshot_scope_inputs(keys) -> dict:
+    snapshot = dict(st.session_state.get("auto_gen_input_snapshot", {}))
+    for key in keys:
+        value = st.session_state.get(key)
+        snapshot[key] = value.copy() if isinstance(value, pd.DataFrame) else copy.deepcopy(value)
+    return snapshot
 
 
 def maybe_flag_auto_generation():
-    sig = compute_input_signature()
+    parts = compute_input_components()
+    sig = compute_input_signature(parts)
     prev_sig = st.session_state.get("auto_gen_input_signature")
     if prev_sig is None:
         st.session_state["auto_gen_input_signature"] = sig
+        st.session_state["auto_gen_input_components"] = parts
+        st.session_state["auto_gen_input_snapshot"] = _snapshot_scope_inputs(SCOPE_INPUT_KEYS)
         return
-    if sig != prev_sig:
-        st.session_state["auto_gen_input_signature"] = sig
-        st.session_state["auto_gen_needed"] = True
-        st.session_state["auto_gen_reason"] = "設定変更を検知しました"
-        st.session_state["auto_notice_page"] = st.session_state.get("page", "home")
+    if sig == prev_sig:
+        return
+
+    prev_parts = st.session_state.get("auto_gen_input_components", {})
+    changed = {key for key, value in parts.items() if prev_parts.get(key) != value}
+    action = classify_input_change(changed, st.session_state.get("last_result") is not None)
+    scope = None
+    if action == "repair":
+        scope = input_change_scope(changed, st.session_state.get("auto_gen_input_snapshot", {}))
+    st.session_state["auto_gen_input_signature"] = sig
+    st.session_state["auto_gen_input_components"] = parts
+    st.session_state["auto_gen_input_snapshot"] = _snapshot_scope_inputs(changed & set(SCOPE_INPUT_KEYS))
+    if action == "skip":
+        return
+
+    # まだ走らせていない変更があれば、重い方の計算のしかたにまとめる
+    if st.session_state.get("auto_gen_needed"):
+        pending = st.session_state.get("auto_gen_action", "full")
+        if RESOLVE_ACTIONS.index(pending) > RESOLVE_ACTIONS.index(action):
+            action = pending
+        pending_scope = st.session_state.get("auto_gen_scope")
+        if action == "repair" and pending_scope and scope:
+            scope = {k: sorted(set(scope[k]) | set(pending_scope[k])) for k in ("staffs", "days")}
+    st.session_state["auto_gen_action"] = action
+    st.session_state["auto_gen_scope"] = scope
+    mark_auto_gen_needed("設定変更を検知しました")
+
+
+def auto_gen_quiet_seconds() -> int:
+    return max(0, safe_int(st.session_state.get("auto_gen_quiet_seconds"), DEFAULT_AUTO_GEN_QUIET_SECONDS))
+
+
+def auto_gen_wait_remaining() -> float:
+    """自動生成まであと何秒待つか（入力が続いている間は延びる）"""
+    changed_at = st.session_state.get("auto_gen_changed_at", 0.0)
+    return max(0.0, changed_at + auto_gen_quiet_seconds() - time.time())
+
+
+def clear_pending_auto_generation():
+    st.session_state["auto_gen_needed"] = False
+    st.session_state.pop("auto_gen_action", None)
+    st.session_state.pop("auto_gen_scope", None)
 
 
 def mark_auto_gen_needed(reason: str):
     st.session_state["auto_gen_needed"] = True
     st.session_state["auto_gen_reason"] = reason
     st.session_state["auto_notice_page"] = st.session_state.get("page", "home")
+    st.session_state["auto_gen_changed_at"] = time.time()
+    # 古い入力で走っている自動生成は結果を待っても使わないので止める
+    job = st.session_state.get("solve_job")
+    if job is not None and job.trigger == "auto" and not job.done:
+        cancel_solve_job()
 
 
 def maybe_run_auto_generation():
     if not st.session_state.get("auto_gen_needed"):
         return
+    if auto_gen_wait_remaining() > 0:
+        # まだ入力が続いているかもしれないので待つ（render_auto_gen_timer が時間になったら再実行する）
+        return
 
-    st.session_state["auto_gen_needed"] = False
     reason = st.session_state.get("auto_gen_reason", "設定変更を検知しました")
+    action = st.session_state.get("auto_gen_action", "full")
+    scope = st.session_state.get("auto_gen_scope")
+    clear_pending_auto_generation()
     days = st.session_state.get("days_list", [])
     day_map = st.session_state.get("day_map", {})
     work_shifts = st.session_state.get("work_shifts_list", [])
@@ -2086,24 +1769,7 @@ def maybe_run_auto_generation():
         st.session_state["last_status"] = "skipped"
         return
 
-    with st.container(border=True):
-        st.markdown('<div class="card-title">🔁 自動生成</div>', unsafe_allow_html=True)
-        st.caption(f"変更検知: {reason}")
-        result_df, debug_msgs = run_and_store_generation(
-            days, day_map, work_shifts, holiday_types, shift_types, trigger="auto", reason=reason
-        )
-        if result_df is not None:
-            st.success("自動生成が完了しました。")
-            if debug_msgs:
-                with st.expander("⚠️ 結果に関するお知らせ（不足・余剰など）", expanded=False):
-                    for msg in debug_msgs:
-                        st.write(msg)
-        else:
-            st.error("解が見つかりませんでした。条件を緩和してください。")
-            if debug_msgs:
-                with st.expander("詳細な理由（可能性）", expanded=True):
-                    for msg in debug_msgs:
-                        st.write(msg)
+    start_generation(days, day_map, work_shifts, holiday_types, shift_types, trigger="auto", reason=reason, action=action, scope=scope)
 
 
 # ----------------------------
@@ -2387,7 +2053,9 @@ def page_save_load():
 # Fragments for Stability (Partial Updates)
 # =========================================================
 if not hasattr(st, "fragment"):
-    def fragment(func):
+    def fragment(func=None, **kwargs):
+        if func is None:
+            return lambda f: f
         return func
     st.fragment = fragment
 
@@ -2675,12 +2343,13 @@ def render_detailed_rule_editor():
                 st.button("追加", key="gr_dow_add", use_container_width=True, on_click=add_gr_dow_callback)
 
         with tab_date:
-            days_opts = st.session_state.get("days_list", [])
-            if not days_opts:
+            cal = current_calendar()
+            if cal is None or not len(cal):
                 st.info("期間が設定されていません")
             else:
                 c_dt, c_s2, c_e2, c_b2 = st.columns([1.5, 1.5, 1.5, 0.8])
-                sel_date = c_dt.selectbox("日付", days_opts, key="gr_date_sel")
+                # 保存するのは ISO 形式の日付で、ラベルは表示のときだけ作る
+                sel_date = c_dt.selectbox("日付", cal.iso, format_func=cal.label_of, key="gr_date_sel")
                 sel_shift_date = c_s2.selectbox("適用する休日", target_shifts, key="gr_date_shift_sel")
                 sel_emp_date = c_e2.selectbox("対象の雇用形態", emp_types_opts, key="gr_date_emp_sel")
                 
@@ -2695,8 +2364,11 @@ def render_detailed_rule_editor():
             # Formatter
             def format_gr(r):
                 kind = "曜日" if r["type"] == "dow" else "日付"
+                value = r["value"]
+                if r["type"] == "date":
+                    value = cal.label_of(value) if cal is not None else str(value)
                 emp_str = f" ({r.get('employment_type')})" if r.get('employment_type') else ""
-                return f"【{kind}】{r['value']}{emp_str} が休みなら → {r['shift']}"
+                return f"【{kind}】{value}{emp_str} が休みなら → {r['shift']}"
             
             gr_labels = [format_gr(r) for r in gr_list]
             
@@ -3037,32 +2709,23 @@ def page_home():
                         + st.session_state.get("holiday_types_list", [])
                     )
 
-                    # --- Determine Cutoff Date (Search backwards) ---
+                    # --- Determine Cutoff Date ---
                     start_d = st.session_state.get("start_date", datetime.date.today())
                     
                     # Identify date columns
                     date_cols = [c for c in target_df.columns if c != staff_col]
                     
-                    found_cutoff_str = None
-                    cutoff_date_obj = None
-                    
-                    # Search backwards from yesterday up to 60 days
-                    for i in range(1, 61):
-                        target_d = start_d - datetime.timedelta(days=i)
-                        w_label = WEEKDAYS_JP[target_d.weekday()]
-                        d_str = f"{target_d.month}/{target_d.day}({w_label})"
-                        
-                        if d_str in date_cols:
-                            found_cutoff_str = d_str
-                            cutoff_date_obj = target_d
-                            break
+                    # 列ごとの日付（年まで分かるので、ラベルを遡って探さなくてよい）
+                    col_dates = saved_result_dates(data, date_cols)
+                    before = [(d, j) for j, d in enumerate(col_dates) if d is not None and d < start_d]
+                    cutoff_date_obj, cut_idx = max(before) if before else (None, None)
+                    found_cutoff_str = day_label(cutoff_date_obj, cutoff_date_obj.year != start_d.year) if cutoff_date_obj else None
                     
                     use_cols = []
                     cutoff_msg = ""
                     
                     if found_cutoff_str:
                         # Found a valid date before start_date
-                        cut_idx = date_cols.index(found_cutoff_str)
                         use_cols = date_cols[:cut_idx+1]
                         
                         # Gap check
@@ -3135,7 +2798,7 @@ def page_home():
                                 current_staff_df.at[idx, "シフト開始前の連勤数"] = val["cons_work"]
                                 if val.get("prev_shift_type"):
                                     current_staff_df.at[idx, "シフト開始前の担務/休日"] = val["prev_shift_type"]
-                            st.session_state["staff_df"] = current_staff_df
+                            set_input_table("staff_df", current_staff_df)
                             st.success("連勤データを更新しました！")
                             time.sleep(1)
                             st.rerun()
@@ -3277,7 +2940,7 @@ def page_staff():
                         new_row[f"月の{h_name}日数"] = hol_settings.get(h_name, {}).get("month", 4)
                         new_row[period_col] = st.session_state.get(f"staff_add_hol_period_{h_name}", "週")
 
-                    st.session_state["staff_df"] = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+                    set_input_table("staff_df", pd.concat([df, pd.DataFrame([new_row])], ignore_index=True))
                     st.rerun()
                 else:
                     st.error("その名前は既に存在します。")
@@ -3303,12 +2966,12 @@ def page_staff():
             df_swap = st.session_state["staff_df"].copy()
             indices = list(range(len(df_swap)))
             indices[idx1], indices[idx2] = indices[idx2], indices[idx1]
-            st.session_state["staff_df"] = df_swap.iloc[indices].reset_index(drop=True)
+            set_input_table("staff_df", df_swap.iloc[indices].reset_index(drop=True))
 
         def delete_staff_callback(idx):
             df_curr = st.session_state["staff_df"]
             new_df = df_curr.drop(index=idx).reset_index(drop=True)
-            st.session_state["staff_df"] = new_df
+            set_input_table("staff_df", new_df)
 
         # Note: Fragment triggers re-run on interaction, so updated state will be rendered.
         
@@ -3605,7 +3268,7 @@ def page_staff_detail():
             # Actually st.session_state["staff_df"].copy() was called at top of function? No, inside fragment I should invoke it freshly.
             # In the original code 'df' was a copy, but 'at' operations modify it.
             # Re-assigning to session state is safer to trigger Streamlit updates elsewhere if needed.
-            st.session_state["staff_df"] = df_basic
+            set_input_table("staff_df", df_basic)
 
         render_staff_basic_settings(target)
 
@@ -3647,7 +3310,7 @@ def page_staff_detail():
                     )
                     df_shifts.at[row_idx_local, pref_col] = pref_val
             
-            st.session_state["staff_df"] = df_shifts
+            set_input_table("staff_df", df_shifts)
 
         render_possible_shifts_editor(target)
 
@@ -3686,7 +3349,7 @@ def page_staff_detail():
                 if target_staff not in hf.index:
                     hf.loc[target_staff] = ""
                 hf.at[target_staff, d_key] = val
-                st.session_state["hope_df"] = hf
+                set_input_table("hope_df", hf)
                 mark_auto_gen_needed("希望シフトを更新しました")
                 # Removed toast/rerun to keep lightweight; fragment update is sufficient
 
@@ -3698,7 +3361,7 @@ def page_staff_detail():
                     hf.at[target_staff, d_key] = ""
                     changed = True
                 if changed:
-                    st.session_state["hope_df"] = hf
+                    set_input_table("hope_df", hf)
                     mark_auto_gen_needed("希望シフトを更新しました")
 
             # --- Calendar Selection UI ---
@@ -3739,6 +3402,7 @@ def page_staff_detail():
             curr_hope_df = st.session_state["hope_df"]
             if target_staff not in curr_hope_df.index:
                 curr_hope_df.loc[target_staff] = ""
+                bump_input_version("hope_df")
 
             for week in cal_weeks:
                 cols = st.columns(7)
@@ -3865,7 +3529,7 @@ def page_staff_detail():
             def add_rule_callback(s_name, dow, tgt, typ):
                 curr = st.session_state.get("individual_rules_df", pd.DataFrame())
                 new_row = {"スタッフ名":s_name, "曜日":dow, "希望内容":tgt, "ルールタイプ":typ}
-                st.session_state["individual_rules_df"] = pd.concat([curr, pd.DataFrame([new_row])], ignore_index=True)
+                set_input_table("individual_rules_df", pd.concat([curr, pd.DataFrame([new_row])], ignore_index=True))
                 
             def remove_rules_callback(items_to_remove, current_display_list, current_map):
                 if not items_to_remove: return
@@ -3875,7 +3539,7 @@ def page_staff_detail():
                     if lbl in current_map:
                         indices_to_drop.extend(current_map[lbl])
                 if indices_to_drop:
-                    st.session_state["individual_rules_df"] = curr.drop(indices_to_drop).reset_index(drop=True)
+                    set_input_table("individual_rules_df", curr.drop(indices_to_drop).reset_index(drop=True))
 
             # Form
             c1, c2, c3 = st.columns(3)
@@ -4110,19 +3774,19 @@ def page_staff_detail():
 
         render_period_counts_editor(target)
 
-    st.session_state["staff_df"] = df
+    set_input_table("staff_df", df)
 
 
 def page_req():
     st.header("要員配置")
 
     def template_row_for_day(day_label: str) -> pd.Series:
-        day_map = st.session_state.get("day_map", {})
-        d_obj = day_map.get(day_label)
-        if not d_obj:
+        cal = current_calendar()
+        di = cal.index.get(day_label) if cal is not None else None
+        if di is None:
             return pd.Series({ws: 0 for ws in st.session_state.get("work_shifts_list", [])})
 
-        w_key = WEEKDAYS_JP[d_obj.weekday()]
+        w_key = WEEKDAYS_JP[cal.weekday[di]]
 
         wd_settings = st.session_state.get("req_by_weekday", pd.DataFrame())
         work_shifts_local = st.session_state.get("work_shifts_list", [])
@@ -4162,7 +3826,7 @@ def page_req():
     target_index = WEEKDAYS_JP
     wd_df = st.session_state.get("req_by_weekday", pd.DataFrame())
     wd_df = wd_df.reindex(index=target_index, columns=work_shifts, fill_value=0)
-    st.session_state["req_by_weekday"] = wd_df
+    set_input_table("req_by_weekday", wd_df)
 
     tab1, tab2 = st.tabs(["基本要員配置（曜日別）", "日別配置調整"])
 
@@ -4180,7 +3844,7 @@ def page_req():
                     for col in req_df_curr.columns:
                         if col in templ.index:
                             req_df_curr.at[d, col] = int(templ[col])
-            st.session_state["req_df"] = req_df_curr
+            set_input_table("req_df", req_df_curr)
             st.success("基本設定を全期間に反映しました。（日別の例外設定は上書きされました）")
 
         wd_df = st.session_state["req_by_weekday"]
@@ -4218,7 +3882,7 @@ def page_req():
                     changed = True
 
             if changed:
-                st.session_state["req_by_weekday"] = wd_df
+                set_input_table("req_by_weekday", wd_df)
 
     with tab2:
         st.caption("特定の日付の配置数を調整します。基本設定と異なる日のみが表示されます。")
@@ -4273,7 +3937,7 @@ def page_req():
                                 if d_str in new_req.index:
                                     for ws_key in target_work_shifts:
                                         new_req.at[d_str, ws_key] = int(templ.get(ws_key, 0))
-                                    st.session_state["req_df"] = new_req
+                                    set_input_table("req_df", new_req)
                                     st.toast(f"{d_str} をリセットしました", icon="🗑️")
                                     time.sleep(0.5)
                                     st.rerun()
@@ -4300,7 +3964,7 @@ def page_req():
                         for col in req_df.columns:
                             if col in templ2.index:
                                 req_df.at[d_str, col] = int(templ2[col])
-                    st.session_state["req_df"] = req_df
+                    set_input_table("req_df", req_df)
                     st.success("リセットしました。")
                     time.sleep(1.0)
                     st.rerun()
@@ -4378,10 +4042,8 @@ def page_req():
         cal_weeks = calendar.monthcalendar(st.session_state["cal_view_year"], st.session_state["cal_view_month"])
         
         # Prepare reverse map for fast lookup: date -> index in `days`
-        date_to_idx = {}
-        for idx, d_str in enumerate(days):
-            if d_str in day_map:
-                date_to_idx[day_map[d_str]] = idx
+        cal = current_calendar()
+        date_to_idx = {d: idx for idx, d in enumerate(cal.dates)} if cal is not None else {}
 
         for week in cal_weeks:
             cols = st.columns(7)
@@ -4442,14 +4104,14 @@ def page_req():
                     updated_single = True
 
             if updated_single:
-                st.session_state["req_df"] = req_df
+                set_input_table("req_df", req_df)
                 st.rerun()
 
             if st.button("基本設定に戻す", key="reset_day_to_template", use_container_width=True):
                 new_req = st.session_state["req_df"].copy()
                 for ws in target_work_shifts:
                     new_req.at[selected_day, ws] = int(templ.get(ws, 0))
-                st.session_state["req_df"] = new_req
+                set_input_table("req_df", new_req)
                 st.success("基本設定に戻しました")
                 time.sleep(0.15)
                 st.rerun()
@@ -4475,7 +4137,7 @@ def apply_provisional_update():
         hope_df.loc[sel_staff] = ""
     # Update value
     hope_df.at[sel_staff, sel_day] = "" if sel_val == "削除" else sel_val
-    st.session_state["hope_df"] = hope_df
+    set_input_table("hope_df", hope_df)
     
     mark_auto_gen_needed("希望シフトを更新しました")
     st.toast("希望シフトに反映しました", icon="✅")
@@ -4488,11 +4150,10 @@ def render_provisional_editor_fragment(days, day_map):
     if not days:
         st.info("期間を設定してください。")
     else:
-        staff_df = st.session_state.get("staff_df", pd.DataFrame(columns=["スタッフ名"]))
-        hope_df = st.session_state.get("hope_df", pd.DataFrame())
-        rules_df = st.session_state.get("individual_rules_df", pd.DataFrame())
-
-        provisional_df = build_provisional_table(days, day_map, staff_df, hope_df, rules_df)
+        work_shifts = st.session_state.get("work_shifts_list", [])
+        holiday_types = st.session_state.get("holiday_types_list", [])
+        problem = build_schedule_problem(days, day_map, work_shifts, holiday_types, build_shift_types(work_shifts, holiday_types))
+        provisional_df = build_provisional_table(problem)
 
         with st.container():
             all_shifts = ["休み(全般)", "出勤(全般)"] + st.session_state.get("work_shifts_list", []) + st.session_state.get("holiday_types_list", []) + ["削除"]
@@ -4615,6 +4276,179 @@ if hasattr(st, "fragment"):
     render_result_editor_fragment = st.fragment(render_result_editor_fragment)
 
 
+@st.fragment(run_every=1.0)
+def render_solve_job_status():
+    """裏で動いている求解ジョブの経過を1秒ごとに描き直す（ほかの画面操作はそのまま続けられる）"""
+    job = st.session_state.get("solve_job")
+    if job is None:
+        return
+    if job.done:
+        # 結果の反映はアプリ全体の再実行で行う（deliver_finished_solve_job）
+        st.rerun()
+
+    progress = job.progress()
+    snapshot = progress["snapshot"]
+    with st.container(border=True):
+        st.markdown('<div class="card-title">⏳ シフト計算中</div>', unsafe_allow_html=True)
+        if job.trigger == "auto":
+            st.caption(f"変更検知: {job.reason}")
+        elapsed = progress["elapsed"]
+        budget = progress["time_budget"]
+        if progress["position"]:
+            load = job.pool.load()
+            st.info(
+                f"順番待ち: {progress['position']}番目"
+                f"（実行中 {load['running']}件 / 同時に計算できるのは {load['max_concurrent']}件まで）"
+            )
+        elif budget:
+            st.progress(min(1.0, elapsed / budget), text=f"{progress['label']} {elapsed:.0f}s / 最大 {budget:.0f}s")
+        else:
+            st.caption(progress["label"])
+
+        cols = st.columns(2)
+        cols[0].button(
+            "この時点の結果で確定",
+            key="solve_job_accept",
+            on_click=job.accept,
+            disabled=snapshot is None,
+            use_container_width=True,
+        )
+        cols[1].button("中止", key="solve_job_cancel", on_click=job.cancel, use_container_width=True)
+
+        if snapshot is None:
+            st.caption("まだ解は見つかっていません。")
+            return
+        cols = st.columns(4)
+        cols[0].metric("評価値", f"{snapshot['objective']:.1f}")
+        cols[1].metric("上限", f"{snapshot['bound']:.1f}")
+        cols[2].metric("ギャップ", f"{snapshot['gap'] * 100:.1f}%")
+        cols[3].metric("人員不足", f"{snapshot['shortage']}名")
+        with st.expander("現在の最良解", expanded=False):
+            st.dataframe(values_to_table(job.problem, snapshot["values"]), use_container_width=True)
+
+
+@st.fragment(run_every=0.5)
+def render_auto_gen_timer():
+    """自動生成の待ち時間を表示し、時間になったらアプリ全体を再実行して生成を始める"""
+    if not st.session_state.get("auto_gen_needed"):
+        return
+    remaining = auto_gen_wait_remaining()
+    if remaining <= 0:
+        st.rerun()
+    st.caption(f"⏱ 入力が止まったら自動でシフトを作り直します（あと {remaining:.0f} 秒）")
+
+
+def render_constraint_mode_editor():
+    """制約ファミリーごとの「厳守 / できるだけ守る」を選ぶ"""
+    modes = dict(st.session_state.get("constraint_modes", DEFAULT_CONSTRAINT_MODES))
+    mode_codes = list(CONSTRAINT_MODE_LABELS.keys())
+    with st.expander("制約の扱い（厳守 / できるだけ守る）", expanded=False):
+        st.caption("「できるだけ守る」にすると、守れない場合も不足・超過をお知らせに出して表を作成します。")
+        changed = False
+        for family, label in CONSTRAINT_FAMILIES.items():
+            current = modes.get(family, DEFAULT_CONSTRAINT_MODES[family])
+            new_mode = st.radio(
+                label,
+                mode_codes,
+                index=mode_codes.index(current) if current in mode_codes else 0,
+                format_func=lambda c: CONSTRAINT_MODE_LABELS[c],
+                key=f"constraint_mode_{family}",
+                horizontal=True,
+            )
+            if new_mode != current:
+                modes[family] = new_mode
+                changed = True
+        if changed:
+            st.session_state["constraint_modes"] = modes
+
+
+def render_solver_settings_editor():
+    """計算の設定（プリセット・計算時間・乱数シード・評価のしかた）"""
+    settings = {**DEFAULT_SOLVER_SETTINGS, **st.session_state.get("solver_settings", {})}
+    preset_codes = list(SOLVER_PRESETS.keys())
+    with st.expander("計算の設定", expanded=False):
+        preset = st.radio(
+            "計算モード",
+            preset_codes,
+            index=preset_codes.index(settings["preset"]) if settings["preset"] in preset_codes else 0,
+            format_func=lambda c: SOLVER_PRESETS[c]["label"],
+            key="solver_preset",
+            horizontal=True,
+        )
+        time_limit = st.number_input(
+            "計算時間の上限（秒）",
+            min_value=0,
+            max_value=3600,
+            value=safe_int(settings.get("time_limit"), 0),
+            step=10,
+            help="0 のときは人数・日数に合わせて自動で決めます。",
+            key="solver_time_limit",
+        )
+        random_seed = st.number_input(
+            "乱数シード",
+            min_value=0,
+            value=safe_int(settings.get("random_seed"), 0),
+            step=1,
+            help="同じ条件・同じシードなら同じ結果になりやすくなります。",
+            key="solver_random_seed",
+        )
+        warm_start = st.checkbox(
+            "前回の結果を元に計算する",
+            value=bool(settings.get("warm_start", True)),
+            help="前回の結果のうち今回も使えるマスを初期値にします。少しの変更なら早く、似た表になります。",
+            key="solver_warm_start",
+        )
+        hint_repair = st.checkbox(
+            "前回の結果をできるだけ変えない",
+            value=bool(settings.get("hint_repair", False)),
+            disabled=not warm_start,
+            help="まず変更のあった週以外を前回の結果のまま固定して直し、無理なときだけ全体を計算し直します。",
+            key="solver_hint_repair",
+        )
+        mode_codes = list(OBJECTIVE_MODES.keys())
+        objective_mode = st.radio(
+            "評価のしかた",
+            mode_codes,
+            index=mode_codes.index(settings.get("objective_mode")) if settings.get("objective_mode") in mode_codes else 0,
+            format_func=lambda c: OBJECTIVE_MODES[c],
+            help="段階的に解くと、必要人数 → 休日数 → 希望・優先 の順に、前の段の結果を落とさない範囲で最適化します。",
+            key="solver_objective_mode",
+            horizontal=True,
+        )
+        engine_codes = list(SEQUENCE_ENGINES.keys())
+        sequence_engine = st.radio(
+            "連勤・禁止遷移の表し方",
+            engine_codes,
+            index=engine_codes.index(settings.get("sequence_engine")) if settings.get("sequence_engine") in engine_codes else 0,
+            format_func=lambda c: SEQUENCE_ENGINES[c],
+            help="どちらでも作れる表は同じです。オートマトンは制約の数が少なくなりますが、多くの場合は標準のほうが速く解けます。",
+            key="solver_sequence_engine",
+            horizontal=True,
+        )
+        new_settings = {
+            "preset": preset,
+            "time_limit": int(time_limit),
+            "random_seed": int(random_seed),
+            "warm_start": bool(warm_start),
+            "hint_repair": bool(hint_repair),
+            "objective_mode": objective_mode,
+            "sequence_engine": sequence_engine,
+        }
+        if new_settings != settings:
+            st.session_state["solver_settings"] = new_settings
+
+        # 自動生成の待ち時間は計算結果に関係しないので solver_settings とは別に持つ
+        st.session_state["auto_gen_quiet_seconds"] = st.number_input(
+            "自動生成までの待ち時間（秒）",
+            min_value=0,
+            max_value=60,
+            value=auto_gen_quiet_seconds(),
+            step=1,
+            help="入力が止まってからこの秒数たったら自動で作り直します。続けて入力した分はまとめて1回で計算します。",
+            key="auto_gen_quiet_input",
+        )
+
+
 def page_gen():
     st.header("シフト作成")
 
@@ -4622,8 +4456,7 @@ def page_gen():
     end = st.session_state.get("end_date")
     if isinstance(start, datetime.date) and isinstance(end, datetime.date) and end >= start:
         days, day_map = compute_days(start, end)
-        st.session_state["days_list"] = days
-        st.session_state["day_map"] = day_map
+        set_period_days(days, day_map)
     else:
         days, day_map = [], {}
 
@@ -4638,6 +4471,8 @@ def page_gen():
     with st.container(border=True):
         st.markdown('<div class="card-title">🚀 生成</div>', unsafe_allow_html=True)
         st.caption("現在の設定でシフトを生成します。")
+        render_constraint_mode_editor()
+        render_solver_settings_editor()
         if st.button("生成開始", type="primary", use_container_width=True, key="gen_start"):
             if not isinstance(start, datetime.date) or not isinstance(end, datetime.date) or end < start:
                 st.error("期間設定が不正です。")
@@ -4649,20 +4484,9 @@ def page_gen():
                     return
                 shift_types = build_shift_types(ws, hol)
 
-                result_df, debug_msgs = run_and_store_generation(
-                    days, day_map, ws, hol, shift_types, trigger="manual", reason="生成開始"
-                )
-                if result_df is not None:
-                    if debug_msgs:
-                        with st.expander("⚠️ 結果に関するお知らせ（不足・余剰など）", expanded=True):
-                            for msg in debug_msgs:
-                                st.write(msg)
-                else:
-                    st.error("解が見つかりませんでした。条件を緩和してください。")
-                    if debug_msgs:
-                        with st.expander("詳細な理由（可能性）", expanded=True):
-                            for msg in debug_msgs:
-                                st.write(msg)
+                start_generation(days, day_map, ws, hol, shift_types, trigger="manual", reason="生成開始")
+                # 経過表示とお知らせはページ上部に出すので描き直す
+                st.rerun()
 
     if hasattr(st, "fragment"):
         render_result_editor_fragment()
@@ -4705,16 +4529,21 @@ def main():
         st.session_state["end_date"] = end
 
     days, day_map = compute_days(start, end)
-    st.session_state["days_list"] = days
-    st.session_state["day_map"] = day_map
+    set_period_days(days, day_map)
 
     sync_staff_df_schema()
     sync_req_df(days)
     sync_hope_df(days)
 
+    deliver_finished_solve_job()
     maybe_flag_auto_generation()
     maybe_run_auto_generation()
 
+    if st.session_state.get("auto_gen_needed"):
+        render_auto_gen_timer()
+    if st.session_state.get("solve_job") is not None:
+        render_solve_job_status()
+    render_solve_notice()
     render_navbar()
     page = st.session_state.get("page", "home")
 
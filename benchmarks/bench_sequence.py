@@ -0,0 +1,116 @@
+"""連勤上限・禁止遷移の符号化ベンチマーク
+
+線形制約（窓ごとの和・日付ペア）と AddAutomaton で、モデルサイズ・presolve 時間・最初の解までの時間を比べる。
+
+    python -m benchmarks.bench_sequence --staff 100 --transitions 15
+"""
+
+import argparse
+import time
+
+from ortools.sat.python import cp_model
+
+from benchmarks.synthetic import make_problem
+from shift_model import SEQUENCE_ENGINES, build_model
+
+# 禁止遷移の候補（前から順に使う）
+TRANSITIONS = [
+    {"prev": "夜勤", "next": "日勤"},
+    {"prev": "夜勤", "next": "早番"},
+    {"prev": "日勤", "next": "早番"},
+    {"prev": "夜勤", "next": "年休"},
+    {"prev": "夜勤", "next": "代休"},
+    {"prev": "夜勤", "next": "特休"},
+    {"prev": "年休", "next": "夜勤"},
+    {"prev": "代休", "next": "夜勤"},
+    {"prev": "特休", "next": "夜勤"},
+    {"prev": "年休", "next": "早番"},
+    {"prev": "代休", "next": "早番"},
+    {"prev": "特休", "next": "早番"},
+    {"prev": "非番", "next": "早番"},
+    {"prev": "早番", "next": "代休"},
+    {"prev": "早番", "next": "特休"},
+]
+
+
+class FirstSolution(cp_model.CpSolverSolutionCallback):
+    def __init__(self):
+        super().__init__()
+        self.start = time.perf_counter()
+        self.first_sec = None
+
+    def on_solution_callback(self):
+        if self.first_sec is None:
+            self.first_sec = time.perf_counter() - self.start
+
+
+def new_solver(args, **params) -> cp_model.CpSolver:
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = args.time_limit
+    solver.parameters.num_workers = args.workers
+    solver.parameters.random_seed = args.seed
+    for k, v in params.items():
+        setattr(solver.parameters, k, v)
+    return solver
+
+
+def run(problem, engine: str, args) -> dict:
+    t0 = time.perf_counter()
+    built = build_model(problem, sequence_engine=engine)
+    build_sec = time.perf_counter() - t0
+    proto = built.model.Proto()
+
+    # presolve のみ
+    solver = new_solver(args, stop_after_presolve=True)
+    t0 = time.perf_counter()
+    solver.Solve(built.model)
+    presolve_sec = time.perf_counter() - t0
+
+    solver = new_solver(args)
+    cb = FirstSolution()
+    status = solver.Solve(built.model, cb)
+    return {
+        "engine": engine,
+        "vars": len(proto.variables),
+        "constraints": len(proto.constraints),
+        "build_sec": build_sec,
+        "presolve_sec": presolve_sec,
+        "first_sec": cb.first_sec,
+        "solve_sec": solver.WallTime(),
+        "status": solver.StatusName(status),
+        "objective": solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--staff", type=int, default=100)
+    parser.add_argument("--days", type=int, default=35)
+    parser.add_argument("--transitions", type=int, default=15)
+    parser.add_argument("--max-consecutive", type=int, default=5)
+    parser.add_argument("--time-limit", type=float, default=60.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    problem = make_problem(
+        n_staff=args.staff,
+        n_days=args.days,
+        n_order_rules=0,
+        seed=args.seed,
+        max_consecutive_work=args.max_consecutive,
+        prohibited_transitions=TRANSITIONS[: args.transitions],
+    )
+    print(f"staff={args.staff} days={args.days} transitions={len(problem.prohibited_transitions)}")
+    for engine in SEQUENCE_ENGINES:
+        r = run(problem, engine, args)
+        first = "-" if r["first_sec"] is None else f"{r['first_sec']:.2f}s"
+        obj = "-" if r["objective"] is None else f"{r['objective']:.2f}"
+        print(
+            f"{r['engine']:>9}: vars={r['vars']:>7} cons={r['constraints']:>7} build={r['build_sec']:.2f}s "
+            f"presolve={r['presolve_sec']:.2f}s first={first} solve={r['solve_sec']:.2f}s {r['status']} obj={obj}"
+        )
+
+
+if __name__ == "__main__":
+    main()
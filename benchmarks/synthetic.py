@@ -0,0 +1,92 @@
+"""ベンチマーク用の合成シフト条件（Streamlit 不要）"""
+
+import datetime
+import random
+
+import pandas as pd
+
+from shift_model import WEEKDAYS_JP, ScheduleProblem
+
+WORK_SHIFTS = ["日勤", "夜勤", "早番"]
+HOLIDAY_TYPES = ["週休", "非番", "年休", "代休", "特休"]
+
+# 休日順序ルールの候補（HOLIDAY_TYPES の並び順に沿うので互いに矛盾しない）
+ORDER_RULES = [
+    {"pre": "週休", "post": "非番"},
+    {"pre": "週休", "post": "年休"},
+    {"pre": "非番", "post": "年休"},
+    {"pre": "週休", "post": "代休"},
+    {"pre": "非番", "post": "代休"},
+    {"pre": "年休", "post": "代休"},
+    {"pre": "週休", "post": "特休"},
+    {"pre": "非番", "post": "特休"},
+]
+
+
+def make_problem(
+    n_staff: int = 100,
+    n_days: int = 35,
+    n_order_rules: int = 8,
+    start: datetime.date = datetime.date(2026, 4, 26),
+    seed: int = 0,
+    max_consecutive_work: int = 5,
+    prohibited_transitions: list[dict] | None = None,
+) -> ScheduleProblem:
+    rnd = random.Random(seed)
+
+    days = []
+    day_map = {}
+    for k in range(n_days):
+        d = start + datetime.timedelta(days=k)
+        label = f"{d.month}/{d.day}({WEEKDAYS_JP[d.weekday()]})"
+        days.append(label)
+        day_map[label] = d
+
+    rows = []
+    for i in range(n_staff):
+        emp = "パート" if i % 4 == 0 else "正社員"
+        able = {"日勤"} if emp == "パート" else set(rnd.sample(WORK_SHIFTS, rnd.randint(2, 3)))
+        row = {
+            "スタッフ名": f"S{i:03d}",
+            "雇用形態": emp,
+            "最大連勤数": 0,
+            "シフト開始前の連勤数": rnd.randint(0, 3),
+            "シフト開始前の担務/休日": rnd.choice(["", "日勤", "夜勤", "週休"]),
+        }
+        for ws in WORK_SHIFTS:
+            row[ws] = ws in able
+            row[f"{ws}希望度"] = rnd.choice(["低", "中", "高"])
+        for h in ["週休", "非番"]:
+            row[f"週の{h}日数"] = 1
+            row[f"月の{h}日数"] = 4
+            row[f"{h}日数対象"] = "週"
+        rows.append(row)
+    staff_df = pd.DataFrame(rows)
+
+    req_df = pd.DataFrame(0, index=days, columns=WORK_SHIFTS)
+    req_df["日勤"] = max(1, n_staff // 4)
+    req_df["夜勤"] = max(1, n_staff // 8)
+    req_df["早番"] = n_staff // 10
+
+    hope_df = pd.DataFrame("", index=staff_df["スタッフ名"], columns=days)
+    for _ in range(n_staff):
+        hope_df.at[rnd.choice(rows)["スタッフ名"], rnd.choice(days)] = rnd.choice(["休み(全般)", "出勤(全般)"])
+
+    if prohibited_transitions is None:
+        prohibited_transitions = [{"prev": "夜勤", "next": "日勤"}, {"prev": "夜勤", "next": "早番"}]
+
+    return ScheduleProblem(
+        days=days,
+        day_map=day_map,
+        work_shifts=WORK_SHIFTS,
+        holiday_types=HOLIDAY_TYPES,
+        shift_types=WORK_SHIFTS + HOLIDAY_TYPES,
+        staff_df=staff_df,
+        req_df=req_df,
+        hope_df=hope_df,
+        work_shift_properties=[{"名称": ws, "必要人数対象": True} for ws in WORK_SHIFTS],
+        holiday_properties=[{"名称": h, "週回数固定設定": h in ("週休", "非番")} for h in HOLIDAY_TYPES],
+        prohibited_transitions=prohibited_transitions,
+        holiday_order_rules=ORDER_RULES[:n_order_rules],
+        max_consecutive_work=max_consecutive_work,
+    )
@@ -0,0 +1,105 @@
+# result_cache.py - 求解結果のキャッシュ（メモリ上の LRU + ディレクトリ）
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pandas as pd
+
+
+@dataclass
+class CachedResult:
+    result_df: Optional[pd.DataFrame]
+    messages: list[str]
+    stats: dict = field(default_factory=dict)
+
+
+class ResultCache:
+    """キー（入力シグネチャ + ソルバー設定のハッシュ）→ 求解結果
+
+    メモリ上に max_entries 件を LRU で持ち、directory に1件1ファイルの JSON で保存する。
+    ディレクトリ側は更新日時の新しい max_files 件だけ残す。
+    画面側では1つのインスタンスを全セッション（別々のスクリプトスレッド）で共有するので、
+    LRU の操作とファイルの書き込み・整理は _lock の中で行う。
+    """
+
+    def __init__(self, directory: str, max_entries: int = 32, max_files: int = 200):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                df_data = data.get("result")
+                result_df = None
+                if df_data is not None:
+                    result_df = pd.DataFrame(df_data["data"], index=df_data["index"], columns=df_data["columns"])
+                entry = CachedResult(result_df, list(data.get("messages", [])), dict(data.get("stats", {})))
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            except Exception:
+                # 壊れたファイルは使わない
+                return None
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key: str, result_df: Optional[pd.DataFrame], messages: list[str], stats: Optional[dict] = None):
+        entry = CachedResult(
+            None if result_df is None else result_df.copy(),
+            list(messages),
+            dict(stats or {}),
+        )
+        data = {
+            "result": None if result_df is None else json.loads(result_df.to_json(orient="split", force_ascii=False)),
+            "messages": entry.messages,
+            "stats": entry.stats,
+        }
+        with self._lock:
+            self._remember(key, entry)
+            try:
+                tmp_path = self._path(key) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, default=str)
+                os.replace(tmp_path, self._path(key))
+                self._prune_files()
+            except OSError:
+                # 保存に失敗してもメモリ上のキャッシュは使える
+                pass
+
+    def _remember(self, key: str, entry: CachedResult):
+        # _lock の中から呼ぶ
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_files(self):
+        files = [
+            os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".json")
+        ]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime, reverse=True)
+        for path in files[self.max_files:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,1905 @@
+# shift_model.py - Streamlit に依存しないシフト最適化モデル
+import calendar
+import datetime
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from ortools.sat.python import cp_model
+
+try:
+    import jpholiday
+except Exception:
+    jpholiday = None
+
+
+WEEKDAYS_JP = ["月", "火", "水", "木", "金", "土", "日"]
+VACANT_SHIFT = "空き"
+
+VACANCY_POLICY_MAP = {
+    "keep_blank": "空きがあったら、空きを表示する",
+    "assign_specific": "特定の担務や休日を付与する",
+}
+
+# 制約ファミリーごとの扱い（hard: 厳守 / soft: できるだけ守る）
+CONSTRAINT_FAMILIES = {
+    "demand": "必要人数",
+    "weekly_holiday": "週の休日数",
+}
+CONSTRAINT_MODE_LABELS = {
+    "hard": "厳守",
+    "soft": "できるだけ守る",
+}
+DEFAULT_CONSTRAINT_MODES = {family: "hard" for family in CONSTRAINT_FAMILIES}
+
+# CP-SAT の設定プリセット
+# time_base + time_per_var * 変数数 を [time_min, time_max] に収めたものを既定の計算時間にする
+# max_workers は CPU コア数で頭打ちにする
+# 打ち切り条件（0 / None で無効）:
+#   gap_limit: 評価値と上限の相対ギャップがこれ以下になったら止める
+#   plateau_seconds: この秒数だけ改善がなければ止める
+#   penalty_target: 必要人数の不足がなく、違反ペナルティの合計がこれ以下になったら止める
+#     （None で無効。できるだけ守る条件がなくペナルティが常に 0 のモデルでは使わない）
+SOLVER_PRESETS = {
+    "quick": {
+        "label": "下書き（速さ優先）",
+        "max_workers": 8,
+        "linearization_level": 2,
+        "cp_model_presolve": True,
+        "max_presolve_iterations": 1,
+        "time_base": 5.0,
+        "time_per_var": 0.0005,
+        "time_min": 10.0,
+        "time_max": 60.0,
+        "gap_limit": 0.05,
+        "plateau_seconds": 10.0,
+        "penalty_target": None,
+    },
+    "balanced": {
+        "label": "標準",
+        "max_workers": 16,
+        "linearization_level": 2,
+        "cp_model_presolve": True,
+        "max_presolve_iterations": 3,
+        "time_base": 10.0,
+        "time_per_var": 0.002,
+        "time_min": 30.0,
+        "time_max": 300.0,
+        "gap_limit": 0.01,
+        "plateau_seconds": 30.0,
+        "penalty_target": None,
+    },
+    "thorough": {
+        "label": "じっくり（品質優先）",
+        "max_workers": 16,
+        "linearization_level": 2,
+        "cp_model_presolve": True,
+        "max_presolve_iterations": 5,
+        "time_base": 30.0,
+        "time_per_var": 0.005,
+        "time_min": 60.0,
+        "time_max": 900.0,
+        "gap_limit": 0.0,
+        "plateau_seconds": 120.0,
+        "penalty_target": None,
+    },
+}
+DEFAULT_SOLVER_PRESET = "balanced"
+DEFAULT_SOLVER_SETTINGS = {
+    "preset": DEFAULT_SOLVER_PRESET,
+    "time_limit": 0,  # 0 なら変数数から自動で決める
+    "random_seed": 0,
+    "warm_start": True,  # 前回の結果を初期値（ヒント）として使う
+    "hint_repair": False,  # まず変更のあった週以外を前回の結果で固定して解く（変更を最小限にする）
+    "objective_mode": "weighted",  # OBJECTIVE_MODES のキー
+    "sequence_engine": "linear",  # SEQUENCE_ENGINES のキー
+}
+# hint_repair で前回の結果を固定して解く段階の計算時間の上限（秒）
+HINT_FIX_TIME_LIMIT = 10.0
+# 解なしの原因を探す診断の計算時間の上限（秒）と、条件の種類ごとの試し解きの上限（秒）
+DIAGNOSIS_TIME_LIMIT = 30.0
+DIAGNOSIS_PROBE_TIME_LIMIT = 5.0
+# 診断で外して試す条件の種類（build_model(diagnose=True) のグループの分類）
+DIAGNOSIS_FAMILIES = {
+    "hope": "希望シフト",
+    "rule": "個別ルール",
+    "global_rule": "共通ルール",
+    "demand": "必要人数",
+    "ng_pair": "NGペア（絶対NG）",
+    "consecutive": "連勤制限",
+    "transition": "禁止遷移",
+    "period_count": "期間内の回数",
+    "weekly_holiday": "週の休日数",
+    "holiday_order": "休日の順序",
+    "public_holiday": "祝日・代休",
+}
+
+# 目的関数の重み（すべて整数。評価値 = 加点の合計 - 違反ペナルティの合計）
+# 段（tier）ごとに桁を分けている。段の中の重みは項目どうしの比率を表す
+OBJECTIVE_WEIGHTS = {
+    # 段1: 必要人数（「できるだけ守る」のとき、不足・過剰 1人あたりのペナルティ）
+    "demand": 1_000_000,
+    # 段2: 休日数（週は「できるだけ守る」のときの過不足、月は目標とのずれ。1日あたりのペナルティ）
+    "weekly_holiday": 100_000,
+    "monthly_holiday": 50_000,
+    # 段3: 希望・優先
+    "ng_pair_soft": 10_000,  # 「できるだけNG」のペアが同じ日に勤務（ペナルティ）
+    "priority_high": 10_000,  # 共通ルールの「優先（高/中/低）」
+    "priority_mid": 5_000,
+    "priority_low": 1_000,
+    "preference": 100,  # シフト希望度（多め +, 少なめ -）
+    "vacant_keep_blank": 20,  # 空き対応: 空きにする
+    "vacant_default": 2,
+    "vacant_assign_specific": -2,  # 空き対応: 特定の担務で埋める（空きは最終手段）
+    "vacancy_candidate": 24,  # 補完候補の1番目。順位ごとに step ずつ下げ、min で止める
+    "vacancy_candidate_step": 2,
+    "vacancy_candidate_min": 6,
+    "tie_break": 1,  # 解が不定にならないための微小な重み
+}
+# 段の並び順（lexicographic モードではこの順に1段ずつ最適化して値を固定する）
+OBJECTIVE_TIERS = {
+    "demand": "必要人数",
+    "holiday": "休日数",
+    "preference": "希望・優先",
+}
+OBJECTIVE_MODES = {
+    "weighted": "重み付き（一度に解く）",
+    "lexicographic": "優先順に段階的に解く",
+}
+
+
+def safe_int(v, default=0):
+    if pd.isna(v):
+        return default
+    try:
+        return int(v)
+    except Exception:
+        return default
+
+
+def day_label(d: datetime.date, with_year: bool = False) -> str:
+    """日付の表示ラベル（例: 1/5(月)、with_year なら 2026/1/5(月)）"""
+    prefix = f"{d.year}/" if with_year else ""
+    return f"{prefix}{d.month}/{d.day}({WEEKDAYS_JP[d.weekday()]})"
+
+
+def parse_iso_date(value) -> Optional[datetime.date]:
+    """ISO 形式の日付（2026-01-05）を date にする。それ以外は None"""
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+class CalendarIndex:
+    """計画期間の日付の索引: 日番号・曜日・週（日曜始まり）・月・祝日をまとめて1回だけ求める
+
+    中身は日番号（期間の先頭からの日数）と ISO 形式の日付で持ち、「1/5(月)」のような表示ラベルは
+    labels にだけ置く。期間が1年を超えると月日と曜日が同じ日が出てくるので、そのときはラベルに年を付ける。
+    同じ期間なら calendar_index(start, end) が同じものを返すので、画面・モデルの両方で使い回す。
+    """
+
+    def __init__(self, dates: list[datetime.date]):
+        self.dates = list(dates)
+        self.iso = [d.isoformat() for d in self.dates]
+        with_year = bool(self.dates) and (max(self.dates) - min(self.dates)).days >= 365
+        self.labels = [day_label(d, with_year) for d in self.dates]
+        self.day_map = dict(zip(self.labels, self.dates))
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        self.index.update((iso, i) for i, iso in enumerate(self.iso))
+        self._date_index = {d: i for i, d in enumerate(self.dates)}
+        self.weekday = np.array([d.weekday() for d in self.dates], dtype=np.int8)
+        self.holiday = np.zeros(len(self.dates), dtype=bool)
+        if jpholiday:
+            for i, d in enumerate(self.dates):
+                try:
+                    self.holiday[i] = bool(jpholiday.is_holiday(d))
+                except Exception:
+                    pass
+
+        # 週・月は期間内で連続しているので、日番号の範囲（slice）で持つ
+        self.weeks: dict[datetime.date, slice] = {}
+        self.months: dict[tuple[int, int], slice] = {}
+        for i, d in enumerate(self.dates):
+            sunday = d - datetime.timedelta(days=(d.weekday() + 1) % 7)
+            for groups, key in ((self.weeks, sunday), (self.months, (d.year, d.month))):
+                start = groups[key].start if key in groups else i
+                groups[key] = slice(start, i + 1)
+        self._dow_ids = {WEEKDAYS_JP[w]: np.flatnonzero(self.weekday == w).tolist() for w in range(7)}
+        self._dow_ids["全日"] = list(range(len(self.dates)))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def day_index(self, key) -> Optional[int]:
+        """日付・ISO 文字列・表示ラベルのどれかから日番号を引く（期間外なら None）"""
+        if isinstance(key, datetime.date):
+            return self._date_index.get(key)
+        return self.index.get(str(key).strip())
+
+    def label_of(self, key) -> str:
+        """日付・ISO 文字列・表示ラベルを表示用のラベルにする（期間外の ISO はその場で作る）"""
+        i = self.day_index(key)
+        if i is not None:
+            return self.labels[i]
+        d = parse_iso_date(key)
+        return day_label(d, with_year=True) if d else str(key)
+
+    def dow_ids(self, dow: str) -> list[int]:
+        """曜日（または「全日」）に該当する日番号"""
+        return list(self._dow_ids.get(dow, []))
+
+    def is_holiday(self, key) -> bool:
+        """祝日か（期間外の日は False）"""
+        i = self.day_index(key)
+        return i is not None and bool(self.holiday[i])
+
+
+@functools.lru_cache(maxsize=16)
+def calendar_index(start: datetime.date, end: datetime.date) -> CalendarIndex:
+    """start〜end（両端を含む）の CalendarIndex。同じ期間なら作り直さない"""
+    n_days = max(0, (end - start).days + 1)
+    return CalendarIndex([start + datetime.timedelta(days=i) for i in range(n_days)])
+
+
+@dataclass
+class ScheduleProblem:
+    """シフト作成の入力一式。session_state から切り離した純粋なデータ。"""
+
+    days: list[str]
+    day_map: dict[str, datetime.date]
+    work_shifts: list[str]
+    holiday_types: list[str]
+    shift_types: list[str]
+    staff_df: pd.DataFrame
+    req_df: pd.DataFrame
+    hope_df: pd.DataFrame
+    individual_rules_df: pd.DataFrame = field(default_factory=pd.DataFrame)
+    work_shift_properties: list[dict] = field(default_factory=list)
+    holiday_properties: list[dict] = field(default_factory=list)
+    global_rules: list[dict] = field(default_factory=list)
+    ng_pairs: list[dict] = field(default_factory=list)
+    prohibited_transitions: list[dict] = field(default_factory=list)
+    period_counts: dict = field(default_factory=dict)
+    holiday_order_rules: list[dict] = field(default_factory=list)
+    public_holiday_rules: dict = field(default_factory=dict)
+    max_consecutive_work: int = 5
+    vacancy_policy: str = VACANCY_POLICY_MAP["keep_blank"]
+    vacancy_fill_candidates: list = field(default_factory=list)
+    vacancy_target_mode: str = "全員"
+    vacancy_target_value: str = ""
+    constraint_modes: dict = field(default_factory=lambda: dict(DEFAULT_CONSTRAINT_MODES))
+    # compile_rules の結果（None なら最初に使うときに作る）。画面側で作り置きしたものを渡してもよい
+    compiled_rules: Optional["RuleMasks"] = field(default=None, repr=False, compare=False)
+    # build_staff_settings の結果（同上。画面側では staff_df の版ごとに作り置きする）
+    compiled_staff: Optional[dict] = field(default=None, repr=False, compare=False)
+    _calendar: Optional[CalendarIndex] = field(default=None, init=False, repr=False, compare=False)
+    _req: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
+
+    def rule_masks(self, staff_settings: Optional[dict] = None) -> "RuleMasks":
+        """希望・ルール・可能な担務のコンパイル結果（1つの問題につき1回だけ作る）"""
+        if self.compiled_rules is None:
+            self.compiled_rules = compile_rules(self, staff_settings)
+        return self.compiled_rules
+
+    def staff_settings(self) -> dict[str, "StaffSettings"]:
+        """スタッフ名 → StaffSettings（1つの問題につき1回だけ作る）"""
+        if self.compiled_staff is None:
+            self.compiled_staff = build_staff_settings(self)
+        return self.compiled_staff
+
+    @property
+    def staffs(self) -> list[str]:
+        return [n.strip() for n in self.staff_df["スタッフ名"].fillna("").astype(str).tolist() if str(n).strip()]
+
+    @property
+    def target_work_shifts(self) -> list[str]:
+        """必要人数の対象となる担務"""
+        ws_props = {p["名称"]: p for p in self.work_shift_properties}
+        return [ws for ws in self.work_shifts if ws_props.get(ws, {}).get("必要人数対象", True)]
+
+    @property
+    def weekly_holiday_targets(self) -> list[str]:
+        """週・月の日数を設定する休日"""
+        return [
+            x["名称"]
+            for x in self.holiday_properties
+            if x.get("週回数固定設定") and x.get("名称") in self.holiday_types
+        ]
+
+    def constraint_mode(self, family: str) -> str:
+        mode = (self.constraint_modes or {}).get(family, DEFAULT_CONSTRAINT_MODES[family])
+        return mode if mode in CONSTRAINT_MODE_LABELS else DEFAULT_CONSTRAINT_MODES[family]
+
+    def req_matrix(self, shifts: Optional[list[str]] = None) -> np.ndarray:
+        """必要人数を (日, 担務) の整数配列にする。列は shifts（省略時は work_shifts）の順"""
+        if self._req is None:
+            req_df = self.req_df
+            if req_df is None or req_df.empty:
+                self._req = np.zeros((len(self.days), len(self.work_shifts)), dtype=np.int64)
+            else:
+                req_df = req_df[~req_df.index.duplicated()].reindex(index=self.days, columns=self.work_shifts)
+                self._req = req_df.apply(pd.to_numeric, errors="coerce").fillna(0).to_numpy(dtype=np.int64)
+        if shifts is None:
+            return self._req
+        ws_idx = {ws: i for i, ws in enumerate(self.work_shifts)}
+        cols = [ws_idx.get(ws) for ws in shifts]
+        out = np.zeros((len(self.days), len(cols)), dtype=np.int64)
+        for j, c in enumerate(cols):
+            if c is not None:
+                out[:, j] = self._req[:, c]
+        return out
+
+    @property
+    def calendar(self) -> CalendarIndex:
+        """days に対応する CalendarIndex（ふつうは連続した期間なので calendar_index の作り置きを使う）"""
+        if self._calendar is None:
+            dates = [self.day_map[d] for d in self.days]
+            cal = calendar_index(dates[0], dates[-1]) if dates else None
+            if cal is None or cal.dates != dates:
+                cal = CalendarIndex(dates)
+            self._calendar = cal
+        return self._calendar
+
+    def weeks(self) -> dict[datetime.date, list[str]]:
+        """日曜始まりの週ごとの日付ラベル"""
+        return {sunday: self.days[ids] for sunday, ids in self.calendar.weeks.items()}
+
+    def months(self) -> dict[tuple[int, int], list[str]]:
+        return {ym: self.days[ids] for ym, ids in self.calendar.months.items()}
+
+    def day_ids_for_dow(self, dow: str) -> list[int]:
+        """曜日（または「全日」）に該当する日のインデックス"""
+        return self.calendar.dow_ids(dow)
+
+    def hope_matrix(self) -> np.ndarray:
+        """希望シフトを (スタッフ, 日) の文字列配列にする。未入力は空文字。"""
+        hope_df = self.hope_df
+        if hope_df is None or hope_df.empty:
+            return np.full((len(self.staffs), len(self.days)), "", dtype=object)
+        hope_df = hope_df[~hope_df.index.duplicated()]
+        mat = hope_df.reindex(index=self.staffs, columns=self.days).fillna("")
+        return mat.astype(str).apply(lambda col: col.str.strip()).to_numpy(dtype=object)
+
+
+def _var_namer(name_vars: bool):
+    """変数名の生成関数。name_vars=False なら空文字を返し、文字列生成を省く。"""
+    if name_vars:
+        return lambda *parts: "_".join(str(p) for p in parts)
+    return lambda *parts: ""
+
+
+class ShiftVars:
+    """(staff_idx, day_idx, type_idx) → BoolVar の配列
+
+    allowed（(スタッフ, 日, 種別) の bool 配列）を渡すと、取りえない種別には変数を作らず定数 0 を、
+    取りうる種別が1つだけのマスには定数 1 を置く。
+    """
+
+    def __init__(
+        self,
+        model: cp_model.CpModel,
+        staffs: list[str],
+        days: list[str],
+        shift_types: list[str],
+        name_vars: bool = False,
+        allowed: Optional[np.ndarray] = None,
+    ):
+        self.staffs = staffs
+        self.days = days
+        self.shift_types = shift_types
+        self.staff_idx = {s: i for i, s in enumerate(staffs)}
+        self.day_idx = {d: i for i, d in enumerate(days)}
+        self.type_idx = {t: i for i, t in enumerate(shift_types)}
+
+        shape = (len(staffs), len(days), len(shift_types))
+        if allowed is None:
+            allowed = np.ones(shape, dtype=bool)
+        # 変数を作るのは、取りうる種別が2つ以上あるマスの許可された種別だけ
+        free = allowed & (allowed.sum(axis=2, keepdims=True) > 1)
+        self.fixed = (allowed & ~free).astype(np.int64)
+        cells = np.argwhere(free)
+
+        if name_vars:
+            new_vars = [
+                model.NewBoolVar(f"shift_{staffs[si]}_{days[di]}_{shift_types[ti]}") for si, di, ti in cells
+            ]
+        else:
+            new_vars = [model.NewBoolVar("") for _ in range(len(cells))]
+        self.x = np.empty(shape, dtype=object)
+        self.x[...] = 0
+        self.x[self.fixed == 1] = 1
+        self.var_index = np.full(shape, -1, dtype=np.int64)
+        if len(cells):
+            flat = np.empty(len(new_vars), dtype=object)
+            flat[:] = new_vars
+            self.x[free] = flat
+            self.var_index[free] = np.fromiter((v.Index() for v in new_vars), dtype=np.int64, count=len(new_vars))
+        self.free = free
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.x.shape
+
+    def type_ids(self, names) -> list[int]:
+        return [self.type_idx[t] for t in names if t in self.type_idx]
+
+    def cell_literals(self, si: int, di: int) -> list:
+        """そのマスで実際に変数になっている種別"""
+        return self.x[si, di, self.free[si, di]].tolist()
+
+    def solution(self, solver: cp_model.CpSolver) -> np.ndarray:
+        """求解結果を (スタッフ, 日, 種別) の 0/1 配列で返す"""
+        return self.values_from(solver.ResponseProto().solution)
+
+    def values_from(self, solution) -> np.ndarray:
+        """CpSolverResponse.solution（全変数の値）を (スタッフ, 日, 種別) の 0/1 配列にする"""
+        values = np.asarray(solution, dtype=np.int64)
+        if values.size == 0:
+            return self.fixed.copy()
+        return np.where(self.var_index >= 0, values[np.maximum(self.var_index, 0)], self.fixed)
+
+
+def sum_vars(arr) -> cp_model.LinearExpr:
+    return cp_model.LinearExpr.Sum(np.asarray(arr, dtype=object).ravel().tolist())
+
+
+class ConstraintGroups:
+    """診断用: 厳守の制約をまとまり（グループ）ごとに1つの有効化リテラルで切り替えられるようにする
+
+    グループは (分類, キー...) で識別し、同じグループの制約は同じリテラルを共有する。
+    リテラルを仮定（AddAssumptions）として渡して解くと、解なしのときに原因のグループが分かる。
+    """
+
+    def __init__(self, model: cp_model.CpModel):
+        self.model = model
+        self.literals = []
+        self.keys = []
+        self.messages = []
+        self._index = {}
+
+    def guard(self, ct, key: tuple, message: str):
+        """制約 ct を key のグループのリテラルが真のときだけ有効にする"""
+        i = self._index.get(key)
+        if i is None:
+            i = len(self.literals)
+            self._index[key] = i
+            self.literals.append(self.model.NewBoolVar(""))
+            self.keys.append(key)
+            self.messages.append(message)
+        ct.OnlyEnforceIf(self.literals[i])
+        return ct
+
+    def family_indices(self, family: str) -> list[int]:
+        return [i for i, key in enumerate(self.keys) if key[0] == family]
+
+
+@dataclass
+class BuiltModel:
+    """build_model の戻り値。CpModel と変数インデックス、結果抽出に使う付帯情報。"""
+
+    model: cp_model.CpModel
+    vars: ShiftVars
+    staffs: list[str]
+    staff_settings: dict[str, "StaffSettings"]
+    weeks: list[list[int]]
+    months: dict[tuple[int, int], list[int]]
+    # 違反ペナルティの変数インデックスと重み（途中経過でペナルティ合計を出すのに使う）
+    penalty_index: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    penalty_weights: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    # 段（OBJECTIVE_TIERS のキー）ごとの目的関数の項 (変数, 係数)
+    objective_terms: dict = field(default_factory=dict)
+    # diagnose=True で作ったときの制約グループ
+    groups: Optional[ConstraintGroups] = None
+
+    def penalty(self, solution) -> int:
+        values = np.asarray(solution, dtype=np.int64)
+        if values.size == 0 or self.penalty_index.size == 0:
+            return 0
+        return int(values[self.penalty_index] @ self.penalty_weights)
+
+    def objective(self, tiers=None) -> cp_model.LinearExpr:
+        """指定した段（省略時はすべて）の目的関数の式"""
+        obj_vars, obj_coefs = [], []
+        for tier in tiers or OBJECTIVE_TIERS:
+            tier_vars, tier_coefs = self.objective_terms.get(tier, ([], []))
+            obj_vars.extend(tier_vars)
+            obj_coefs.extend(tier_coefs)
+        return cp_model.LinearExpr.WeightedSum(obj_vars, obj_coefs)
+
+
+# 休日の日数を数える単位（スタッフ設定の「〇〇日数対象」）。どちらでもない値は -1 で、日数を数えない
+HOLIDAY_PERIOD_CODES = {"週": 0, "月": 1}
+
+
+class StaffSettings:
+    """スタッフ1人分の設定（staff_df の1行）
+
+    担務は problem.work_shifts、休日は problem.weekly_holiday_targets の並び順の番号で持つ。
+    able_mask は可能な担務のビット列、holiday_* はその休日ごとの日数と数える単位。
+    """
+
+    __slots__ = (
+        "name",
+        "employment_type",
+        "able_mask",
+        "holiday_week",
+        "holiday_month",
+        "holiday_period",
+        "preferences",
+        "prev_consecutive_work",
+        "max_consecutive_work",
+        "prev_shift_type",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        employment_type: str,
+        able_mask: int,
+        holiday_week: np.ndarray,
+        holiday_month: np.ndarray,
+        holiday_period: np.ndarray,
+        preferences: tuple,
+        prev_consecutive_work: int,
+        max_consecutive_work: int,
+        prev_shift_type: str,
+    ):
+        self.name = name
+        self.employment_type = employment_type
+        self.able_mask = able_mask
+        self.holiday_week = holiday_week
+        self.holiday_month = holiday_month
+        self.holiday_period = holiday_period
+        self.preferences = preferences
+        self.prev_consecutive_work = prev_consecutive_work
+        self.max_consecutive_work = max_consecutive_work
+        self.prev_shift_type = prev_shift_type
+
+    def __repr__(self) -> str:
+        return f"StaffSettings({self.name!r}, able=0b{self.able_mask:b})"
+
+    def can_work(self, ws_i: int) -> bool:
+        """work_shifts[ws_i] の担務ができるか"""
+        return bool((self.able_mask >> ws_i) & 1)
+
+    def week_target(self, h_i: int) -> Optional[int]:
+        """weekly_holiday_targets[h_i] の週の日数（週単位で数えない休日なら None）"""
+        if self.holiday_period[h_i] != HOLIDAY_PERIOD_CODES["週"]:
+            return None
+        return int(self.holiday_week[h_i])
+
+    def month_target(self, h_i: int) -> Optional[int]:
+        """weekly_holiday_targets[h_i] の月の日数（月単位で数えない休日なら None）"""
+        if self.holiday_period[h_i] != HOLIDAY_PERIOD_CODES["月"]:
+            return None
+        return int(self.holiday_month[h_i])
+
+
+def _int_column(df: pd.DataFrame, col: str, default: int) -> np.ndarray:
+    """safe_int を列ごとにまとめて行う"""
+    if col not in df.columns:
+        return np.full(len(df), default, dtype=np.int64)
+    values = pd.to_numeric(df[col], errors="coerce").fillna(default)
+    return np.trunc(values.to_numpy(dtype=np.float64)).astype(np.int64)
+
+
+def _str_column(df: pd.DataFrame, col: str, default: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.full(len(df), default, dtype=object)
+    values = df[col].astype(str).str.strip()
+    return values.where(values != "", default).to_numpy(dtype=object)
+
+
+def build_staff_settings(problem: ScheduleProblem) -> dict[str, StaffSettings]:
+    """staff_df を列ごとに1回だけ読んで、スタッフ名 → StaffSettings にする（ふつうは problem.staff_settings() を使う）"""
+    df = problem.staff_df
+    if df is None or df.empty or "スタッフ名" not in df.columns:
+        return {}
+    names = df["スタッフ名"].fillna("").astype(str).str.strip().to_numpy(dtype=object)
+    keep = np.flatnonzero(names != "")
+    df = df.iloc[keep]
+    names = names[keep]
+    targets = problem.weekly_holiday_targets
+
+    able = np.zeros(len(df), dtype=np.int64)
+    for ws_i, ws in enumerate(problem.work_shifts):
+        if ws in df.columns:
+            able |= df[ws].astype(bool).to_numpy().astype(np.int64) << ws_i
+    hol_week = np.zeros((len(df), len(targets)), dtype=np.int16)
+    hol_month = np.zeros((len(df), len(targets)), dtype=np.int16)
+    hol_period = np.zeros((len(df), len(targets)), dtype=np.int8)
+    for h_i, h in enumerate(targets):
+        hol_week[:, h_i] = _int_column(df, f"週の{h}日数", 1)
+        hol_month[:, h_i] = _int_column(df, f"月の{h}日数", 4)
+        hol_period[:, h_i] = [HOLIDAY_PERIOD_CODES.get(v, -1) for v in _str_column(df, f"{h}日数対象", "週")]
+    prefs = list(zip(*(_str_column(df, f"{ws}希望度", "中") for ws in problem.work_shifts))) or [()] * len(df)
+    prev_cons = _int_column(df, "シフト開始前の連勤数", 0)
+    max_cons = _int_column(df, "最大連勤数", 0)
+    prev_type = _str_column(df, "シフト開始前の担務/休日", "")
+    emp = _str_column(df, "雇用形態", "")
+
+    # 同じ名前が複数行あるときは下の行が優先（dict に入れる順）
+    return {
+        name: StaffSettings(
+            name,
+            emp[i],
+            int(able[i]),
+            hol_week[i],
+            hol_month[i],
+            hol_period[i],
+            prefs[i],
+            int(prev_cons[i]),
+            int(max_cons[i]),
+            prev_type[i],
+        )
+        for i, name in enumerate(names)
+    }
+
+
+@dataclass
+class RuleMasks:
+    """可能な担務・希望シフト・個別ルール・共通ルールを (スタッフ, 日, 種別) の配列にまとめたもの
+
+    1マス1種別なので、禁止/固定/休日ならこれのみ・希望・可能な担務は全てマスごとの種別の絞り込みとして表せる。
+    モデル構築・事前チェック・診断・仮の表の表示はすべてここから読む。
+    """
+
+    able: np.ndarray  # 可能な担務だけで絞ったもの（診断では希望・ルールを制約として別に足す）
+    allowed: np.ndarray  # able に希望・個別ルール・共通ルールを重ねたもの
+    priority: np.ndarray  # 共通ルール「優先」の重みの合計（int64）
+    hope: np.ndarray  # 希望シフトの文字列 (スタッフ, 日)
+    fixed_labels: np.ndarray  # 表示用: 希望 > 曜日指定の固定ルール > 全日の固定ルール (スタッフ, 日)
+    restrictions: list = field(default_factory=list)  # rule_restrictions の結果
+
+    @property
+    def forbidden(self) -> np.ndarray:
+        return ~self.allowed
+
+    @property
+    def forced(self) -> np.ndarray:
+        """取りうる種別が1つだけに決まっているマスのその種別"""
+        return self.allowed & (self.allowed.sum(axis=2, keepdims=True) == 1)
+
+
+def compile_rules(problem: ScheduleProblem, staff_settings: Optional[dict] = None) -> RuleMasks:
+    """希望・ルール・可能な担務を1回だけ解釈して RuleMasks にする（ふつうは problem.rule_masks() を使う）"""
+    if staff_settings is None:
+        staff_settings = problem.staff_settings()
+    staffs = problem.staffs
+    type_idx = {t: i for i, t in enumerate(problem.shift_types)}
+    shape = (len(staffs), len(problem.days), len(problem.shift_types))
+
+    # 可能な担務のビット列で、必要人数の対象となる担務のうちできないものを外す
+    target_set = set(problem.target_work_shifts)
+    targets = [(ws_i, type_idx[ws]) for ws_i, ws in enumerate(problem.work_shifts) if ws in target_set and ws in type_idx]
+    able = np.ones(shape, dtype=bool)
+    for si, s in enumerate(staffs):
+        unable = [ti for ws_i, ti in targets if not staff_settings[s].can_work(ws_i)]
+        able[si, :, unable] = False
+
+    hope = problem.hope_matrix()
+    restrictions = list(rule_restrictions(problem, hope))
+    allowed = able.copy()
+    for _, _, staff_ids, day_ids, cell_mask in restrictions:
+        allowed[np.ix_(staff_ids, day_ids)] &= cell_mask
+
+    # 共通ルールの「優先（高/中/低）」
+    priority = np.zeros(shape, dtype=np.int64)
+    for _, rule, staff_ids, day_ids in _global_rule_targets(problem):
+        r_act = rule.get("action") or ""
+        if not r_act.startswith("優先"):
+            continue
+        weight = 0
+        if "高" in r_act:
+            weight = OBJECTIVE_WEIGHTS["priority_high"]
+        elif "中" in r_act:
+            weight = OBJECTIVE_WEIGHTS["priority_mid"]
+        elif "低" in r_act:
+            weight = OBJECTIVE_WEIGHTS["priority_low"]
+        if weight > 0:
+            priority[np.ix_(staff_ids, day_ids, [type_idx[rule["shift"]]])] += weight
+
+    # 仮の表に出す固定ルール: 曜日指定の行を先に、全日の行を後に、それぞれ上の行ほど優先
+    rule_labels = np.full(hope.shape, "", dtype=object)
+    rules_df = problem.individual_rules_df
+    if rules_df is not None and not rules_df.empty:
+        staff_idx = {s: i for i, s in enumerate(staffs)}
+        fixed_rows = [
+            (str(row.get("スタッフ名", "")).strip(), str(row.get("曜日", "")).strip(), str(row.get("希望内容", "")).strip())
+            for _, row in rules_df.iterrows()
+            if str(row.get("ルールタイプ", "")).strip() == "固定"
+        ]
+        for all_days in (False, True):
+            for s, dow, target in fixed_rows:
+                if s not in staff_idx or (dow == "全日") != all_days:
+                    continue
+                day_ids = problem.day_ids_for_dow(dow)
+                cells = rule_labels[staff_idx[s], day_ids]
+                rule_labels[staff_idx[s], day_ids] = np.where(cells == "", target, cells)
+    fixed_labels = np.where(hope != "", hope, rule_labels)
+
+    return RuleMasks(
+        able=able,
+        allowed=allowed,
+        priority=priority,
+        hope=hope,
+        fixed_labels=fixed_labels,
+        restrictions=restrictions,
+    )
+
+
+def _global_rule_targets(problem: ScheduleProblem):
+    """共通ルールごとの (番号, ルール, 対象スタッフ番号, 対象日番号)。対象のないルールは飛ばす"""
+    staffs = problem.staffs
+    type_idx = {t: i for i, t in enumerate(problem.shift_types)}
+    staff_settings = problem.staff_settings()
+    for i, rule in enumerate(problem.global_rules):
+        r_type = rule.get("type")
+        r_val = rule.get("value")
+        r_shift = rule.get("shift")
+        r_emp = rule.get("employment_type")
+        if not r_shift or r_shift not in type_idx:
+            continue
+
+        target_days = []
+        if r_type == "dow" and r_val in WEEKDAYS_JP:
+            target_days = problem.day_ids_for_dow(r_val)
+        elif r_type == "date" and r_val is not None:
+            # 値は ISO 形式の日付（以前のデータは表示ラベル）
+            di = problem.calendar.day_index(r_val)
+            target_days = [] if di is None else [di]
+        if not target_days:
+            continue
+
+        # 雇用形態によるフィルタリング
+        if r_emp and r_emp != "指定なし(全員)":
+            target_staff = [si for si, s in enumerate(staffs) if staff_settings[s].employment_type == r_emp]
+        else:
+            target_staff = list(range(len(staffs)))
+        if not target_staff:
+            continue
+        yield i, rule, target_staff, target_days
+
+
+def rule_restrictions(problem: ScheduleProblem, hope_mat: Optional[np.ndarray] = None):
+    """希望シフト・個別ルール・共通ルールによる種別の絞り込みを1件ずつ返す
+
+    (グループのキー, 説明, スタッフ番号, 日番号, 許される種別の bool 配列) のタプル。
+    """
+    staffs = problem.staffs
+    days = problem.days
+    type_idx = {t: i for i, t in enumerate(problem.shift_types)}
+    staff_idx = {s: i for i, s in enumerate(staffs)}
+    n_types = len(problem.shift_types)
+    W = [type_idx[t] for t in problem.work_shifts if t in type_idx]
+    H = [type_idx[t] for t in problem.holiday_types if t in type_idx]
+
+    def only(ids) -> np.ndarray:
+        m = np.zeros(n_types, dtype=bool)
+        m[ids] = True
+        return m
+
+    def except_(ids) -> np.ndarray:
+        return ~only(ids)
+
+    # 「休み(全般)」「出勤(全般)」または種別名 → 許される種別
+    def target_types(target: str) -> Optional[list[int]]:
+        if target == "休み(全般)":
+            return H
+        if target == "出勤(全般)":
+            return W
+        if target in type_idx:
+            return [type_idx[target]]
+        return None
+
+    if hope_mat is None:
+        hope_mat = problem.hope_matrix()
+    for si, di in zip(*np.nonzero(hope_mat != "")):
+        ids = target_types(hope_mat[si, di])
+        if ids is not None:
+            s, d = staffs[si], days[di]
+            yield ("hope", s, d), f"希望シフト: {s}さんの {d} ({hope_mat[si, di]})", [si], [di], only(ids)
+
+    rules_df = problem.individual_rules_df
+    if rules_df is not None and not rules_df.empty:
+        for i, (_, row) in enumerate(rules_df.iterrows()):
+            s = str(row.get("スタッフ名", "")).strip()
+            dow = str(row.get("曜日", "")).strip()
+            target = str(row.get("希望内容", "")).strip()
+            rule_type = str(row.get("ルールタイプ", "固定")).strip()
+            if not s or s not in staff_idx or not dow or not target:
+                continue
+            ids = target_types(target)
+            if ids is None or rule_type not in ("固定", "不可"):
+                continue
+            day_ids = problem.day_ids_for_dow(dow)
+            if not day_ids:
+                continue
+            cell_mask = only(ids) if rule_type == "固定" else except_(ids)
+            yield ("rule", i), f"ルール: {s}さんの {dow}曜 {target} ({rule_type})", [staff_idx[s]], day_ids, cell_mask
+
+    for i, rule, target_staff, target_days in _global_rule_targets(problem):
+        r_type = rule.get("type")
+        r_val = rule.get("value")
+        r_shift = rule.get("shift")
+        r_act = rule.get("action")
+        ti = type_idx[r_shift]
+
+        if r_act == "禁止":
+            cell_mask = except_([ti])
+        elif r_act == "固定":
+            cell_mask = only([ti])
+        elif r_act == "休日ならこれのみ":
+            # 指定されたシフト以外の全ての休日を禁止
+            cell_mask = except_([hi for hi in H if hi != ti])
+        else:
+            continue
+        label = f"{r_val}曜" if r_type == "dow" else r_val
+        yield ("global_rule", i), f"共通ルール: {label} の {r_shift} {r_act}", target_staff, target_days, cell_mask
+
+
+@dataclass
+class CapacityCheck:
+    """check_capacity の結果"""
+
+    messages: list[str]
+    # 厳守の条件だけで解なしが確定している（CP-SAT を回すまでもない）
+    infeasible: bool = False
+
+
+# 担務の組み合わせを全部調べるのはこの数まで（超えたら1つずつと全体だけ）
+CAPACITY_SUBSET_LIMIT = 10
+
+
+def _shift_subsets(k: int) -> np.ndarray:
+    """k 個の担務の空でない組み合わせを (組, 担務) の bool 配列で返す（少ない順）"""
+    if k <= CAPACITY_SUBSET_LIMIT:
+        codes = np.arange(1, 2 ** k)
+        subsets = (codes[:, None] >> np.arange(k)[None, :]) & 1 == 1
+        return subsets[np.argsort(subsets.sum(axis=1), kind="stable")]
+    return np.vstack([np.eye(k, dtype=bool), np.ones((1, k), dtype=bool)])
+
+
+def check_capacity(
+    problem: ScheduleProblem, staff_settings: Optional[dict] = None, allowed: Optional[np.ndarray] = None
+) -> CapacityCheck:
+    """事前チェック: 必要人数を満たせるだけの人手があるか（モデルを作らずに NumPy だけで判定する）
+
+    1. 日ごと: 担務の組み合わせ A ごとに「A のどれかに入れる人数 >= A の必要人数の合計」。
+       1人1日1種別なので、これが全ての A で成り立つことが割り当てが存在する条件（Hall の条件）。
+       同じ人を日勤と夜勤の両方で数えてしまうような見落としがなくなる。
+       逆に「A にしか入れない人数 <= A の必要人数の合計」も見る（必要人数はちょうど、0 は常に厳守のため）。
+    2. 週・期間: 休日数（週の回数・期間内の回数）を差し引いた勤務できる人日 >= 必要人数の人日
+    いずれも可能な担務・希望シフト・ルールだけを見た必要条件なので、通っても解があるとは限らない。
+    """
+    if staff_settings is None:
+        staff_settings = problem.staff_settings()
+    if allowed is None:
+        allowed = problem.rule_masks(staff_settings).allowed
+    staffs = problem.staffs
+    days = problem.days
+    type_idx = {t: i for i, t in enumerate(problem.shift_types)}
+    target = [ws for ws in problem.target_work_shifts if ws in type_idx]
+    messages = []
+    infeasible = False
+    if not staffs or not days:
+        return CapacityCheck(messages)
+    demand_hard = problem.constraint_mode("demand") != "soft"
+
+    # 取りうる種別が1つもないマス（希望とルールの食い違いなど）
+    empty = ~allowed.any(axis=2)
+    for si, di in zip(*np.nonzero(empty)):
+        messages.append(f"・{staffs[si]}さんの {days[di]}: 希望シフトやルールが重なり、取れるシフトがありません。")
+        infeasible = True
+    if not target:
+        return CapacityCheck(messages, infeasible)
+
+    target_ids = [type_idx[ws] for ws in target]
+    req = problem.req_matrix(target)
+    can = allowed[:, :, target_ids].transpose(1, 0, 2)  # (日, スタッフ, 担務)
+    other_ids = [i for i in range(len(problem.shift_types)) if i not in set(target_ids)]
+    has_other = allowed[:, :, other_ids].any(axis=2).T if other_ids else np.zeros(can.shape[:2], dtype=bool)
+
+    subsets = _shift_subsets(len(target))  # (組, 担務)
+    names = np.array(target, dtype=object)
+    need = req @ subsets.T  # (日, 組)
+    can_i = can.astype(np.int64)
+    reach = ((can_i @ subsets.T) > 0).sum(axis=1)  # A のどれかに入れる人数
+    outside = can_i @ (~subsets).T  # A 以外の担務に入れる数
+    only = ((outside == 0) & ~has_other[:, :, None] & can.any(axis=2)[:, :, None]).sum(axis=1)  # A にしか入れない人数
+
+    shortage = need - reach
+    excess = only - need
+    # 必要人数0の担務だけの組は、モードに関わらず厳守
+    zero_only = need == 0
+    single = subsets.sum(axis=1) == 1
+    for di, d in enumerate(days):
+        # 1つの担務で足りないならそれを全部、なければ組み合わせで一番足りないものを1件
+        short = np.nonzero((shortage[di] > 0) & single)[0]
+        if len(short) == 0 and (shortage[di] > 0).any():
+            short = [int(np.argmax(shortage[di]))]
+        for p in short:
+            ws_names = names[subsets[p]]
+            if len(ws_names) == 1:
+                messages.append(f"・{d} の「{ws_names[0]}」: 目標 {need[di, p]}名 に対し、勤務可能なスタッフが {reach[di, p]}名 しかいません。")
+            else:
+                messages.append(
+                    f"・{d} の「{'・'.join(ws_names)}」: 目標 合計{need[di, p]}名 に対し、"
+                    f"どれかに入れるスタッフが {reach[di, p]}名 しかいません（1人が入れるのは1日1つです）。"
+                )
+            infeasible |= demand_hard
+
+        over = np.nonzero((excess[di] > 0) & (demand_hard | zero_only[di]))[0]
+        if len(over):
+            p = over[np.argmax(excess[di, over])]
+            ws_names = "・".join(names[subsets[p]])
+            messages.append(
+                f"・{d} の「{ws_names}」: 目標 {need[di, p]}名 に対し、"
+                f"希望シフトやルールでここにしか入れないスタッフが {only[di, p]}名 います。"
+            )
+            infeasible = True
+
+    # 週・期間: 休日数を引いた勤務できる日数の上限
+    weeks = [list(range(ids.start, ids.stop)) for ids in problem.calendar.weeks.values()]
+    workable = can.any(axis=2).T  # (スタッフ, 日)
+    weekly_hard = problem.constraint_mode("weekly_holiday") != "soft"
+    holiday_set = set(problem.holiday_types)
+    cap_staff = np.zeros(len(staffs), dtype=np.int64)
+    # 週単位で数える休日の日数の合計（スタッフごと）
+    week_code = HOLIDAY_PERIOD_CODES["週"]
+    rest = np.array(
+        [
+            int(np.where(staff_settings[s].holiday_period == week_code, staff_settings[s].holiday_week, 0).sum())
+            for s in staffs
+        ],
+        dtype=np.int64,
+    )
+    for w_ids in weeks:
+        cap_week = workable[:, w_ids].sum(axis=1)
+        if weekly_hard and len(w_ids) == 7:
+            cap_week = np.minimum(cap_week, np.clip(7 - rest, 0, None))
+        cap_staff += cap_week
+        week_need = int(req[w_ids].sum())
+        if week_need > int(cap_week.sum()):
+            messages.append(
+                f"・{days[w_ids[0]]} からの週: 必要人数の合計 {week_need}人日 に対し、"
+                f"休日数を差し引くと勤務できるのは最大 {int(cap_week.sum())}人日 です。"
+            )
+            infeasible |= demand_hard
+
+    # 期間内の回数で休日が決まっている分
+    period_rest = np.array(
+        [
+            sum(int(c) for t, c in problem.period_counts.get(s, {}).items() if t in holiday_set)
+            for s in staffs
+        ],
+        dtype=np.int64,
+    )
+    cap_staff = np.minimum(cap_staff, np.clip(len(days) - period_rest, 0, None))
+    total_need = int(req.sum())
+    if total_need > int(cap_staff.sum()):
+        messages.append(
+            f"・期間全体: 必要人数の合計 {total_need}人日 に対し、"
+            f"休日数を差し引くと勤務できるのは最大 {int(cap_staff.sum())}人日 です。"
+        )
+        infeasible |= demand_hard
+    return CapacityCheck(messages, infeasible)
+
+
+# 連勤上限・禁止遷移の表し方（solver_settings["sequence_engine"]）。受け付ける並びはどちらも同じ
+SEQUENCE_ENGINES = {
+    "linear": "線形制約（標準）",
+    "automaton": "オートマトン（AddAutomaton）",
+}
+
+
+def _max_consecutive(problem: ScheduleProblem, settings: StaffSettings) -> int:
+    s_max = settings.max_consecutive_work
+    return s_max if s_max > 0 else int(problem.max_consecutive_work)
+
+
+def _transition_rules(problem: ScheduleProblem, sv: ShiftVars) -> list[tuple[str, Optional[int], Optional[int]]]:
+    return [
+        (p["prev"], sv.type_idx.get(p["prev"]), sv.type_idx.get(p["next"]))
+        for p in problem.prohibited_transitions
+    ]
+
+
+def _add_sequence_linear(
+    model,
+    x_s,
+    W,
+    settings: StaffSettings,
+    max_cons: int,
+    transitions,
+    groups: Optional[ConstraintGroups] = None,
+    label: str = "",
+    type_names=(),
+) -> None:
+    """連勤上限と禁止遷移を窓ごとの和・日付ペアの線形制約で表す（従来方式）
+
+    groups を渡すと、スタッフ（label）の連勤上限・禁止遷移ごとのグループにする（診断用）。
+    """
+    n_days = x_s.shape[0]
+
+    def guard_transition(ct, prev_name, ni):
+        if groups is not None:
+            groups.guard(ct, ("transition", label, prev_name, ni), f"禁止遷移: {label}さんの {prev_name}→{type_names[ni]}")
+
+    # 月初の「前日→初日」も禁止遷移に含める
+    prev_shift_type = settings.prev_shift_type
+    if prev_shift_type and n_days:
+        for prev_name, _, ni in transitions:
+            if prev_name == prev_shift_type and ni is not None:
+                guard_transition(model.Add(x_s[0, ni] == 0), prev_name, ni)
+    for di in range(n_days - 1):
+        for prev_name, pi, ni in transitions:
+            if pi is not None and ni is not None:
+                prev_lit, next_lit = x_s[di, pi], x_s[di + 1, ni]
+                # 取りえない種別（定数 0）が絡む組は常に満たされる
+                if isinstance(prev_lit, int) and prev_lit == 0 or isinstance(next_lit, int) and next_lit == 0:
+                    continue
+                guard_transition(model.Add(prev_lit + next_lit <= 1), prev_name, ni)
+
+    def guard_consecutive(ct):
+        if groups is not None:
+            groups.guard(ct, ("consecutive", label), f"連勤制限: {label}さん (最大{max_cons}連勤)")
+
+    window_len = max_cons + 1
+    prev_work = settings.prev_consecutive_work
+    if prev_work > 0:
+        limit = window_len - prev_work
+        if 0 < limit <= n_days:
+            guard_consecutive(model.Add(sum_vars(x_s[:limit][:, W]) <= limit - 1))
+
+    for i in range(n_days - max_cons):
+        guard_consecutive(model.Add(sum_vars(x_s[i : i + window_len][:, W]) <= max_cons))
+
+
+def _add_sequence_automaton(model, x_s, W, settings: StaffSettings, max_cons: int, transitions, vname, label: str) -> None:
+    """連勤上限・開始前の引き継ぎ・禁止遷移を1本のオートマトン（AddAutomaton）にまとめる
+
+    状態は (現在の連勤日数, 直前の種別) 。直前の種別は禁止遷移の「前」に出てくるものだけ区別する。
+    """
+    n_days, n_types = x_s.shape
+    if n_days == 0:
+        return
+
+    work_ids = set(W)
+    forbidden = {}
+    for prev_name, pi, ni in transitions:
+        if ni is not None:
+            forbidden.setdefault(prev_name, set()).add(ni)
+    type_names = {}
+    for prev_name, pi, _ in transitions:
+        if pi is not None:
+            type_names[pi] = prev_name
+
+    # 開始前の連勤数が上限を超えている場合は従来どおり引き継がない
+    prev_work = settings.prev_consecutive_work
+    run0 = prev_work if 0 < prev_work <= max_cons else 0
+    last0 = settings.prev_shift_type or None
+    start = (run0, last0 if last0 in forbidden else None)
+
+    state_ids = {start: 0}
+    triples = []
+    queue = [start]
+    while queue:
+        state = queue.pop()
+        run, last = state
+        banned = forbidden.get(last, set())
+        for t in range(n_types):
+            if t in banned:
+                continue
+            if t in work_ids:
+                if run + 1 > max_cons:
+                    continue
+                nxt_run = run + 1
+            else:
+                nxt_run = 0
+            nxt_last = type_names.get(t)
+            nxt = (nxt_run, nxt_last if nxt_last in forbidden else None)
+            if nxt not in state_ids:
+                state_ids[nxt] = len(state_ids)
+                queue.append(nxt)
+            triples.append((state_ids[state], t, state_ids[nxt]))
+
+    # 日ごとの種別インデックスを作り、0/1 変数と対応づける
+    seq = []
+    for di in range(n_days):
+        y = model.NewIntVar(0, n_types - 1, vname("seq", label, di))
+        model.Add(y == cp_model.LinearExpr.WeightedSum(x_s[di].tolist(), list(range(n_types))))
+        seq.append(y)
+    model.AddAutomaton(seq, 0, list(state_ids.values()), triples)
+
+
+def build_model(
+    problem: ScheduleProblem,
+    name_vars: bool = False,
+    sequence_engine: str = "linear",
+    diagnose: bool = False,
+) -> BuiltModel:
+    """ScheduleProblem から CP-SAT モデルを構築する（求解はしない）
+
+    name_vars=True で変数に名前を付ける（デバッグ・モデル出力用）。本番では省略して構築を軽くする。
+    sequence_engine は連勤上限・禁止遷移の表し方（"automaton" / "linear"）。
+    diagnose=True なら厳守の制約をグループごとの有効化リテラル付きで作る（built.groups。解なしの診断用）。
+    """
+    if sequence_engine not in SEQUENCE_ENGINES:
+        raise ValueError(f"unknown sequence_engine: {sequence_engine}")
+    days = problem.days
+    shift_types = problem.shift_types
+    staffs_local = problem.staffs
+    staff_settings = problem.staff_settings()
+    vname = _var_namer(name_vars)
+
+    model = cp_model.CpModel()
+    groups = ConstraintGroups(model) if diagnose else None
+    # 可能な担務・希望・個別ルール・共通ルールで決まる種別の絞り込みは、変数を作る前に済ませる
+    # （診断時は希望・ルールを外せるように、マスごとの制約として足す）
+    masks = problem.rule_masks(staff_settings)
+    sv = ShiftVars(model, staffs_local, days, shift_types, name_vars=name_vars, allowed=masks.able if diagnose else masks.allowed)
+    x = sv.x
+    n_staff, n_days, _ = sv.shape
+    W = sv.type_ids(problem.work_shifts)
+    H = sv.type_ids(problem.holiday_types)
+    if groups is not None:
+        for key, message, staff_ids, day_ids, cell_mask in masks.restrictions:
+            banned = np.flatnonzero(~cell_mask)
+            for si in staff_ids:
+                for di in day_ids:
+                    groups.guard(model.Add(sum_vars(x[si, di, banned]) == 0), key, message)
+    objective_terms = {tier: ([], []) for tier in OBJECTIVE_TIERS}
+    # 違反ペナルティ（目的関数には -weight で入る）
+    penalty_vars = []
+    penalty_weights = []
+
+    def add_penalty(tier: str, var, weight: int):
+        penalty_vars.append(var)
+        penalty_weights.append(weight)
+        objective_terms[tier][0].append(var)
+        objective_terms[tier][1].append(-weight)
+
+    forced = sv.fixed.any(axis=2)
+    for si in range(n_staff):
+        for di in range(n_days):
+            if not forced[si, di]:
+                # 取りうる種別がないマスは空の ExactlyOne になり、解なしになる
+                model.AddExactlyOne(sv.cell_literals(si, di))
+
+    demand_soft = problem.constraint_mode("demand") == "soft"
+    req_mat = problem.req_matrix(problem.target_work_shifts)
+    for di, d in enumerate(days):
+        for wi, ws in enumerate(problem.target_work_shifts):
+            ti = sv.type_idx[ws]
+            req = int(req_mat[di, wi])
+            assigned = sum_vars(x[:, di, ti])
+
+            if req > 0 and demand_soft:
+                # できるだけ守る: 不足・過剰を片側のスラックで表し、大きなペナルティを与える
+                shortage = model.NewIntVar(0, req, vname("short", d, ws))
+                excess = model.NewIntVar(0, max(0, n_staff - req), vname("excess", d, ws))
+                model.Add(assigned + shortage - excess == req)
+                add_penalty("demand", shortage, OBJECTIVE_WEIGHTS["demand"])
+                add_penalty("demand", excess, OBJECTIVE_WEIGHTS["demand"])
+            else:
+                # 厳守（必要人数0なら0人で固定。ここはモードに関わらず厳守）
+                ct = model.Add(assigned == req)
+                if groups is not None:
+                    if req == 0:
+                        groups.guard(ct, ("demand", d, ws), f"募集なしシフト: {d} の {ws} (目標配置数0)")
+                    else:
+                        groups.guard(ct, ("demand", d, ws), f"必要人数: {d} の {ws} ({req}名)")
+
+    hope_mat = masks.hope
+
+    # 共通ルールの「優先」（禁止・固定・休日ならこれのみは masks.allowed で反映済み）
+    for si, di, ti in np.argwhere(masks.priority > 0):
+        objective_terms["preference"][0].append(x[si, di, ti])
+        objective_terms["preference"][1].append(int(masks.priority[si, di, ti]))
+
+    for pair_i, pair in enumerate(problem.ng_pairs):
+        s1, s2 = pair.get("スタッフA"), pair.get("スタッフB")
+        p_type = pair.get("type", "絶対NG")
+
+        if s1 in sv.staff_idx and s2 in sv.staff_idx and s1 != s2:
+            a, b = sv.staff_idx[s1], sv.staff_idx[s2]
+            for di, d in enumerate(days):
+                both_work = sum_vars(x[[a, b]][:, di, W])
+
+                if p_type == "できるだけNG":
+                    # Penalty if both work: term_a + term_b <= 1 + both_flg
+                    both_flg = model.NewBoolVar(vname("both", s1, s2, d))
+                    model.Add(both_work <= 1 + both_flg)
+                    add_penalty("preference", both_flg, OBJECTIVE_WEIGHTS["ng_pair_soft"])
+                else:
+                    # Absolute NG (Hard Constraint)
+                    ct = model.Add(both_work <= 1)
+                    if groups is not None:
+                        groups.guard(ct, ("ng_pair", pair_i), f"NGペア: {s1}さんと{s2}さん")
+
+    # 連勤上限・禁止遷移（開始前の連勤数・担務の引き継ぎを含む）
+    transitions = _transition_rules(problem, sv)
+    for si, s in enumerate(staffs_local):
+        max_cons = _max_consecutive(problem, staff_settings[s])
+        if sequence_engine == "automaton" and groups is None:
+            _add_sequence_automaton(model, x[si], W, staff_settings[s], max_cons, transitions, vname, s)
+        else:
+            _add_sequence_linear(model, x[si], W, staff_settings[s], max_cons, transitions, groups, s, shift_types)
+
+    # 期間内の回数指定（Hard制約）
+    # ただし、希望シフトで指定された回数が設定値を上回る場合は、希望シフトの回数を優先（適用）する
+    period_counts = problem.period_counts
+    for si, s in enumerate(staffs_local):
+        if s in period_counts:
+            for t_type, count in period_counts[s].items():
+                if t_type in sv.type_idx:
+                    # 希望シフトでの指定回数をカウント
+                    hope_count = int(np.count_nonzero(hope_mat[si] == t_type))
+
+                    # 設定値と希望数の大きい方を採用
+                    target_count = max(int(count), hope_count)
+                    ct = model.Add(sum_vars(x[si, :, sv.type_idx[t_type]]) == target_count)
+                    if groups is not None:
+                        groups.guard(ct, ("period_count", s, t_type), f"期間内の回数: {s}さんの {t_type} ({target_count}回)")
+
+    weeks = [list(range(ids.start, ids.stop)) for ids in problem.calendar.weeks.values()]
+
+    weekly_holiday_targets = problem.weekly_holiday_targets
+    weekly_soft = problem.constraint_mode("weekly_holiday") == "soft"
+    for si, s in enumerate(staffs_local):
+        for w_ids in weeks:
+            for h_i, h in enumerate(weekly_holiday_targets):
+                req_count = staff_settings[s].week_target(h_i)
+                if req_count is None:
+                    continue
+                actual_sum = sum_vars(x[si, w_ids, sv.type_idx[h]])
+                w_label = days[w_ids[0]]
+                n_w = len(w_ids)
+
+                if not weekly_soft:
+                    # 厳守: 7日ある週はちょうど、半端な週は上限のみ
+                    if n_w == 7:
+                        ct = model.Add(actual_sum == req_count)
+                    else:
+                        ct = model.Add(actual_sum <= req_count)
+                    if groups is not None:
+                        groups.guard(ct, ("weekly_holiday", s, h), f"週の休日数: {s}さんの {h} (週{req_count}回)")
+                    continue
+
+                # できるだけ守る: 違反分だけ大きなペナルティ
+                excess = model.NewIntVar(0, n_w, vname("excess", s, h, w_label))
+                if n_w == 7:
+                    shortage = model.NewIntVar(0, max(0, req_count), vname("short", s, h, w_label))
+                    model.Add(actual_sum + shortage - excess == req_count)
+                    add_penalty("holiday", shortage, OBJECTIVE_WEIGHTS["weekly_holiday"])
+                else:
+                    # 半端な週は req_count を超えた分だけペナルティ
+                    model.Add(actual_sum - excess <= req_count)
+                add_penalty("holiday", excess, OBJECTIVE_WEIGHTS["weekly_holiday"])
+
+    # Monthly holiday count constraints (soft)
+    months = {ym: list(range(ids.start, ids.stop)) for ym, ids in problem.calendar.months.items()}
+
+    for si, s in enumerate(staffs_local):
+        for (y, m), m_ids in months.items():
+            for h_i, h in enumerate(weekly_holiday_targets):
+                req_count = staff_settings[s].month_target(h_i)
+                if req_count is None:
+                    continue
+                actual_sum = sum_vars(x[si, m_ids, sv.type_idx[h]])
+
+                # Soft constraint only: allow any count, penalize deviation from target.
+                actual_var = model.NewIntVar(0, len(m_ids), vname("act_m", s, h, y, m))
+                model.Add(actual_var == actual_sum)
+                diff_var = model.NewIntVar(-len(m_ids), len(m_ids), vname("diff_m", s, h, y, m))
+                model.Add(diff_var == actual_var - req_count)
+                abs_diff = model.NewIntVar(0, len(m_ids), vname("abs_m", s, h, y, m))
+                model.AddAbsEquality(abs_diff, diff_var)
+                add_penalty("holiday", abs_diff, OBJECTIVE_WEIGHTS["monthly_holiday"])
+
+    # --- 休日順序ルール (Holiday Order Rules) ---
+    # 週単位で「Pre」が「Post」より先（または同時）でなければならない
+    # => 同じ週内で「Post」を取った日より後に「Pre」を置くことを禁止
+    # 日付ペアを全て並べる代わりに、週ごとに「その日より前に Post を取ったか」の
+    # 累積フラグ seen[k] を作り、x[Pre, k] + seen[k] <= 1 とする（週の日数に比例したサイズ）
+    # 同じ Post のルールはフラグを共有する。Pre は1日に1つしか立たないので1本の制約にまとめる
+    order_pres = {}
+    for r in problem.holiday_order_rules:
+        pre, post = r.get("pre"), r.get("post")
+        if pre in sv.type_idx and post in sv.type_idx:
+            order_pres.setdefault(sv.type_idx[post], set()).add(sv.type_idx[pre])
+    if order_pres:
+        for si, s in enumerate(staffs_local):
+            for w_ids in weeks:
+                n_w = len(w_ids)
+                if n_w < 2:
+                    continue
+
+                for post_i, pre_ids in order_pres.items():
+                    pre_ids = sorted(pre_ids)
+                    seen = x[si, w_ids[0], post_i]
+                    for k in range(1, n_w):
+                        if k > 1:
+                            # seen[k] = seen[k-1] OR x[Post, k-1]（下から押さえるだけで十分）
+                            nxt = model.NewBoolVar(vname("post_seen", s, days[w_ids[k]], shift_types[post_i]))
+                            model.Add(nxt >= seen)
+                            model.Add(nxt >= x[si, w_ids[k - 1], post_i])
+                            seen = nxt
+                        ct = model.Add(sum_vars(x[si, w_ids[k], pre_ids]) + seen <= 1)
+                        if groups is not None:
+                            groups.guard(ct, ("holiday_order", s), f"休日の順序: {s}さん")
+
+    # --- 祝日・代休ルール ---
+    ph_rules = problem.public_holiday_rules
+    if ph_rules.get("enabled", False) and jpholiday:
+        target_emps = ph_rules.get("target_employments", [])
+        comp_type = ph_rules.get("comp_holiday_type", "")
+
+        # 期間内の祝日を取得
+        public_holidays = set(np.flatnonzero(problem.calendar.holiday).tolist())
+
+        if comp_type in sv.type_idx and public_holidays:
+            ci = sv.type_idx[comp_type]
+            for si, s in enumerate(staffs_local):
+                # 雇用形態チェック
+                s_emp = staff_settings[s].employment_type
+                if target_emps and s_emp not in target_emps:
+                    continue
+
+                # 代休の残り日数（祝日勤務で+1、代休取得で-1）を日ごとの変数で持つ
+                # balance[d] = balance[d-1] + 祝日勤務[d] - 代休[d]、balance >= 0
+                # これにより「先取り」を禁止し、「後から（または同時）」のみ許可
+                # ※同時はシフト排他制御により不可なので、実質「後から」になる
+                balance = 0
+                ph_so_far = 0
+                for di in range(n_days):
+                    if di in public_holidays:
+                        ph_so_far += 1
+                        # 全ての勤務シフトについて和をとる (Work Shiftであればカウント)
+                        earned = sum_vars(x[si, di, W])
+                    else:
+                        earned = 0
+                    next_balance = model.NewIntVar(0, ph_so_far, vname("comp_balance", s, days[di]))
+                    ct = model.Add(next_balance == balance + earned - x[si, di, ci])
+                    if groups is not None:
+                        groups.guard(ct, ("public_holiday", s), f"祝日・代休: {s}さん")
+                    balance = next_balance
+
+                # 期間終了時に精算完了していること
+                ct = model.Add(balance == 0)
+                if groups is not None:
+                    groups.guard(ct, ("public_holiday", s), f"祝日・代休: {s}さん")
+
+    vacancy_policy = problem.vacancy_policy
+    vacancy_candidates = problem.vacancy_fill_candidates
+    pref_weights = {"低": -OBJECTIVE_WEIGHTS["preference"], "中": 0, "高": OBJECTIVE_WEIGHTS["preference"]}
+
+    def priority_weight(idx: int, base: int, step: int, min_w: int) -> int:
+        return max(min_w, base - (idx * step))
+
+    vacant_weight = OBJECTIVE_WEIGHTS["vacant_default"]
+    if vacancy_policy == VACANCY_POLICY_MAP["keep_blank"]:
+        vacant_weight = OBJECTIVE_WEIGHTS["vacant_keep_blank"]
+    elif vacancy_policy == VACANCY_POLICY_MAP["assign_specific"]:
+        # 空きは最終手段にしたいのでマイナス寄りにする
+        vacant_weight = OBJECTIVE_WEIGHTS["vacant_assign_specific"]
+
+    candidate_weights = []
+    for idx, cand in enumerate(vacancy_candidates):
+        if isinstance(cand, dict):
+            c_shift = str(cand.get("shift", "")).strip()
+        else:
+            c_shift = str(cand).strip()
+        if c_shift in sv.type_idx:
+            candidate_weights.append(
+                (
+                    sv.type_idx[c_shift],
+                    priority_weight(
+                        idx,
+                        base=OBJECTIVE_WEIGHTS["vacancy_candidate"],
+                        step=OBJECTIVE_WEIGHTS["vacancy_candidate_step"],
+                        min_w=OBJECTIVE_WEIGHTS["vacancy_candidate_min"],
+                    ),
+                )
+            )
+    vacant_i = sv.type_idx.get(VACANT_SHIFT)
+
+    for si, s in enumerate(staffs_local):
+        # スタッフ単位で日ごとに同じ重みになるので、(種別 → 重み) をまとめてから全日に展開する
+        type_weights = []
+
+        # 0. シフト希望度（なるべく少なめ/多め）
+        for ws, pref in zip(problem.work_shifts, staff_settings[s].preferences):
+            w = pref_weights.get(pref, 0)
+            if w != 0:
+                type_weights.append((sv.type_idx[ws], w))
+
+        # 1. 空き対応の方針に応じた補完
+        # スタッフごとの適用判断
+        apply_specific = False
+        current_vacant_weight = vacant_weight
+
+        if vacancy_policy == VACANCY_POLICY_MAP["assign_specific"]:
+            target_mode = problem.vacancy_target_mode
+            target_val = problem.vacancy_target_value
+
+            if target_mode == "全員":
+                apply_specific = True
+            elif target_mode == "雇用形態":
+                s_emp = staff_settings[s].employment_type
+                if s_emp == target_val:
+                    apply_specific = True
+            elif target_mode == "スタッフ":
+                if s == target_val:
+                    apply_specific = True
+
+            # 対象外の場合はデフォルトの「空きにする(keep_blank)」挙動に戻す
+            if not apply_specific:
+                current_vacant_weight = OBJECTIVE_WEIGHTS["vacant_keep_blank"]
+
+        if vacant_i is not None and current_vacant_weight > 0:
+            type_weights.append((vacant_i, current_vacant_weight))
+
+        if apply_specific:
+            type_weights.extend(candidate_weights)
+
+        # 2. その他のシフト（不定を防ぐための微小な重み）
+        for ti, t in enumerate(shift_types):
+            if t != VACANT_SHIFT:
+                type_weights.append((ti, OBJECTIVE_WEIGHTS["tie_break"]))
+
+        for ti, w in type_weights:
+            objective_terms["preference"][0].extend(x[si, :, ti].tolist())
+            objective_terms["preference"][1].extend([w] * n_days)
+
+    built = BuiltModel(
+        model=model,
+        vars=sv,
+        staffs=staffs_local,
+        staff_settings=staff_settings,
+        weeks=weeks,
+        months=months,
+        penalty_index=np.array([v.Index() for v in penalty_vars], dtype=np.int64),
+        penalty_weights=np.array(penalty_weights, dtype=np.int64),
+        objective_terms=objective_terms,
+        groups=groups,
+    )
+    model.Maximize(built.objective())
+    return built
+
+
+def extract_solution(problem: ScheduleProblem, built: BuiltModel, solver: cp_model.CpSolver) -> tuple[pd.DataFrame, list[str]]:
+    """求解済みの solver から結果表とお知らせ（休日回数・人数の過不足）を作る"""
+    return extract_values(problem, built, built.vars.solution(solver))
+
+
+def extract_values(problem: ScheduleProblem, built: BuiltModel, values: np.ndarray) -> tuple[pd.DataFrame, list[str]]:
+    """(スタッフ, 日, 種別) の 0/1 配列から結果表とお知らせを作る"""
+    sv = built.vars
+    staff_settings = built.staff_settings
+    days = problem.days
+    weekly_holiday_targets = problem.weekly_holiday_targets
+    messages = []
+
+    # ソフト制約（休日回数）の違反チェック
+    for si, s in enumerate(built.staffs):
+        for w_ids in built.weeks:
+            if len(w_ids) == 7:
+                for h_i, h in enumerate(weekly_holiday_targets):
+                    req = staff_settings[s].week_target(h_i)
+                    if req is None:
+                        continue
+                    actual = int(values[si, w_ids, sv.type_idx[h]].sum())
+                    if actual != req:
+                        messages.append(f"⚠️ {s}さんの {days[w_ids[0]]}週: {h}が {actual}日 (設定: {req}日)")
+
+        for (y, m), m_ids in built.months.items():
+            days_in_month = calendar.monthrange(y, m)[1]
+            if len(m_ids) == days_in_month:
+                for h_i, h in enumerate(weekly_holiday_targets):
+                    req = staff_settings[s].month_target(h_i)
+                    if req is None:
+                        continue
+                    actual = int(values[si, m_ids, sv.type_idx[h]].sum())
+                    if actual != req:
+                        messages.append(f"⚠️ {s}さんの {y}年{m}月: {h}が {actual}日 (設定: {req}日)")
+
+    # 必要人数の不足・余剰チェック
+    req_mat = problem.req_matrix(problem.target_work_shifts)
+    for di, d in enumerate(days):
+        for wi, ws in enumerate(problem.target_work_shifts):
+            req = int(req_mat[di, wi])
+            if req > 0:
+                actual = int(values[:, di, sv.type_idx[ws]].sum())
+                if actual < req:
+                    messages.append(f"⚠️ {d} の「{ws}」: {actual}名 (目標: {req}名) - 人手不足")
+                elif actual > req:
+                    messages.append(f"ℹ️ {d} の「{ws}」: {actual}名 (目標: {req}名) - 余剰あり")
+
+    out_df = values_to_table(problem, values)
+    out_df.index.name = "スタッフ名"
+    return out_df.reset_index(), messages
+
+
+def values_to_table(problem: ScheduleProblem, values: np.ndarray) -> pd.DataFrame:
+    """0/1 配列をスタッフ×日の種別名の表にする"""
+    type_names = np.array(list(problem.shift_types) + [""], dtype=object)
+    # どの種別も 1 でないセルは空文字（末尾のダミー）にする
+    chosen = np.where(values.any(axis=2), values.argmax(axis=2), len(problem.shift_types))
+    return pd.DataFrame(type_names[chosen], index=problem.staffs, columns=problem.days)
+
+
+class SolutionStream(cp_model.CpSolverSolutionCallback):
+    """改善解が見つかるたびに、その時点の最良解を記録するコールバック
+
+    求解スレッドから呼ばれるので、画面側は snapshot() で読む。
+    solver_settings のプリセットの打ち切り条件（ギャップ・ペナルティ）を満たしたら探索を止める。
+    「改善なし」の判定は解が来ないと呼ばれないので、呼び出し側が plateau_reached() で見る。
+    """
+
+    def __init__(self, problem: ScheduleProblem, built: BuiltModel, solver_settings: Optional[dict] = None):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._built = built
+        self._sv = built.vars
+        self._best = None
+        self._count = 0
+        self._last_improved = time.monotonic()
+        preset = solver_preset(solver_settings)
+        self.gap_limit = float(preset.get("gap_limit") or 0.0)
+        self.plateau_seconds = float(preset.get("plateau_seconds") or 0.0)
+        # 違反ペナルティの項がない（全て厳守）なら、どの解もペナルティ 0 で最初の解で止まってしまうので使わない
+        self.penalty_target = preset.get("penalty_target") if built.penalty_index.size else None
+        self.stop_reason = None
+        # 必要人数の不足数を数えるための (日, 担務) の必要人数
+        self._target_ids = built.vars.type_ids(problem.target_work_shifts)
+        self._req = problem.req_matrix([ws for ws in problem.target_work_shifts if ws in built.vars.type_idx])
+
+    def on_solution_callback(self):
+        solution = self.response_proto.solution
+        values = self._sv.values_from(solution)
+        assigned = values[:, :, self._target_ids].sum(axis=0)
+        shortage = int(np.clip(self._req - assigned, 0, None).sum())
+        penalty = self._built.penalty(solution)
+        objective = self.ObjectiveValue()
+        bound = self.BestObjectiveBound()
+        gap = abs(objective - bound) / max(1.0, abs(objective))
+        with self._lock:
+            self._count += 1
+            self._last_improved = time.monotonic()
+            self._best = {
+                "objective": objective,
+                "bound": bound,
+                "gap": gap,
+                "shortage": shortage,
+                "penalty": penalty,
+                "wall_time": self.WallTime(),
+                "solutions": self._count,
+                "values": values,
+            }
+
+        if self.gap_limit > 0 and gap <= self.gap_limit:
+            self.stop_reason = "gap"
+            self.StopSearch()
+        elif self.penalty_target is not None and shortage == 0 and penalty <= self.penalty_target:
+            self.stop_reason = "penalty"
+            self.StopSearch()
+
+    def plateau_reached(self) -> bool:
+        """最後の改善から plateau_seconds 経ったか（解が1つもないうちは止めない）"""
+        if self.plateau_seconds <= 0:
+            return False
+        with self._lock:
+            if self._best is None:
+                return False
+            reached = time.monotonic() - self._last_improved >= self.plateau_seconds
+        if reached and self.stop_reason is None:
+            self.stop_reason = "plateau"
+        return reached
+
+    def stop_message(self, solver: cp_model.CpSolver, status: int, time_budget: float) -> Optional[str]:
+        """どの条件で計算を終えたかのお知らせ（最適解が証明できた場合は None）"""
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return None
+        objective, bound = solver.ObjectiveValue(), solver.BestObjectiveBound()
+        # ギャップ 0 の解でコールバックが止めた場合も、最適解が証明できていれば打ち切りではない
+        if status == cp_model.OPTIMAL and abs(objective - bound) <= 1e-6 * max(1.0, abs(objective)):
+            return None
+        # CP-SAT 側の relative_gap_limit で止まった場合は OPTIMAL が返る
+        if self.stop_reason == "gap" or (status == cp_model.OPTIMAL and self.stop_reason is None):
+            return f"⏱ 評価値と上限のギャップが {self.gap_limit * 100:.1f}% 以下になったため計算を打ち切りました。"
+        if self.stop_reason == "penalty":
+            return f"⏱ 必要人数を満たし、違反ペナルティが {self.penalty_target} 以下になったため計算を打ち切りました。"
+        if self.stop_reason == "plateau":
+            return f"⏱ {self.plateau_seconds:.0f}秒間改善がなかったため計算を打ち切りました。"
+        if status == cp_model.FEASIBLE:
+            return f"⏱ 計算時間の上限（{time_budget:.0f}秒）に達したため、その時点の最良の結果を表示しています。"
+        return None
+
+    def snapshot(self) -> Optional[dict]:
+        with self._lock:
+            return None if self._best is None else dict(self._best)
+
+
+def previous_assignment(built: BuiltModel, previous: Optional[pd.DataFrame]) -> np.ndarray:
+    """前回の結果表を (スタッフ, 日) の種別インデックスにする
+
+    スタッフ・日付・種別が消えたマスや、今回の条件で取れなくなった種別のマスは -1。
+    """
+    sv = built.vars
+    n_staff, n_days, _ = sv.shape
+    codes = np.full((n_staff, n_days), -1, dtype=np.int64)
+    if previous is None or previous.empty or "スタッフ名" not in previous.columns:
+        return codes
+    prev = previous.copy()
+    prev["スタッフ名"] = prev["スタッフ名"].fillna("").astype(str).str.strip()
+    prev = prev[~prev["スタッフ名"].duplicated()].set_index("スタッフ名")
+    prev = prev.reindex(index=sv.staffs, columns=sv.days).fillna("")
+    mapped = prev.apply(lambda col: col.astype(str).str.strip().map(sv.type_idx)).to_numpy(dtype=float)
+    known = ~np.isnan(mapped)
+    codes[known] = mapped[known].astype(np.int64)
+
+    # 今回は取れない種別になったマスは使わない
+    allowed = sv.free | (sv.fixed == 1)
+    si, di = np.nonzero(codes >= 0)
+    lost = ~allowed[si, di, codes[si, di]]
+    codes[si[lost], di[lost]] = -1
+    return codes
+
+
+def add_solution_hints(built: BuiltModel, codes: np.ndarray, cells: Optional[np.ndarray] = None) -> int:
+    """前回の結果（previous_assignment）を AddHint し、ヒントにしたマス数を返す
+
+    cells を渡すとそのマス（(スタッフ, 日) の bool 配列）だけをヒントにする。
+    """
+    sv = built.vars
+    usable = codes >= 0
+    if cells is not None:
+        usable &= cells
+    model = built.model
+    hinted = 0
+    for si, di in np.argwhere(usable):
+        ti = codes[si, di]
+        free = sv.free[si, di]
+        # 定数になっているマスはヒント不要
+        if not free[ti]:
+            continue
+        for t in np.flatnonzero(free):
+            model.AddHint(sv.x[si, di, t], int(t == ti))
+        hinted += 1
+    return hinted
+
+
+def hint_full_solution(built: BuiltModel, solution) -> None:
+    """求解結果（全変数の値）をそのままヒントにする（段階的に解くときの次の段の初期値）"""
+    model = built.model
+    model.ClearHints()
+    hint = model.Proto().solution_hint
+    hint.vars.extend(range(len(solution)))
+    hint.values.extend(int(v) for v in solution)
+
+
+def repair_fixed_cells(built: BuiltModel, codes: np.ndarray, scope: Optional[dict] = None) -> np.ndarray:
+    """前回の結果を固定して直すときに固定するマス
+
+    使えなくなったマスを含む週は全スタッフ分を動かせるようにし、それ以外の週は固定する。
+    scope（{"staffs": [...], "days": [...]}）を渡すと、そのスタッフの全日と、その日を含む週も動かせるようにする。
+    """
+    keep = np.ones(codes.shape, dtype=bool)
+    invalid_days = np.flatnonzero((codes < 0).any(axis=0))
+    if scope:
+        sv = built.vars
+        changed_days = [sv.day_idx[d] for d in scope.get("days", []) if d in sv.day_idx]
+        invalid_days = np.union1d(invalid_days, changed_days)
+        keep[[sv.staff_idx[s] for s in scope.get("staffs", []) if s in sv.staff_idx], :] = False
+    for w_ids in built.weeks:
+        if np.isin(w_ids, invalid_days).any():
+            keep[:, w_ids] = False
+    return keep
+
+
+def solver_preset(settings: Optional[dict]) -> dict:
+    key = (settings or {}).get("preset", DEFAULT_SOLVER_PRESET)
+    return SOLVER_PRESETS.get(key, SOLVER_PRESETS[DEFAULT_SOLVER_PRESET])
+
+
+def solver_time_budget(settings: Optional[dict], num_vars: int) -> float:
+    """計算時間の上限（秒）。明示指定がなければモデルの大きさに合わせる"""
+    fixed = safe_int((settings or {}).get("time_limit"), 0)
+    if fixed > 0:
+        return float(fixed)
+    preset = solver_preset(settings)
+    budget = preset["time_base"] + preset["time_per_var"] * num_vars
+    return float(min(preset["time_max"], max(preset["time_min"], budget)))
+
+
+def configure_solver(solver: cp_model.CpSolver, model: cp_model.CpModel, settings: Optional[dict]) -> float:
+    """プリセットをソルバーに反映し、使う計算時間（秒）を返す"""
+    preset = solver_preset(settings)
+    budget = solver_time_budget(settings, len(model.Proto().variables))
+    params = solver.parameters
+    params.max_time_in_seconds = budget
+    workers = min(int(preset["max_workers"]), os.cpu_count() or 1)
+    # 共有サーバーでは1回の計算に使えるワーカー数が決められている（solve_pool）
+    worker_budget = safe_int((settings or {}).get("worker_budget"), 0)
+    if worker_budget > 0:
+        workers = min(workers, worker_budget)
+    params.num_workers = max(1, workers)
+    params.random_seed = safe_int((settings or {}).get("random_seed"), 0)
+    params.linearization_level = int(preset["linearization_level"])
+    params.cp_model_presolve = bool(preset["cp_model_presolve"])
+    params.max_presolve_iterations = int(preset["max_presolve_iterations"])
+    if preset.get("gap_limit"):
+        params.relative_gap_limit = float(preset["gap_limit"])
+    return budget
+
+
+def _stopped(stop_event) -> bool:
+    return stop_event is not None and stop_event.is_set()
+
+
+def _solve_until_stopped(solver: cp_model.CpSolver, model: cp_model.CpModel, stop_event) -> int:
+    """solver.Solve を別スレッドで回し、stop_event が立ったら探索を止める"""
+    result = {}
+    worker = threading.Thread(target=lambda: result.setdefault("status", solver.Solve(model)))
+    worker.start()
+    while worker.is_alive():
+        # StopSearch は Solve 開始前だと効かないので、立っている間は出し直す
+        if stop_event.is_set():
+            solver.StopSearch()
+        worker.join(0.1)
+    return result["status"]
+
+
+def _solve_with_assumptions(model: cp_model.CpModel, literals: list, time_limit: float, stop_event=None):
+    """literals を仮定して解き、(status, 解なしの原因になった仮定の番号) を返す
+
+    stop_event が立ったら探索を止める（そのときは原因の番号は None）。
+    """
+    model.ClearAssumptions()
+    model.AddAssumptions(literals)
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = max(0.1, time_limit)
+    # 仮定による原因の特定はシングルスレッドのほうが確実に返る
+    solver.parameters.num_workers = 1
+    if stop_event is None:
+        status = solver.Solve(model)
+    else:
+        status = _solve_until_stopped(solver, model, stop_event)
+    if status != cp_model.INFEASIBLE:
+        return status, None
+    index = {lit.Index(): i for i, lit in enumerate(literals)}
+    return status, [index[v] for v in solver.SufficientAssumptionsForInfeasibility() if v in index]
+
+
+def find_conflict(
+    built: BuiltModel,
+    candidates: list[int],
+    deadline: float,
+    fixed: Optional[list[int]] = None,
+    stop_event=None,
+) -> Optional[list[int]]:
+    """candidates（built.groups の番号）のうち、同時には満たせないグループの組を返す
+
+    仮定つきで解いて得た原因の組から1つずつ外して解き直し、外しても解なしのままなら外したままにする
+    （時間内に終われば極小の組になる）。fixed のグループは常に有効のまま、縮める対象にしない。
+    解が見つかる・時間切れなら None。stop_event が立ったら、そこまでに縮めた組を返す。
+    """
+    groups = built.groups
+    model = built.model
+    fixed_lits = [groups.literals[i] for i in fixed or []]
+
+    def solve(trial: list[int], time_limit: float) -> Optional[list[int]]:
+        _, sub = _solve_with_assumptions(model, fixed_lits + [groups.literals[j] for j in trial], time_limit, stop_event)
+        if sub is None:
+            return None
+        return [trial[k - len(fixed_lits)] for k in sorted(sub) if k >= len(fixed_lits)]
+
+    core = solve(candidates, deadline - time.time())
+    if not core:
+        model.ClearAssumptions()
+        return None
+
+    i = 0
+    while i < len(core) and time.time() < deadline and not _stopped(stop_event):
+        trial = core[:i] + core[i + 1 :]
+        sub = solve(trial, min(5.0, deadline - time.time()))
+        if sub is not None:
+            # 外しても解なし: 返ってきたさらに小さい組に置き換える（外した分より前は確認済みのまま）
+            core = sub
+            i = min(i, len(core))
+        else:
+            i += 1
+    model.ClearAssumptions()
+    return core
+
+
+def probe_families(
+    built: BuiltModel, families: list[str], max_workers: int, deadline: float, stop_event=None
+) -> list[str]:
+    """条件の種類ごとに「その種類だけ外して」試し解きし、外すと解が見つかる種類を返す
+
+    試し解きはモデルを複製して並列に行う（CP-SAT は求解中 GIL を手放すのでスレッドで並列になる）。
+    """
+    groups = built.groups
+
+    def probe(family: str) -> bool:
+        if _stopped(stop_event):
+            return False
+        model = built.model.Clone()
+        kept = [lit for lit, key in zip(groups.literals, groups.keys) if key[0] != family]
+        time_limit = min(DIAGNOSIS_PROBE_TIME_LIMIT, deadline - time.time())
+        status, _ = _solve_with_assumptions(model, kept, time_limit, stop_event)
+        return status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        resolved = list(executor.map(probe, families))
+    return [family for family, ok in zip(families, resolved) if ok]
+
+
+def diagnose_infeasibility(problem: ScheduleProblem, solver_settings: Optional[dict] = None, stop_event=None) -> list[str]:
+    """
+    解が見つからない場合に、同時には満たせない条件の組を探す診断関数
+
+    本番と同じモデルを、厳守の制約をグループごと（スタッフ×ルール、NGペア、日×担務の必要人数など）の
+    有効化リテラル付きで作り、2段階で絞り込む。
+    1. 仮定つきで1回解いて原因の組を得て、そこに出てくる条件の種類ごとに「その種類だけ外す」試し解きを
+       並列に行い（probe_families）、外せば解ける種類を見つける（組に出てこない種類は外しても解けない）。
+    2. 外せば解ける種類のグループだけを1つずつ外して縮め（find_conflict）、極小の組にする。
+       ほかの種類の疑わしいグループは有効のまま固定し、最後にその中から組の相手を絞る。
+       外せば解ける種類がなければ原因の組全体を縮める。
+    stop_event が立ったら試し解き・縮める手順の途中でも止め、空のリストを返す。
+    """
+    built = build_model(problem, diagnose=True)
+    groups = built.groups
+    # 実行可能かどうかだけを見るので目的関数は外す
+    built.model.ClearObjective()
+    deadline = time.time() + DIAGNOSIS_TIME_LIMIT
+    all_groups = list(range(len(groups.literals)))
+
+    status, core = _solve_with_assumptions(
+        built.model, groups.literals, min(DIAGNOSIS_PROBE_TIME_LIMIT, deadline - time.time()), stop_event
+    )
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) or _stopped(stop_event):
+        return []
+    if core is not None and not core:
+        return ["・可能な担務の設定だけで矛盾しています（担務・休日の種類やスタッフの設定を確認してください）。"]
+    suspects = core if core is not None else all_groups
+    families = list(dict.fromkeys(groups.keys[i][0] for i in suspects))
+
+    max_workers = safe_int((solver_settings or {}).get("worker_budget"), 0) or (os.cpu_count() or 1)
+    guilty = probe_families(built, families, max_workers, deadline, stop_event)
+    if _stopped(stop_event):
+        return []
+
+    if guilty:
+        # 外せば解ける種類は、どの原因の組にも必ず含まれる。その種類のグループだけを縮め、
+        # 縮めた組を固定してから、組の相手になっているほかの種類のグループを絞る
+        guilty_set = set(guilty)
+        others = [i for i in suspects if groups.keys[i][0] not in guilty_set]
+        core = find_conflict(
+            built, [i for i in suspects if groups.keys[i][0] in guilty_set], deadline, fixed=others, stop_event=stop_event
+        )
+        if core and others and not _stopped(stop_event):
+            core = core + (find_conflict(built, others, deadline, fixed=core, stop_event=stop_event) or [])
+    else:
+        core = find_conflict(built, suspects, deadline, stop_event=stop_event)
+    if _stopped(stop_event):
+        return []
+    results = []
+    if guilty:
+        labels = " / ".join(DIAGNOSIS_FAMILIES.get(f, f) for f in guilty)
+        results.append(f"・次の種類の条件を見直すと作成できます: {labels}")
+    if core:
+        results.extend(f"・{groups.messages[i]}" for i in core)
+    return results
@@ -0,0 +1,365 @@
+# solve_job.py - バックグラウンドで動くシフト作成ジョブ（Streamlit に依存しない）
+import queue
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from ortools.sat.python import cp_model
+
+from shift_model import (
+    DEFAULT_SOLVER_SETTINGS,
+    HINT_FIX_TIME_LIMIT,
+    OBJECTIVE_TIERS,
+    ScheduleProblem,
+    SolutionStream,
+    add_solution_hints,
+    build_model,
+    check_capacity,
+    configure_solver,
+    diagnose_infeasibility,
+    extract_solution,
+    hint_full_solution,
+    previous_assignment,
+    repair_fixed_cells,
+)
+
+
+def run_solve(problem: ScheduleProblem, settings: dict, previous_result: Optional[pd.DataFrame], events, stop_event) -> dict:
+    """モデル構築 → 求解 → 結果抽出 / 診断
+
+    求解プロセス側でも動くよう、途中経過は events（キュー）に ("label", 表示, 計算時間) と
+    ("snapshot", 最良解) を流し、stop_event が立ったら探索を止める。
+    """
+    capacity = check_capacity(problem)
+    if capacity.infeasible:
+        # 人手が足りないことが確定しているので、モデルを作らずに返す
+        return {
+            "result_df": None,
+            "capacity_messages": capacity.messages,
+            "stop_msg": None,
+            "messages": ["・上の理由で必要人数を満たせないことが確定しているため、計算を行いませんでした。"],
+            "stats": {
+                "status": "INFEASIBLE",
+                "objective": None,
+                "wall_time": 0.0,
+                "preset": settings.get("preset"),
+                "solved_at": time.time(),
+                "precheck": True,
+            },
+        }
+    events.put(("label", "モデルを作成中...", 0.0))
+    built = build_model(problem, sequence_engine=settings.get("sequence_engine") or "linear")
+
+    # 前回の結果のうち今回も有効なマスを初期値として渡す
+    action = settings.get("resolve_action", "full")
+    prev_codes = None
+    if previous_result is not None and (settings.get("warm_start") or action in ("validate", "repair")):
+        prev_codes = previous_assignment(built, previous_result)
+
+    # 前回の結果を固定して解く段階（軽い順）。解けたらそこで終わり、だめなら次の段階へ
+    stages = []
+    if prev_codes is not None:
+        if action in ("validate", "repair") and (prev_codes >= 0).all():
+            # 全マス固定: 今の結果が新しい条件も満たしているかの確認だけ
+            stages.append(("validate", np.ones(prev_codes.shape, dtype=bool), "今の結果を確認中..."))
+        if action == "repair" or settings.get("hint_repair"):
+            # 変更のあった週・スタッフ以外を固定して直す（変更が最小限で済む）
+            cells = repair_fixed_cells(built, prev_codes, settings.get("repair_scope"))
+            stages.append(("repair", cells, "前回の結果を元に修正中..."))
+
+    status = None
+    stop_msg = None
+    resolved_by = None  # 結果を出した段階（解が得られたときだけ入れる）
+    previous_score = settings.get("previous_score")
+    for stage, cells, label in stages:
+        built.model.ClearHints()
+        add_solution_hints(built, prev_codes, cells=cells)
+        solver = cp_model.CpSolver()
+        budget = min(HINT_FIX_TIME_LIMIT, configure_solver(solver, built.model, settings))
+        solver.parameters.max_time_in_seconds = budget
+        solver.parameters.fix_variables_to_their_hinted_value = True
+        status, stop_msg = _solve(problem, built, solver, settings, budget, label, events, stop_event)
+        found = status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+        # 確認だけの段階は、できるだけ守る条件（必要人数・休日数など）の点数が前回より下がっていないときだけ採用する
+        if found and (stage != "validate" or (previous_score is not None and _solution_score(built, solver) >= previous_score)):
+            resolved_by = stage
+            break
+        if stop_event.is_set() and not found:
+            # 中止: 解がないまま止まったので、次の段階には進まない
+            break
+        status = None
+
+    if status is None:
+        if prev_codes is not None:
+            built.model.ClearHints()
+            add_solution_hints(built, prev_codes)
+        if settings.get("objective_mode") == "lexicographic":
+            solver, status, stop_msg = _solve_lexicographic(problem, built, settings, events, stop_event)
+        else:
+            solver = cp_model.CpSolver()
+            budget = configure_solver(solver, built.model, settings)
+            status, stop_msg = _solve(problem, built, solver, settings, budget, "計算中...", events, stop_event)
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            resolved_by = "full"
+
+    result = {
+        "result_df": None,
+        "capacity_messages": capacity.messages,
+        "stop_msg": stop_msg,
+        "messages": [],
+        "stats": {
+            "status": solver.StatusName(status),
+            "objective": solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None,
+            # 重み付きの目的関数の値（lexicographic でも全段の合計）。次の「確認だけ」の判定に使う
+            "score": _solution_score(built, solver) if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None,
+            "wall_time": solver.WallTime(),
+            "preset": settings.get("preset"),
+            "solved_at": time.time(),
+            "resolved_by": resolved_by,
+        },
+    }
+    messages = result["messages"]
+    if resolved_by == "validate":
+        messages.append("✅ 変更後の条件も今の結果で満たせているため、作り直しませんでした。")
+    elif resolved_by == "repair":
+        messages.append("🔧 変更のあった部分の周りだけを作り直しました。")
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        result["result_df"], result_messages = extract_solution(problem, built, solver)
+        messages.extend(result_messages)
+    elif status == cp_model.INFEASIBLE and not stop_event.is_set():
+        messages.append("・制約条件が厳しく、解が存在しません（NGペアや連勤制限などが原因の可能性があります）。")
+        messages.append("🔍 詳細診断を実行中...")
+        events.put(("label", "原因を診断中...", 0.0))
+        diag_reasons = diagnose_infeasibility(problem, settings, stop_event)
+        if stop_event.is_set():
+            messages.append("・診断の途中で計算を止めたため、原因は特定していません。")
+        elif diag_reasons:
+            messages.append("以下の条件は同時には満たせません（どれか1つを緩和・削除すると解決する可能性があります）：")
+            messages.extend(diag_reasons)
+        else:
+            messages.append("・診断を行いましたが、特定の原因を特定できませんでした。")
+    elif stop_event.is_set():
+        messages.append("・解が見つかる前に計算を止めたため、結果はありません。")
+    elif status == cp_model.UNKNOWN:
+        messages.append("・計算時間内に解が見つかりませんでした。")
+    return result
+
+
+def _solution_score(built, solver: cp_model.CpSolver) -> int:
+    """解の重み付き目的関数の値（大きいほど良い）"""
+    return int(solver.Value(built.objective()))
+
+
+def _solve_lexicographic(problem, built, settings: dict, events, stop_event):
+    """段（OBJECTIVE_TIERS）の順に1段ずつ最適化し、その段の値を落とさない制約を足して次の段へ進む
+
+    計算時間は全段で共有する。各段は前の段の解を初期値にするので、途中で止まっても直前の段の解が残る。
+    """
+    tiers = [tier for tier in OBJECTIVE_TIERS if built.objective_terms.get(tier, ([], []))[0]]
+    if not tiers:
+        # 重みのある項がない（重みが全て0・できるだけ守る条件がない）ときは重み付きで1回解く
+        solver = cp_model.CpSolver()
+        budget = configure_solver(solver, built.model, settings)
+        status, stop_msg = _solve(problem, built, solver, settings, budget, "計算中...", events, stop_event)
+        return solver, status, stop_msg
+    deadline = None
+    best = None
+    for i, tier in enumerate(tiers):
+        expr = built.objective([tier])
+        built.model.Maximize(expr)
+        solver = cp_model.CpSolver()
+        budget = configure_solver(solver, built.model, settings)
+        if deadline is None:
+            deadline = time.time() + budget
+        budget = max(1.0, deadline - time.time())
+        solver.parameters.max_time_in_seconds = budget
+        label = f"計算中（{i + 1}/{len(tiers)}: {OBJECTIVE_TIERS[tier]}）..."
+        status, stop_msg = _solve(problem, built, solver, settings, budget, label, events, stop_event)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            # 解なしは1段目でしか起きない。時間切れなら直前の段の解を使う
+            return best or (solver, status, stop_msg)
+        best = (solver, status, stop_msg)
+        if stop_event.is_set():
+            break
+        built.model.Add(expr >= int(round(solver.ObjectiveValue())))
+        hint_full_solution(built, solver.ResponseProto().solution)
+    return best
+
+
+def _solve(problem, built, solver: cp_model.CpSolver, settings: dict, time_budget: float, label: str, events, stop_event):
+    """solver.Solve を別スレッドで回し、停止要求・打ち切り（改善なし）を見張りながら改善解を events に流す"""
+    stream = SolutionStream(problem, built, settings)
+    events.put(("label", label, time_budget))
+
+    result = {}
+    worker = threading.Thread(target=lambda: result.setdefault("status", solver.Solve(built.model, stream)))
+    worker.start()
+    sent = 0
+    while worker.is_alive():
+        # StopSearch は Solve 開始前だと効かないので、止める要求は見張りの中で出し直す
+        if stop_event.is_set() or stream.plateau_reached():
+            solver.StopSearch()
+        snapshot = stream.snapshot()
+        if snapshot is not None and snapshot["solutions"] != sent:
+            events.put(("snapshot", snapshot))
+            sent = snapshot["solutions"]
+        worker.join(0.1)
+    snapshot = stream.snapshot()
+    if snapshot is not None and snapshot["solutions"] != sent:
+        events.put(("snapshot", snapshot))
+    status = result["status"]
+    return status, stream.stop_message(solver, status, time_budget)
+
+
+class SolveJob:
+    """1回分のシフト作成を裏で実行する（画面側から見たハンドル）
+
+    pool（solve_pool.SolvePool）を渡すと共有の求解プロセスで順番に実行し、
+    渡さなければこのプロセスのスレッドで実行する。
+    画面側は progress() で途中経過を読み、cancel() で中止、accept() で途中の最良解で確定する。
+    終わったら done が True になり、result_df / messages / stats に結果が入る。
+    """
+
+    def __init__(
+        self,
+        problem: ScheduleProblem,
+        solver_settings: Optional[dict] = None,
+        previous_result: Optional[pd.DataFrame] = None,
+        trigger: str = "manual",
+        reason: str = "",
+        cache_key: Optional[str] = None,
+        pool=None,
+    ):
+        self.problem = problem
+        self.solver_settings = {**DEFAULT_SOLVER_SETTINGS, **(solver_settings or {})}
+        self.previous_result = previous_result
+        self.trigger = trigger
+        self.reason = reason
+        self.cache_key = cache_key
+        self.pool = pool
+
+        self.state = "queued"  # queued / running / done / cancelled / error
+        self.label = "順番待ち..."
+        self.started_at = None
+        self.time_budget = 0.0
+        self.result_df = None
+        self.messages = []
+        self.stats = {}
+        self.error = None
+        self.accepted = False
+
+        self._lock = threading.Lock()
+        self._cancel_requested = False
+        self._snapshot = None
+        if pool is not None:
+            self._events, self._stop_event = pool.channel()
+            self.solver_settings["worker_budget"] = pool.workers_per_solve
+        else:
+            self._events, self._stop_event = queue.Queue(), threading.Event()
+        self._thread = None
+
+    # --- 画面側から呼ぶ ---
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """中止: 探索を止め、結果は使わない（順番待ちなら列から外す）"""
+        self._cancel_requested = True
+        self._stop_event.set()
+        if self.pool is not None:
+            self.pool.withdraw(self)
+
+    def accept(self):
+        """この時点の結果で確定: 探索を止め、それまでの最良解を結果にする"""
+        self.accepted = True
+        self._stop_event.set()
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "cancelled", "error")
+
+    @property
+    def elapsed(self) -> float:
+        return 0.0 if self.started_at is None else time.time() - self.started_at
+
+    def progress(self) -> dict:
+        self._drain_events()
+        with self._lock:
+            snapshot = self._snapshot
+        return {
+            "state": self.state,
+            "label": self.label,
+            "elapsed": self.elapsed,
+            "time_budget": self.time_budget,
+            "snapshot": snapshot,
+            "position": self.pool.position(self) if self.pool is not None and self.state == "queued" else 0,
+        }
+
+    # --- ジョブ本体 ---
+    def run(self):
+        try:
+            if self.pool is None:
+                self._start_running()
+                result = run_solve(self.problem, self.solver_settings, self.previous_result, self._events, self._stop_event)
+            else:
+                if not self.pool.acquire(self):
+                    self.state = "cancelled"
+                    return
+                try:
+                    self._start_running()
+                    future = self.pool.submit(
+                        run_solve, self.problem, self.solver_settings, self.previous_result, self._events, self._stop_event
+                    )
+                    result = future.result()
+                finally:
+                    self.pool.release()
+            self._finish(result)
+        except BrokenProcessPool:
+            self.error = RuntimeError("計算プロセスが異常終了しました（メモリ不足の可能性があります）。")
+            self.state = "error"
+        except Exception as e:
+            self.error = e
+            self.state = "error"
+
+    def _start_running(self):
+        self.state = "running"
+        self.label = "準備中..."
+        self.started_at = time.time()
+        if self._cancel_requested:
+            self._stop_event.set()
+
+    def _finish(self, result: dict):
+        if self._cancel_requested:
+            self.state = "cancelled"
+            return
+        self.result_df = result["result_df"]
+        messages = list(result["capacity_messages"])
+        if self.accepted and self.result_df is not None:
+            messages.append(f"⏹ 途中の結果で確定しました（{result['stats']['wall_time']:.0f}秒時点）。")
+        elif result["stop_msg"]:
+            messages.append(result["stop_msg"])
+        messages.extend(result["messages"])
+        self.messages = messages
+        self.stats = dict(result["stats"], accepted_early=self.accepted)
+        self.state = "done"
+
+    def _drain_events(self):
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                return
+            except (EOFError, OSError):
+                # 共有プールのマネージャーが止まった後など
+                return
+            if event[0] == "label":
+                self.label, budget = event[1], event[2]
+                if budget:
+                    self.time_budget = budget
+            elif event[0] == "snapshot":
+                with self._lock:
+                    self._snapshot = event[1]
@@ -0,0 +1,96 @@
+# solve_pool.py - 複数セッションで共有する求解プロセスプール（Streamlit に依存しない）
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from shift_model import safe_int
+
+# 同時に走らせる計算の数と、1回の計算に使う CP-SAT ワーカー数（環境変数で上書きできる）
+DEFAULT_MAX_CONCURRENT_SOLVES = max(1, safe_int(os.environ.get("SHIFT_APP_MAX_CONCURRENT_SOLVES"), 2))
+DEFAULT_WORKERS_PER_SOLVE = safe_int(os.environ.get("SHIFT_APP_WORKERS_PER_SOLVE"), 0)  # 0 ならコア数を等分
+
+
+class SolvePool:
+    """求解を別プロセスで実行する共有プール
+
+    同時に走る計算は max_concurrent 件までで、あふれた分は到着順（FIFO）に待たせる。
+    CP-SAT のメモリ消費や CPU 負荷を Streamlit サーバーのプロセスから切り離すのが目的。
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT_SOLVES, workers_per_solve: int = DEFAULT_WORKERS_PER_SOLVE):
+        self.max_concurrent = max(1, int(max_concurrent))
+        if workers_per_solve <= 0:
+            workers_per_solve = (os.cpu_count() or 1) // self.max_concurrent
+        self.workers_per_solve = max(1, int(workers_per_solve))
+
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._running = 0
+        # fork だと Streamlit サーバーのスレッドごと複製されるので spawn で起動する
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = None
+        self._manager = None
+
+    # --- 順番待ち ---
+    def acquire(self, job) -> bool:
+        """job の順番が来るまで待つ。待っている間に withdraw されたら False"""
+        with self._cond:
+            self._waiting.append(job)
+            while True:
+                if job not in self._waiting:
+                    return False
+                if self._waiting[0] is job and self._running < self.max_concurrent:
+                    self._waiting.popleft()
+                    self._running += 1
+                    return True
+                self._cond.wait()
+
+    def release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def withdraw(self, job):
+        """順番待ちから外す（実行中なら何もしない）"""
+        with self._cond:
+            if job in self._waiting:
+                self._waiting.remove(job)
+                self._cond.notify_all()
+
+    def position(self, job) -> int:
+        """待ち行列での順番（1 始まり）。待っていなければ 0"""
+        with self._cond:
+            for i, waiting in enumerate(self._waiting):
+                if waiting is job:
+                    return i + 1
+        return 0
+
+    def load(self) -> dict:
+        with self._cond:
+            return {"running": self._running, "waiting": len(self._waiting), "max_concurrent": self.max_concurrent}
+
+    # --- 実行 ---
+    def channel(self):
+        """別プロセスと途中経過・停止要求をやり取りするキューとイベント"""
+        with self._cond:
+            if self._manager is None:
+                self._manager = self._context.Manager()
+            return self._manager.Queue(), self._manager.Event()
+
+    def submit(self, fn, *args):
+        try:
+            return self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # ワーカーが落ちる（メモリ不足で kill されるなど）とプールごと使えなくなるので作り直す
+            with self._cond:
+                self._executor = None
+            return self._get_executor().submit(fn, *args)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._cond:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_concurrent, mp_context=self._context)
+            return self._executor
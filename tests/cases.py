@@ -0,0 +1,37 @@
+"""テスト用の小さなシフト条件（benchmarks/synthetic.py の make_problem をもとにする）"""
+
+import datetime
+
+import pandas as pd
+
+from benchmarks.synthetic import HOLIDAY_TYPES, WORK_SHIFTS, make_problem
+from shift_model import VACANT_SHIFT, ScheduleProblem
+
+START = datetime.date(2026, 4, 26)
+
+
+def small_problem(seed: int = 0, n_staff: int = 8, n_days: int = 14, extras: bool = False) -> ScheduleProblem:
+    """画面と同じ種別の並び（休日 + 担務 + 空き）にした小さな問題
+
+    extras=True なら NG ペア・個別ルール・共通ルール・期間内の回数・祝日ルールも入れる
+    （期間はゴールデンウィークにかかる）。
+    """
+    problem = make_problem(n_staff=n_staff, n_days=n_days, n_order_rules=2, start=START, seed=seed)
+    problem.shift_types = HOLIDAY_TYPES + WORK_SHIFTS + [VACANT_SHIFT]
+    if extras:
+        problem.individual_rules_df = pd.DataFrame(
+            [
+                {"スタッフ名": "S001", "曜日": "土", "希望内容": "休み(全般)", "ルールタイプ": "固定"},
+                {"スタッフ名": "S002", "曜日": "月", "希望内容": "夜勤", "ルールタイプ": "不可"},
+            ]
+        )
+        problem.ng_pairs = [
+            {"スタッフA": "S003", "スタッフB": "S005", "type": "絶対NG"},
+            {"スタッフA": "S006", "スタッフB": "S007", "type": "できるだけNG"},
+        ]
+        problem.period_counts = {"S006": {"年休": 1}}
+        problem.global_rules = [
+            {"type": "date", "value": problem.days[5], "shift": "週休", "action": "休日ならこれのみ", "employment_type": "パート"},
+        ]
+        problem.public_holiday_rules = {"enabled": True, "target_employments": ["正社員"], "comp_holiday_type": "代休"}
+    return problem
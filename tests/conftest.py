@@ -0,0 +1,8 @@
+import os
+import sys
+
+# リポジトリ直下のモジュール（shift_model など）と tests/cases.py を import できるようにする
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.dirname(os.path.abspath(__file__))):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,81 @@
+"""画面側（app.py）の Streamlit に依存しない判断のテスト（bare モードで import する）"""
+
+import datetime
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+import app
+from shift_model import calendar_index
+
+
+@pytest.fixture
+def session():
+    st.session_state.clear()
+    yield st.session_state
+    st.session_state.clear()
+
+
+@pytest.mark.parametrize(
+    "changed, has_result, action",
+    [
+        (set(), True, "skip"),
+        ({"employment_types_list", "req_by_weekday"}, True, "skip"),
+        ({"hope_df"}, True, "repair"),
+        ({"staff_df", "req_df", "ng_pairs", "period_counts"}, True, "repair"),
+        ({"hope_df", "filler_shift_type"}, True, "repair"),
+        ({"hope_df"}, False, "full"),
+        ({"global_rules"}, True, "validate"),
+        ({"hope_df", "prohibited_transitions"}, True, "validate"),
+        ({"end_date"}, True, "full"),
+        ({"hope_df", "work_shifts_list"}, True, "full"),
+    ],
+)
+def test_classify_input_change(changed, has_result, action):
+    assert app.classify_input_change(changed, has_result) == action
+
+
+def test_input_change_scope(session):
+    days = ["4/26(日)", "4/27(月)"]
+    before = {
+        "hope_df": pd.DataFrame("", index=["A", "B"], columns=days),
+        "req_df": pd.DataFrame(1, index=days, columns=["日勤"]),
+        "staff_df": pd.DataFrame({"スタッフ名": ["A", "B"], "日勤": [True, True]}),
+        "ng_pairs": [{"スタッフA": "A", "スタッフB": "B", "type": "絶対NG"}],
+    }
+    session["hope_df"] = before["hope_df"].copy()
+    session["hope_df"].at["A", "4/27(月)"] = "休み(全般)"
+    session["req_df"] = before["req_df"].copy()
+    session["req_df"].at["4/26(日)", "日勤"] = 2
+    session["staff_df"] = pd.DataFrame({"スタッフ名": ["A", "B"], "日勤": [True, False]})
+    session["ng_pairs"] = []
+    scope = app.input_change_scope({"hope_df", "req_df", "staff_df"}, before)
+    assert scope == {"staffs": ["B"], "days": days}
+    scope = app.input_change_scope({"ng_pairs"}, before)
+    assert scope == {"staffs": ["A", "B"], "days": []}
+
+
+def test_set_period_days_migrates_labels(session):
+    short = calendar_index(datetime.date(2026, 4, 1), datetime.date(2026, 4, 3))
+    session["work_shifts_list"] = ["日勤"]
+    session["staff_df"] = pd.DataFrame({"スタッフ名": ["A"], "日勤": [True]})
+    app.set_period_days(short.labels, short.day_map)
+    session["req_df"] = pd.DataFrame({"日勤": [1, 2, 3]}, index=short.labels)
+    session["hope_df"] = pd.DataFrame([["休み(全般)", "", ""]], index=["A"], columns=short.labels)
+    session["global_rules"] = [{"type": "date", "value": "4/2(木)", "shift": "週休", "action": "固定"}]
+
+    # 期間が1年以上になるとラベルに年が付くが、同じ日付の入力はそのまま残る
+    long = calendar_index(datetime.date(2026, 4, 1), datetime.date(2027, 4, 3))
+    app.set_period_days(long.labels, long.day_map)
+    app.sync_req_df(long.labels)
+    app.sync_hope_df(long.labels)
+    assert session["req_df"]["日勤"].iloc[:3].tolist() == [1, 2, 3]
+    assert session["req_df"]["日勤"].sum() == 6
+    assert session["hope_df"].at["A", "2026/4/1(水)"] == "休み(全般)"
+    assert session["global_rules"][0]["value"] == "2026/4/2(木)"
+
+    # 元の期間に戻したときも同じ
+    app.set_period_days(short.labels, short.day_map)
+    app.sync_req_df(short.labels)
+    assert session["req_df"]["日勤"].tolist() == [1, 2, 3]
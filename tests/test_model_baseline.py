@@ -0,0 +1,52 @@
+"""リファクタリング前のモデル（app.py の run_optimization）と同じ答えになるか
+
+期待値は分割前の run_optimization で同じ条件を最適まで解いた値。当時の目的関数は小数の重み
+（同点 0.01 など）だったので、整数化した今の目的関数ではちょうど100倍になる。
+"""
+
+import pytest
+from ortools.sat.python import cp_model
+
+from cases import small_problem
+from shift_model import SEQUENCE_ENGINES, build_model
+
+# (small_problem の引数, 分割前の状態, 分割前の目的関数の値)
+BASELINE = [
+    (dict(seed=0), "OPTIMAL", 50.34),
+    (dict(seed=1, extras=True), "OPTIMAL", 27.82),
+    (dict(seed=3, n_staff=6, n_days=21), "OPTIMAL", 10.38),
+]
+
+
+def solve(problem, sequence_engine):
+    built = build_model(problem, sequence_engine=sequence_engine)
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = 8
+    solver.parameters.random_seed = 0
+    solver.parameters.max_time_in_seconds = 120
+    status = solver.Solve(built.model)
+    return built, solver, status
+
+
+@pytest.mark.parametrize("sequence_engine", list(SEQUENCE_ENGINES))
+@pytest.mark.parametrize("kwargs, status, objective", BASELINE)
+def test_objective_matches_baseline(kwargs, status, objective, sequence_engine):
+    built, solver, result = solve(small_problem(**kwargs), sequence_engine)
+    assert solver.StatusName(result) == status
+    assert round(solver.ObjectiveValue()) == round(objective * 100)
+    # 目的関数は整数の重みだけで組んでいる
+    assert solver.Value(built.objective()) == round(objective * 100)
+
+
+@pytest.mark.parametrize("sequence_engine", list(SEQUENCE_ENGINES))
+def test_infeasible_matches_baseline(sequence_engine):
+    # 全日出勤の希望では週の休日が取れない（分割前も INFEASIBLE）
+    problem = small_problem(seed=0)
+    problem.hope_df.loc["S001", :] = "出勤(全般)"
+    _, solver, result = solve(problem, sequence_engine)
+    assert result == cp_model.INFEASIBLE
+
+
+def test_unknown_sequence_engine():
+    with pytest.raises(ValueError):
+        build_model(small_problem(seed=0), sequence_engine="regex")
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+
+import pandas as pd
+
+from result_cache import ResultCache
+
+
+def make_df():
+    return pd.DataFrame({"スタッフ名": ["A", "B"], "4/26(日)": ["日勤", "週休"]})
+
+
+def test_memory_lru_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=2)
+    cache.put("k1", make_df(), [])
+    cache.put("k2", make_df(), [])
+    cache.get("k1")
+    cache.put("k3", make_df(), [])
+    assert list(cache._entries) == ["k1", "k3"]
+
+
+def test_disk_round_trip(tmp_path):
+    df = make_df()
+    ResultCache(str(tmp_path)).put("key", df, ["・お知らせ"], {"status": "OPTIMAL", "score": 12})
+
+    # 別のインスタンス（再起動後）でもファイルから読める
+    entry = ResultCache(str(tmp_path)).get("key")
+    assert entry is not None
+    pd.testing.assert_frame_equal(entry.result_df, df)
+    assert entry.messages == ["・お知らせ"]
+    assert entry.stats == {"status": "OPTIMAL", "score": 12}
+
+
+def test_none_result_round_trip(tmp_path):
+    ResultCache(str(tmp_path)).put("key", None, ["・解が存在しません"], {"status": "INFEASIBLE"})
+    entry = ResultCache(str(tmp_path)).get("key")
+    assert entry.result_df is None
+    assert entry.stats["status"] == "INFEASIBLE"
+
+
+def test_put_copies_result(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    df = make_df()
+    cache.put("key", df, [])
+    df.iloc[0, 1] = "夜勤"
+    assert cache.get("key").result_df.iloc[0, 1] == "日勤"
+
+
+def test_missing_and_broken_files(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("missing") is None
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    assert cache.get("broken") is None
+
+
+def test_prune_keeps_newest_files(tmp_path):
+    cache = ResultCache(str(tmp_path), max_files=2)
+    cache.put("old", make_df(), [])
+    cache.put("mid", make_df(), [])
+    os.utime(tmp_path / "old.json", (1_000_000, 1_000_000))
+    os.utime(tmp_path / "mid.json", (2_000_000, 2_000_000))
+    cache.put("new", make_df(), [])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["mid.json", "new.json"]
+
+
+def test_shared_between_threads(tmp_path):
+    # 画面側では全セッションのスレッドが1つのインスタンスを使う
+    cache = ResultCache(str(tmp_path), max_entries=4, max_files=4)
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(200):
+                key = f"k{(n + i) % 8}"
+                cache.put(key, make_df(), [])
+                cache.get(f"k{(n * i) % 8}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert len(cache._entries) <= 4
+    assert len(list(tmp_path.glob("*.json"))) <= 4
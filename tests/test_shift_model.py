@@ -0,0 +1,266 @@
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from ortools.sat.python import cp_model
+
+from cases import START, small_problem
+from shift_model import (
+    SOLVER_PRESETS,
+    CalendarIndex,
+    SolutionStream,
+    build_model,
+    build_staff_settings,
+    calendar_index,
+    check_capacity,
+    compile_rules,
+    day_label,
+    diagnose_infeasibility,
+    repair_fixed_cells,
+)
+
+
+def type_ids(problem):
+    return {t: i for i, t in enumerate(problem.shift_types)}
+
+
+def day_ids(problem, dow):
+    return [i for i, d in enumerate(problem.days) if d.endswith(f"({dow})")]
+
+
+# --- CalendarIndex ---
+
+
+def test_calendar_labels_and_lookup():
+    cal = calendar_index(START, START + datetime.timedelta(days=13))
+    assert len(cal) == 14
+    assert cal.labels[:2] == ["4/26(日)", "4/27(月)"]
+    for key in (START, "2026-04-26", "4/26(日)"):
+        assert cal.day_index(key) == 0
+    assert cal.day_index("2026-04-25") is None
+    assert cal.label_of("2026-05-01") == "5/1(金)"
+    # 期間外の ISO は年付きのラベルにする
+    assert cal.label_of("2027-01-05") == "2027/1/5(火)"
+    assert cal.dow_ids("日") == [0, 7]
+    assert cal.dow_ids("全日") == list(range(14))
+    # 同じ期間なら作り直さない
+    assert calendar_index(START, START + datetime.timedelta(days=13)) is cal
+
+
+def test_calendar_weeks_and_months():
+    cal = CalendarIndex([START + datetime.timedelta(days=i) for i in range(14)])
+    # 週は日曜始まり、月は暦どおり
+    assert list(cal.weeks.values()) == [slice(0, 7), slice(7, 14)]
+    assert cal.months == {(2026, 4): slice(0, 5), (2026, 5): slice(5, 14)}
+
+    cal = CalendarIndex([datetime.date(2026, 4, 28) + datetime.timedelta(days=i) for i in range(6)])
+    assert list(cal.weeks.values()) == [slice(0, 5), slice(5, 6)]
+
+
+def test_calendar_year_prefix_for_long_periods():
+    cal = calendar_index(datetime.date(2026, 1, 1), datetime.date(2026, 12, 31))
+    assert cal.labels[0] == "1/1(木)"
+    cal = calendar_index(datetime.date(2026, 1, 1), datetime.date(2027, 1, 1))
+    assert cal.labels[0] == "2026/1/1(木)"
+    assert cal.labels[-1] == day_label(datetime.date(2027, 1, 1), with_year=True)
+    assert len(set(cal.labels)) == len(cal)
+    assert cal.day_index("2027/1/1(金)") == 365
+
+
+def test_calendar_holidays():
+    pytest.importorskip("jpholiday")
+    cal = calendar_index(START, START + datetime.timedelta(days=13))
+    assert cal.is_holiday("4/29(水)")
+    assert not cal.is_holiday("4/28(火)")
+    assert np.flatnonzero(cal.holiday).tolist() == [3, 7, 8, 9, 10]
+
+
+# --- StaffSettings ---
+
+
+def test_staff_settings_match_staff_df():
+    problem = small_problem(seed=1)
+    settings = build_staff_settings(problem)
+    assert list(settings) == problem.staffs
+    for _, row in problem.staff_df.iterrows():
+        s = settings[row["スタッフ名"]]
+        assert s.employment_type == row["雇用形態"]
+        assert [s.can_work(i) for i in range(len(problem.work_shifts))] == [bool(row[ws]) for ws in problem.work_shifts]
+        assert s.preferences == tuple(row[f"{ws}希望度"] for ws in problem.work_shifts)
+        assert s.prev_consecutive_work == row["シフト開始前の連勤数"]
+        assert s.prev_shift_type == row["シフト開始前の担務/休日"]
+        for h_i, h in enumerate(problem.weekly_holiday_targets):
+            assert s.week_target(h_i) == row[f"週の{h}日数"]
+            assert s.month_target(h_i) is None
+
+
+def test_staff_settings_defaults_and_duplicates():
+    problem = small_problem(seed=0)
+    problem.staff_df = pd.DataFrame({"スタッフ名": [" A ", "", "B"], "日勤": [True, True, False]})
+    settings = build_staff_settings(problem)
+    assert list(settings) == ["A", "B"]
+    # 列がなければ既定値（週1日・週単位・希望度「中」・前の連勤なし）
+    a = settings["A"]
+    assert a.can_work(0) and not a.can_work(1)
+    assert a.week_target(0) == 1 and a.month_target(0) is None
+    assert a.preferences == ("中",) * 3
+    assert a.prev_consecutive_work == 0 and a.prev_shift_type == ""
+
+    problem.staff_df = pd.DataFrame(
+        [
+            {"スタッフ名": "B", "日勤": False, "週の週休日数": "x", "週休日数対象": "", "月の週休日数": 3},
+            {"スタッフ名": "B", "日勤": True, "週の週休日数": "2.0", "週休日数対象": "月", "月の週休日数": 5},
+        ]
+    )
+    problem.compiled_staff = None
+    b = problem.staff_settings()["B"]
+    # 同じ名前は下の行が優先
+    assert b.can_work(0)
+    assert b.week_target(0) is None and b.month_target(0) == 5
+    # 読めない値・空欄は既定値
+    problem.staff_df = problem.staff_df.iloc[:1]
+    b = build_staff_settings(problem)["B"]
+    assert b.week_target(0) == 1 and b.month_target(0) is None
+    assert problem.staff_settings() is problem.staff_settings()
+
+
+# --- compile_rules ---
+
+
+def test_compile_rules_masks():
+    problem = small_problem(seed=1, extras=True)
+    masks = compile_rules(problem)
+    t = type_ids(problem)
+    holidays = [t[h] for h in problem.holiday_types]
+
+    # パートは日勤だけ（夜勤・早番は able の時点で外れる）
+    assert not masks.able[0, :, [t["夜勤"], t["早番"]]].any()
+    assert masks.able[0, :, t["日勤"]].all()
+    # 個別ルール: S001 は土曜固定で休み（全般）、S002 は月曜に夜勤不可
+    for d in day_ids(problem, "土"):
+        assert masks.allowed[1, d].nonzero()[0].tolist() == holidays
+        assert masks.fixed_labels[1, d] == "休み(全般)"
+    for d in day_ids(problem, "月"):
+        assert masks.able[2, d, t["夜勤"]] and not masks.allowed[2, d, t["夜勤"]]
+    # 共通ルール: 5/1 はパートが休むなら週休のみ（正社員はそのまま）
+    assert not masks.allowed[0, 5, [t["非番"], t["年休"]]].any()
+    assert masks.allowed[0, 5, t["週休"]]
+    assert masks.allowed[1, 5].all()
+    # 希望: 出勤（全般）のマスは休日を取れない
+    s, d = np.argwhere(masks.hope == "出勤(全般)")[0]
+    assert not masks.allowed[s, d, holidays].any()
+
+
+def test_compile_rules_date_rule_accepts_iso_and_label():
+    by_label = small_problem(seed=1, extras=True)
+    by_iso = small_problem(seed=1, extras=True)
+    by_iso.global_rules = [dict(by_iso.global_rules[0], value="2026-05-01")]
+    np.testing.assert_array_equal(compile_rules(by_label).allowed, compile_rules(by_iso).allowed)
+
+
+# --- check_capacity ---
+
+
+def test_check_capacity_passes_sample():
+    result = check_capacity(small_problem(seed=1, extras=True))
+    assert not result.infeasible and result.messages == []
+
+
+def test_check_capacity_single_shift():
+    problem = small_problem(seed=1)
+    problem.req_df.iloc[3, 1] = int(problem.rule_masks().allowed[:, 3, type_ids(problem)["夜勤"]].sum()) + 1
+    result = check_capacity(problem)
+    assert result.infeasible
+    assert result.messages == ["・4/29(水) の「夜勤」: 目標 5名 に対し、勤務可能なスタッフが 4名 しかいません。"]
+
+
+def test_check_capacity_counts_each_person_once_per_day():
+    problem = small_problem(seed=1)
+    t = type_ids(problem)
+    allowed = problem.rule_masks().allowed[:, 3]
+    # 日勤・夜勤それぞれには足りるが、合わせると人が足りない
+    problem.req_df.iloc[3] = [int(allowed[:, t["日勤"]].sum()), int(allowed[:, t["夜勤"]].sum()), 0]
+    result = check_capacity(problem)
+    assert result.infeasible
+    assert len(result.messages) == 1 and "「日勤・夜勤」" in result.messages[0]
+
+
+# --- repair_fixed_cells ---
+
+
+def test_repair_fixed_cells():
+    built = build_model(small_problem(seed=1))
+    codes = np.zeros((len(built.staffs), 14), dtype=np.int64)
+    assert repair_fixed_cells(built, codes).all()
+
+    # 使えなくなったマスを含む週は全員分を動かす
+    codes[0, 9] = -1
+    keep = repair_fixed_cells(built, codes)
+    assert keep[:, :7].all() and not keep[:, 7:].any()
+
+
+def test_repair_fixed_cells_scope():
+    built = build_model(small_problem(seed=1))
+    codes = np.zeros((len(built.staffs), 14), dtype=np.int64)
+    # 変わったスタッフは全日、変わった日はその週を動かす
+    keep = repair_fixed_cells(built, codes, {"staffs": ["S002"], "days": ["4/27(月)"]})
+    assert not keep[2].any()
+    assert not keep[:, :7].any()
+    assert np.delete(keep, 2, axis=0)[:, 7:].all()
+
+
+# --- SolutionStream ---
+
+
+def test_stop_message_none_for_proven_optimum():
+    problem = small_problem(seed=0)
+    built = build_model(problem)
+    stream = SolutionStream(problem, built, {"preset": "balanced"})
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = 8
+    status = solver.Solve(built.model, stream)
+    assert status == cp_model.OPTIMAL
+    assert solver.ObjectiveValue() == solver.BestObjectiveBound()
+    # ギャップ 0 で止めたことを打ち切りとは言わない
+    assert stream.stop_message(solver, status, 60.0) is None
+
+
+# --- diagnose_infeasibility ---
+
+
+def infeasible_problem():
+    # 全日出勤の希望では週の休日が取れない
+    problem = small_problem(seed=0)
+    problem.hope_df.loc["S001", :] = "出勤(全般)"
+    return problem
+
+
+def test_diagnose_infeasibility_finds_conflict():
+    reasons = diagnose_infeasibility(infeasible_problem())
+    assert reasons and any("S001" in r for r in reasons)
+
+
+def test_diagnose_infeasibility_stops_on_request():
+    # 中止済みのジョブは診断を続けない
+    stop_event = threading.Event()
+    stop_event.set()
+    assert diagnose_infeasibility(infeasible_problem(), stop_event=stop_event) == []
+
+
+def test_penalty_target_needs_soft_penalties(monkeypatch):
+    monkeypatch.setitem(SOLVER_PRESETS["quick"], "penalty_target", 0)
+    # 全て厳守のモデルでは違反ペナルティは常に 0 なので、ペナルティの目標では止めない
+    problem = small_problem(seed=0)
+    built = build_model(problem)
+    stream = SolutionStream(problem, built, {"preset": "quick"})
+    assert stream.penalty_target is None
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = 8
+    solver.Solve(built.model, stream)
+    assert stream.stop_reason != "penalty"
+
+    # できるだけNG のペアがあれば使う
+    problem = small_problem(seed=1, extras=True)
+    assert SolutionStream(problem, build_model(problem), {"preset": "quick"}).penalty_target == 0
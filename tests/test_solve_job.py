@@ -0,0 +1,19 @@
+import queue
+import threading
+
+from ortools.sat.python import cp_model
+
+from cases import small_problem
+from shift_model import DEFAULT_SOLVER_SETTINGS, build_model
+from solve_job import _solve_lexicographic
+
+
+def test_lexicographic_without_tiers():
+    # 重みのある項が1つもないときも、重み付きの1回の求解で解を返す
+    problem = small_problem(seed=0)
+    built = build_model(problem)
+    built.objective_terms = {}
+    settings = {**DEFAULT_SOLVER_SETTINGS, "objective_mode": "lexicographic"}
+    solver, status, _ = _solve_lexicographic(problem, built, settings, queue.Queue(), threading.Event())
+    assert status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    assert (built.vars.solution(solver).sum(axis=2) == 1).all()